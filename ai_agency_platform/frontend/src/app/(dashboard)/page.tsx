@@ -56,6 +56,7 @@ export default function Dashboard() {
     const [messages, setMessages] = useState<{ role: string, content: string }[]>([]);
     const [isLoading, setIsLoading] = useState(false);
     const [file, setFile] = useState<File | null>(null);
+    const [ingestStatus, setIngestStatus] = useState<string | null>(null);
 
     const handleRunAgency = async () => {
         if (!prompt || !selectedAgency) return;
@@ -65,10 +66,26 @@ export default function Dashboard() {
         setPrompt("");
 
         try {
-            const res = await api.agency.run(prompt, selectedAgency);
-            const data = res.data;
+            // Node completions are shown as they stream in, in one progress bubble
+            let data: any = null;
+            await api.agency.runStream(prompt, selectedAgency, (event, payload) => {
+                if (event === "node") {
+                    const line = `✓ ${payload.node}${payload.messages?.length ? `: ${payload.messages.join(" ")}` : ""}`;
+                    setMessages(prev => {
+                        const last = prev[prev.length - 1];
+                        if (last?.role === "progress") {
+                            return [...prev.slice(0, -1), { role: "progress", content: `${last.content}\n${line}` }];
+                        }
+                        return [...prev, { role: "progress", content: line }];
+                    });
+                } else if (event === "done") {
+                    data = payload;
+                } else if (event === "error") {
+                    data = { status: "error", ...payload };
+                }
+            });
 
-            if (data.status === "success") {
+            if (data?.status === "success") {
                 let outputMsg = "";
                 if (selectedAgency === "legal") {
                     const extractedOutput = extractBestTextResponse(data.output)
@@ -104,12 +121,39 @@ export default function Dashboard() {
 
     const handleUpload = async () => {
         if (!file) return;
+        let jobId: string;
         try {
-            await api.agency.ingest(file);
-            alert("Fileingested successfully!");
+            const response = await api.agency.ingest(file);
+            jobId = response.data.job_id;
             setFile(null);
         } catch (e) {
             alert("Upload failed");
+            return;
+        }
+
+        // Ingestion runs in the background: poll the job until it finishes
+        const filename = file.name;
+        setIngestStatus(`${filename}: queued`);
+        while (true) {
+            await new Promise(resolve => setTimeout(resolve, 1000));
+            let job: any;
+            try {
+                job = (await api.agency.ingestStatus(jobId)).data;
+            } catch (e) {
+                setIngestStatus(`${filename}: status unavailable`);
+                return;
+            }
+            if (job.status === "completed") {
+                const report = job.report || {};
+                setIngestStatus(`${filename}: indexed (${report.added ?? 0} new, ${report.unchanged ?? 0} unchanged chunks)`);
+                return;
+            }
+            if (job.status === "failed") {
+                setIngestStatus(`${filename}: failed (${job.error})`);
+                return;
+            }
+            const { chunks_indexed, chunks_total } = job.progress;
+            setIngestStatus(`${filename}: ${job.status}, ${chunks_indexed}/${chunks_total} chunks indexed`);
         }
     };
 
@@ -179,6 +223,7 @@ export default function Dashboard() {
                                 >
                                     <Upload className="w-5 h-5" />
                                 </button>
+                                {ingestStatus && <span className="text-sm text-gray-500">{ingestStatus}</span>}
                             </div>
                         )}
                     </div>
@@ -192,7 +237,7 @@ export default function Dashboard() {
                         )}
                         {messages.map((msg, idx) => (
                             <div key={idx} className={`flex ${msg.role === 'user' ? 'justify-end' : 'justify-start'}`}>
-                                <div className={`max-w-[80%] rounded-lg p-4 ${msg.role === 'user' ? 'bg-indigo-600 text-white' : 'bg-white shadow-sm border text-gray-800'}`}>
+                                <div className={`max-w-[80%] rounded-lg p-4 ${msg.role === 'user' ? 'bg-indigo-600 text-white' : msg.role === 'progress' ? 'bg-gray-50 border text-gray-500' : 'bg-white shadow-sm border text-gray-800'}`}>
                                     <pre className="whitespace-pre-wrap font-sans text-sm">{msg.content}</pre>
                                 </div>
                             </div>
@@ -36,14 +36,60 @@ export const api = {
         run: async (prompt: string, type: string) => {
             return pipelineApi.post('/run-agency', { prompt, agency_type: type });
         },
-        ingest: async (file: File) => {
+        // Server-sent events of /run-agency/stream: onEvent gets "run", "node" per
+        // completed node, then "done" (the /run-agency body) or "error".
+        // Aborting the signal disconnects, which cancels the run on the server.
+        runStream: async (
+            prompt: string,
+            type: string,
+            onEvent: (event: string, data: any) => void,
+            signal?: AbortSignal,
+        ) => {
+            const res = await fetch(`${PIPELINE_API_URL}/run-agency/stream`, {
+                method: 'POST',
+                headers: { 'Content-Type': 'application/json' },
+                body: JSON.stringify({ prompt, agency_type: type }),
+                signal,
+            });
+            if (!res.ok || !res.body) {
+                throw new Error(`Stream request failed: ${res.status}`);
+            }
+            const reader = res.body.getReader();
+            const decoder = new TextDecoder();
+            let buffer = '';
+            while (true) {
+                const { done, value } = await reader.read();
+                if (done) break;
+                buffer += decoder.decode(value, { stream: true });
+                let end;
+                while ((end = buffer.indexOf('\n\n')) >= 0) {
+                    const block = buffer.slice(0, end);
+                    buffer = buffer.slice(end + 2);
+                    let event = 'message';
+                    let data = '';
+                    for (const line of block.split('\n')) {
+                        if (line.startsWith('event: ')) event = line.slice(7);
+                        else if (line.startsWith('data: ')) data += line.slice(6);
+                    }
+                    onEvent(event, data ? JSON.parse(data) : null);
+                }
+            }
+        },
+        ingest: async (file: File, docType: string = 'document', tenant?: string) => {
             const formData = new FormData();
             formData.append('file', file);
+            formData.append('doc_type', docType);
+            if (tenant) {
+                formData.append('tenant', tenant);
+            }
             return pipelineApi.post('/ingest', formData, {
                 headers: {
                     'Content-Type': 'multipart/form-data',
                 },
             });
+        },
+        ingestStatus: async (jobId: string) => {
+            return pipelineApi.get(`/ingest/jobs/${jobId}`);
         }
     }
 };
@@ -0,0 +1,188 @@
+import functools
+import math
+import os
+import re
+from typing import Callable, Dict, List, Optional, Tuple
+
+from modules.legal.knowledge.embeddings import EMBEDDING_MODEL
+
+# Start of a clause/section heading at the beginning of a line, e.g. "1. Indemnification:",
+# "2.3 Term", "(a) ...", "Section 4", "ARTICLE IV".
+SECTION_PATTERN = re.compile(
+    r"(?m)^[ \t]*(?:(?:ARTICLE|Article|SECTION|Section)\s+[0-9IVXLC]+|\d+(?:\.\d+)*\.?|\([a-z0-9]{1,4}\)|[A-Z]\.)[ \t]+\S"
+)
+SENTENCE_END = re.compile(r"(?<=[.;:!?])\s+")
+WORD = re.compile(r"\S+")
+
+# Size of the fixed character windows the previous parser used; kept to report the baseline
+BASELINE_CHUNK_CHARS = 1000
+
+
+@functools.lru_cache(maxsize=4)
+def model_token_counter(model_name: str = EMBEDDING_MODEL) -> Callable[[str], int]:
+    """
+    Token counter for the embedding model's tokenizer, or a word-piece
+    estimate when the tokenizer cannot be loaded (e.g. offline).
+    """
+    try:
+        from transformers import AutoTokenizer
+        name = model_name if "/" in model_name else f"sentence-transformers/{model_name}"
+        tokenizer = AutoTokenizer.from_pretrained(name)
+        return lambda text: len(tokenizer.encode(text, add_special_tokens=False))
+    except Exception:
+        return estimate_tokens
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough word-piece count: one token per word/punctuation mark, plus one per 8 chars of long words."""
+    return sum(1 + len(word) // 8 for word in re.findall(r"\w+|[^\w\s]", text))
+
+
+class TokenChunker:
+    """
+    Splits text into chunks that fit the embedding model's token budget.
+
+    Text is first cut at clause/section headings, then (only when a clause is
+    too long) at sentence and finally word boundaries. Consecutive pieces are
+    packed greedily up to ``max_tokens``; a new chunk prefers to start at a
+    section heading, and chunks that continue mid-section repeat up to
+    ``overlap_tokens`` of trailing context from the previous chunk.
+    """
+
+    def __init__(self, max_tokens: int = None, overlap_tokens: int = None, count_tokens: Callable[[str], int] = None):
+        # all-MiniLM-L6-v2 truncates at 256 word-pieces including [CLS]/[SEP]
+        self.max_tokens = max_tokens or int(os.getenv("CHUNK_MAX_TOKENS", "240"))
+        self.overlap_tokens = overlap_tokens if overlap_tokens is not None else int(os.getenv("CHUNK_OVERLAP_TOKENS", "32"))
+        self.count_tokens = count_tokens or model_token_counter()
+
+    def split(self, text: str) -> List[Tuple[int, str, int]]:
+        """
+        Returns ``(start_offset, chunk_text, tokens)`` triples; every chunk is a slice of ``text``.
+        """
+        units = self._units(text)
+        chunks = []
+        current: List[Tuple[int, int, int, bool]] = []
+        current_tokens = 0
+
+        for unit in units:
+            start, end, tokens, is_section = unit
+            full = current_tokens + tokens > self.max_tokens
+            # Break early at a heading rather than splitting the next clause across chunks
+            early = is_section and current_tokens >= self.max_tokens // 2
+            if current and (full or early):
+                chunks.append(current)
+                current = [] if is_section else self._overlap(current)
+                current_tokens = sum(u[2] for u in current)
+                while current and current_tokens + tokens > self.max_tokens:
+                    current_tokens -= current.pop(0)[2]
+            current.append(unit)
+            current_tokens += tokens
+
+        if current:
+            chunks.append(current)
+
+        result = []
+        for c in chunks:
+            chunk_text = text[c[0][0]:c[-1][1]].strip()
+            if chunk_text:
+                result.append((c[0][0], chunk_text, sum(u[2] for u in c)))
+        return result
+
+    def _overlap(self, units: List[Tuple[int, int, int, bool]]) -> List[Tuple[int, int, int, bool]]:
+        carried = []
+        tokens = 0
+        for unit in reversed(units):
+            if tokens + unit[2] > self.overlap_tokens:
+                break
+            carried.insert(0, unit)
+            tokens += unit[2]
+        return carried
+
+    def _units(self, text: str) -> List[Tuple[int, int, int, bool]]:
+        """
+        ``(start, end, tokens, starts_section)`` spans, each within the token budget.
+        """
+        bounds = [m.start() for m in SECTION_PATTERN.finditer(text)]
+        if not bounds or bounds[0] != 0:
+            bounds.insert(0, 0)
+        bounds.append(len(text))
+
+        units = []
+        for start, end in zip(bounds, bounds[1:]):
+            if not text[start:end].strip():
+                continue
+            tokens = self.count_tokens(text[start:end])
+            if tokens <= self.max_tokens:
+                units.append((start, end, tokens, True))
+            else:
+                pieces = self._split_long(text, start, end)
+                units.extend((s, e, t, i == 0) for i, (s, e, t) in enumerate(pieces))
+        return units
+
+    def _split_long(self, text: str, start: int, end: int) -> List[Tuple[int, int, int]]:
+        pieces = []
+        cursor = start
+        for match in list(SENTENCE_END.finditer(text, start, end)) + [None]:
+            stop = match.end() if match else end
+            if stop <= cursor:
+                continue
+            tokens = self.count_tokens(text[cursor:stop])
+            if tokens <= self.max_tokens:
+                pieces.append((cursor, stop, tokens))
+            else:
+                pieces.extend(self._split_words(text, cursor, stop))
+            cursor = stop
+        return pieces
+
+    def _split_words(self, text: str, start: int, end: int) -> List[Tuple[int, int, int]]:
+        pieces = []
+        piece_start, piece_tokens, last_end = start, 0, start
+        for match in WORD.finditer(text, start, end):
+            tokens = self.count_tokens(match.group())
+            if piece_tokens and piece_tokens + tokens > self.max_tokens:
+                pieces.append((piece_start, last_end, piece_tokens))
+                piece_start, piece_tokens = match.start(), 0
+            piece_tokens += tokens
+            last_end = match.end()
+        if piece_tokens:
+            pieces.append((piece_start, end, piece_tokens))
+        return pieces
+
+    @staticmethod
+    def stats(text_length: int, chunk_tokens: List[int], baseline_chunks: Optional[int] = None, model_limit: int = 256) -> Dict:
+        """
+        Compares the chunking of a text of ``text_length`` characters with the
+        previous fixed-size slicing (or ``baseline_chunks`` equal parts, e.g.
+        one per PDF page). Only the length is needed, so streamed documents
+        never have to be held in memory as a whole.
+
+        ``baseline_truncated_tokens`` estimates how many tokens the old chunks
+        carried past the model's limit, i.e. text that was never searchable.
+        """
+        tokens = sum(chunk_tokens)
+        tokens_per_char = tokens / text_length if text_length else 0.0
+        if baseline_chunks is None:
+            sizes = [min(BASELINE_CHUNK_CHARS, text_length - i) for i in range(0, text_length, BASELINE_CHUNK_CHARS)]
+        else:
+            sizes = [text_length / baseline_chunks] * baseline_chunks if baseline_chunks else []
+        truncated = sum(max(0.0, size * tokens_per_char - model_limit) for size in sizes)
+        return {
+            "chunks": len(chunk_tokens),
+            "baseline_chunks": len(sizes),
+            "chunk_reduction": len(sizes) - len(chunk_tokens),
+            "tokens": tokens,
+            "baseline_truncated_tokens": int(math.ceil(truncated)),
+        }
+
+
+def with_embedding_savings(chunk_stats: Dict, engine_stats: Dict) -> Dict:
+    """
+    Adds the estimated embedding time saved by the chunk-count reduction,
+    using the engine's measured encode time per text (negative if chunking
+    produced more chunks than the old fixed-size slicing).
+    """
+    if not chunk_stats:
+        return chunk_stats
+    stats = dict(chunk_stats)
+    stats["embedding_ms_saved"] = round(stats["chunk_reduction"] * engine_stats.get("encode_ms_per_text", 0.0), 2)
+    return stats
@@ -0,0 +1,103 @@
+import argparse
+import hashlib
+import json
+import os
+import re
+import sys
+import zlib
+from typing import List, Optional
+
+import numpy as np
+
+# Allow running as a script from the platform root
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", ".."))
+
+# Hash functions per signature, split into LSH bands of BAND_ROWS values each.
+# Two chunks share a bucket in some band with probability 1 - (1 - J^8)^16
+# for Jaccard similarity J: ~1.0 at J=0.9, ~0.5 at J=0.7, ~0.02 at J=0.4
+NUM_PERM = 128
+BAND_ROWS = 8
+BANDS = NUM_PERM // BAND_ROWS
+# Words per shingle
+SHINGLE_SIZE = 5
+
+# Largest prime below 2**32: permuted hashes of 32-bit shingle hashes stay in uint32
+_PRIME = np.uint64(4294967291)
+_rng = np.random.default_rng(0x5EED)
+# Fixed seed: signatures are persisted and must be comparable across processes
+_A = _rng.integers(1, int(_PRIME), size=NUM_PERM, dtype=np.uint64)
+_B = _rng.integers(0, int(_PRIME), size=NUM_PERM, dtype=np.uint64)
+
+_WORD = re.compile(r"\w+")
+
+
+def shingle_hashes(text: str, size: int = SHINGLE_SIZE) -> np.ndarray:
+    """
+    Stable 32-bit hashes of the word ``size``-grams of ``text`` (case and
+    punctuation ignored); texts shorter than ``size`` words are one shingle.
+    """
+    words = _WORD.findall(text.lower())
+    if not words:
+        return np.zeros(0, dtype=np.uint64)
+    count = max(len(words) - size + 1, 1)
+    return np.fromiter(
+        (zlib.crc32(" ".join(words[i:i + size]).encode()) for i in range(count)), dtype=np.uint64, count=count
+    )
+
+
+def minhash(text: str) -> Optional[np.ndarray]:
+    """
+    MinHash signature (NUM_PERM uint32 values) of the text's shingle set, or
+    None for text without words. The fraction of equal positions between two
+    signatures estimates the Jaccard similarity of the shingle sets.
+    """
+    hashes = shingle_hashes(text)
+    if len(hashes) == 0:
+        return None
+    # (a * x + b) mod p never overflows: x, a, b < 2**32
+    permuted = (hashes[:, None] * _A + _B) % _PRIME
+    return permuted.min(axis=0).astype(np.uint32)
+
+
+def band_buckets(signature: np.ndarray, partition: str) -> List[int]:
+    """
+    One LSH bucket key per band, as signed 64-bit integers (SQLite INTEGER).
+    Keys include the partition, so chunks only ever collide within it.
+    """
+    prefix = partition.encode()
+    buckets = []
+    for band in range(BANDS):
+        h = hashlib.blake2b(signature[band * BAND_ROWS:(band + 1) * BAND_ROWS].tobytes(), digest_size=8)
+        h.update(prefix + bytes([band]))
+        buckets.append(int.from_bytes(h.digest(), "little", signed=True))
+    return buckets
+
+
+def similarity(a: np.ndarray, b: np.ndarray) -> float:
+    """Estimated Jaccard similarity of two signatures."""
+    return float(np.count_nonzero(a == b)) / len(a)
+
+
+def main(argv: List[str] = None):
+    from modules.legal.knowledge.index import MemmapIndex
+
+    parser = argparse.ArgumentParser(
+        description="Collapse near-duplicate chunks of a collection and report how much the index shrank."
+    )
+    parser.add_argument("path", help="Collection directory (e.g. data/vector_store/legal_knowledge)")
+    parser.add_argument("--threshold", type=float, default=0.9, help="Estimated Jaccard similarity to collapse at")
+    args = parser.parse_args(argv)
+
+    before = MemmapIndex(args.path)
+    live = before.count
+    before.close()
+    # Opening with a threshold signs (and collapses) the rows that have no signature yet
+    index = MemmapIndex(args.path, dedup_threshold=args.threshold)
+    report = dict(index.dedup_stats(), rows_before=live)
+    print(json.dumps(report, indent=2))
+    index.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,204 @@
+import argparse
+import json
+import os
+import re
+import sqlite3
+import sys
+import time
+import zlib
+from typing import Callable, Dict, List
+
+import numpy as np
+
+# Allow running as a script from the platform root
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", ".."))
+
+# Which runtime computes embeddings: "sentence-transformers" (torch), "onnx"
+# (onnxruntime, int8-quantized weights by default, no torch) or "hashing"
+# (feature hashing: deterministic, no model download, lexical similarity only)
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "sentence-transformers")
+# ONNX weights inside the model repository; the int8 export runs on any AVX2 CPU
+EMBEDDING_ONNX_FILE = os.getenv("EMBEDDING_ONNX_FILE", "onnx/model_quint8_avx2.onnx")
+# Local directory holding tokenizer.json and the ONNX file (skips the hub download)
+EMBEDDING_ONNX_PATH = os.getenv("EMBEDDING_ONNX_PATH", "")
+# Dimensions of the hashing embedder (384 matches all-MiniLM-L6-v2)
+EMBEDDING_HASH_DIM = int(os.getenv("EMBEDDING_HASH_DIM", "384"))
+
+
+def _repo_id(model_name: str) -> str:
+    return model_name if "/" in model_name else f"sentence-transformers/{model_name}"
+
+
+def sentence_transformers_backend(model_name: str) -> Callable[[List[str]], np.ndarray]:
+    """The reference runtime: the full torch model via sentence-transformers."""
+    from sentence_transformers import SentenceTransformer
+    model = SentenceTransformer(model_name)
+    return lambda texts: model.encode(texts, batch_size=len(texts), convert_to_numpy=True, normalize_embeddings=True)
+
+
+def onnx_backend(model_name: str, max_tokens: int = 256) -> Callable[[List[str]], np.ndarray]:
+    """
+    The same model on onnxruntime with the fast tokenizer: mean pooling over
+    the attention mask and L2 normalization, as sentence-transformers does.
+    Needs only ``onnxruntime`` and ``tokenizers`` (no torch).
+    """
+    import onnxruntime
+    from tokenizers import Tokenizer
+
+    if EMBEDDING_ONNX_PATH:
+        tokenizer_file = os.path.join(EMBEDDING_ONNX_PATH, "tokenizer.json")
+        model_file = os.path.join(EMBEDDING_ONNX_PATH, os.path.basename(EMBEDDING_ONNX_FILE))
+    else:
+        from huggingface_hub import hf_hub_download
+        tokenizer_file = hf_hub_download(_repo_id(model_name), "tokenizer.json")
+        model_file = hf_hub_download(_repo_id(model_name), EMBEDDING_ONNX_FILE)
+
+    tokenizer = Tokenizer.from_file(tokenizer_file)
+    tokenizer.enable_truncation(max_length=max_tokens)
+    tokenizer.enable_padding()
+    options = onnxruntime.SessionOptions()
+    options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+    session = onnxruntime.InferenceSession(model_file, options, providers=["CPUExecutionProvider"])
+    inputs = {i.name for i in session.get_inputs()}
+
+    def encode(texts: List[str]) -> np.ndarray:
+        encodings = tokenizer.encode_batch(texts)
+        feed = {
+            "input_ids": np.array([e.ids for e in encodings], dtype=np.int64),
+            "attention_mask": np.array([e.attention_mask for e in encodings], dtype=np.int64),
+            "token_type_ids": np.array([e.type_ids for e in encodings], dtype=np.int64),
+        }
+        hidden = session.run(None, {name: value for name, value in feed.items() if name in inputs})[0]
+        mask = feed["attention_mask"][:, :, None].astype(np.float32)
+        pooled = (hidden * mask).sum(axis=1) / np.maximum(mask.sum(axis=1), 1e-9)
+        return pooled / np.maximum(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12)
+
+    return encode
+
+
+_TOKEN = re.compile(r"\w+")
+
+
+class HashingEmbedder:
+    """
+    Deterministic feature-hashing embedder: word unigrams and bigrams are
+    hashed into ``dim`` signed buckets, weighted by log term frequency and
+    L2-normalized. Nothing is downloaded and vectors are identical across
+    processes and machines, which suits tests and offline environments.
+    Similarity is lexical overlap, not meaning.
+    """
+
+    def __init__(self, dim: int = None):
+        self.dim = dim or EMBEDDING_HASH_DIM
+
+    def __call__(self, texts: List[str]) -> np.ndarray:
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for i, text in enumerate(texts):
+            words = _TOKEN.findall(text.lower())
+            features = words + [a + " " + b for a, b in zip(words, words[1:])]
+            if not features:
+                continue
+            hashes = np.fromiter((zlib.crc32(f.encode()) for f in features), dtype=np.uint32, count=len(features))
+            # Bucket from the low bits, sign from the top bit, so collisions cancel out on average
+            buckets = (hashes % self.dim).astype(np.int64)
+            signs = np.where(hashes >> 31, -1.0, 1.0).astype(np.float32)
+            np.add.at(vectors[i], buckets, signs)
+        # Sublinear term frequency keeps repeated boilerplate words from dominating
+        vectors = np.sign(vectors) * np.log1p(np.abs(vectors))
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return vectors / norms
+
+
+def hashing_backend(model_name: str) -> Callable[[List[str]], np.ndarray]:
+    return HashingEmbedder()
+
+
+# Backend name -> factory(model_name) returning an encode function
+BACKENDS: Dict[str, Callable[[str], Callable[[List[str]], np.ndarray]]] = {
+    "sentence-transformers": sentence_transformers_backend,
+    "onnx": onnx_backend,
+    "hashing": hashing_backend,
+}
+
+
+def load_backend(name: str, model_name: str) -> Callable[[List[str]], np.ndarray]:
+    """
+    Encode function (texts -> L2-normalized float32 matrix) of backend ``name``.
+    """
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown embedding backend: {name} (expected one of {', '.join(BACKENDS)})")
+    return BACKENDS[name](model_name)
+
+
+def _load_texts(path: str, limit: int) -> List[str]:
+    """Chunk texts of a collection directory, or the non-empty lines of a text file."""
+    if os.path.isdir(path):
+        from modules.legal.knowledge.index import MemmapIndex
+        db = sqlite3.connect(os.path.join(path, MemmapIndex.META_FILE))
+        texts = [r[0] for r in db.execute("SELECT document FROM chunks WHERE document != '' ORDER BY row LIMIT ?", (limit,))]
+        db.close()
+        return texts
+    with open(path, encoding="utf-8") as f:
+        return [line.strip() for line in f if line.strip()][:limit]
+
+
+def benchmark(texts: List[str], backends: List[str], model_name: str, reference: str, k: int = 10, queries: int = 100, batch_size: int = 64) -> Dict:
+    """
+    Throughput of each backend over ``texts``, and its recall@k against
+    ``reference``: the first ``queries`` texts search the rest, and recall is
+    the overlap of each backend's top k with the reference's top k.
+    """
+    report, neighbours = {}, {}
+    for name in backends:
+        try:
+            started = time.perf_counter()
+            encode = load_backend(name, model_name)
+            load_s = time.perf_counter() - started
+            encode(texts[:1])
+            started = time.perf_counter()
+            vectors = np.vstack([encode(texts[i:i + batch_size]) for i in range(0, len(texts), batch_size)])
+            elapsed = time.perf_counter() - started
+        except Exception as e:
+            report[name] = {"error": f"{type(e).__name__}: {e}"}
+            continue
+        vectors = np.asarray(vectors, dtype=np.float32)
+        scores = vectors[:queries] @ vectors[queries:].T
+        neighbours[name] = np.argsort(-scores, axis=1)[:, :k]
+        report[name] = {
+            "dim": int(vectors.shape[1]),
+            "load_s": round(load_s, 2),
+            "texts_per_sec": round(len(texts) / elapsed, 1) if elapsed else None,
+            "ms_per_text": round(elapsed * 1000 / len(texts), 3),
+        }
+    if reference in neighbours:
+        for name, found in neighbours.items():
+            expected = neighbours[reference]
+            recall = np.mean([len(set(a) & set(b)) / len(b) for a, b in zip(found, expected)])
+            report[name][f"recall_at_{k}_vs_{reference}"] = round(float(recall), 4)
+    return report
+
+
+def main(argv: List[str] = None):
+    from modules.legal.knowledge.embeddings import EMBEDDING_MODEL
+
+    parser = argparse.ArgumentParser(description="Compare embedding backends for throughput and retrieval recall.")
+    parser.add_argument("path", help="Collection directory (e.g. data/vector_store/legal_knowledge) or a text file, one passage per line")
+    parser.add_argument("--backends", nargs="+", choices=list(BACKENDS), default=list(BACKENDS))
+    parser.add_argument("--reference", choices=list(BACKENDS), default="sentence-transformers")
+    parser.add_argument("--model", default=EMBEDDING_MODEL)
+    parser.add_argument("--limit", type=int, default=2000, help="Texts embedded per backend")
+    parser.add_argument("--queries", type=int, default=100, help="Texts used as queries against the rest")
+    parser.add_argument("--k", type=int, default=10)
+    args = parser.parse_args(argv)
+
+    texts = _load_texts(args.path, args.limit)
+    if len(texts) <= args.queries:
+        parser.error(f"need more than --queries ({args.queries}) texts, found {len(texts)}")
+    report = benchmark(texts, args.backends, args.model, args.reference, k=args.k, queries=args.queries)
+    print(json.dumps({"texts": len(texts), "backends": report}, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,193 @@
+import fcntl
+import hashlib
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Dict, Optional, Sequence
+
+import numpy as np
+
+
+def content_digest(text: str, model_name: str = "") -> str:
+    """
+    Stable digest of a chunk's text (and optionally the model that embeds it).
+    Unlike ``hash()``, this is identical across processes and restarts.
+    """
+    h = hashlib.blake2b(digest_size=16)
+    h.update(model_name.encode("utf-8"))
+    h.update(b"\0")
+    h.update(text.encode("utf-8"))
+    return h.hexdigest()
+
+
+class EmbeddingCache:
+    """
+    Persistent, content-addressed embedding cache with LRU eviction.
+
+    Vectors are stored as float16 rows in a memory-mapped slot file
+    (``vectors.f16``); ``keys.sqlite`` maps each digest to its slot together
+    with a last-used tick, so LRU order survives restarts.
+
+    Several processes may share the directory (the API service and the bulk
+    CLI both use the default one): slots are looked up in and allocated from
+    ``keys.sqlite`` only, under an flock on ``cache.lock`` that writes take
+    exclusively and reads shared, so no two keys ever get the same slot.
+    """
+
+    VECTORS_FILE = "vectors.f16"
+    KEYS_FILE = "keys.sqlite"
+    LOCK_FILE = "cache.lock"
+
+    def __init__(self, path: str, capacity: int = 500_000):
+        self.path = path
+        self.capacity = capacity
+        os.makedirs(path, exist_ok=True)
+        self._lock = threading.Lock()
+        self._lock_file = open(os.path.join(path, self.LOCK_FILE), "a+")
+
+        self._db = sqlite3.connect(os.path.join(path, self.KEYS_FILE), check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        with self._locked(fcntl.LOCK_EX):
+            self._db.execute("CREATE TABLE IF NOT EXISTS info (key TEXT PRIMARY KEY, value TEXT)")
+            self._db.execute("CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, slot INTEGER, used INTEGER)")
+            self._db.execute("CREATE INDEX IF NOT EXISTS entries_used ON entries (used)")
+            self._db.commit()
+
+        self.dim: Optional[int] = None
+        self._vectors: Optional[np.memmap] = None
+        # Hits since the last write, least recent first; their ticks are persisted with the next write
+        self._touched: "OrderedDict[str, None]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    @contextmanager
+    def _locked(self, operation: int):
+        """The in-process lock plus an flock on LOCK_FILE (LOCK_SH or LOCK_EX)."""
+        with self._lock:
+            fcntl.flock(self._lock_file, operation)
+            try:
+                yield
+            finally:
+                fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+
+    def _map(self):
+        """Maps the slot file once the dimension is known (possibly set by another process). Caller holds the lock."""
+        if self._vectors is not None:
+            return
+        if self.dim is None:
+            row = self._db.execute("SELECT value FROM info WHERE key = 'dim'").fetchone()
+            if row is None:
+                return
+            self.dim = int(row[0])
+        file_path = os.path.join(self.path, self.VECTORS_FILE)
+        size = self.capacity * self.dim * 2
+        with open(file_path, "ab") as f:
+            if f.tell() < size:
+                f.truncate(size)
+        self._vectors = np.memmap(file_path, dtype=np.float16, mode="r+", shape=(self.capacity, self.dim))
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+
+    def get_many(self, keys: Sequence[str]) -> Dict[str, np.ndarray]:
+        """
+        Returns cached vectors for the keys that are present.
+        """
+        found = {}
+        with self._locked(fcntl.LOCK_SH):
+            self._map()
+            slots = self._lookup(keys) if self._vectors is not None else {}
+            for key in keys:
+                slot = slots.get(key)
+                if slot is None:
+                    self.misses += 1
+                    continue
+                self.hits += 1
+                self._touched[key] = None
+                self._touched.move_to_end(key)
+                found[key] = np.asarray(self._vectors[slot], dtype=np.float32)
+        return found
+
+    def put_many(self, keys: Sequence[str], vectors: np.ndarray):
+        """
+        Stores vectors, evicting least recently used entries when full.
+        """
+        if len(keys) == 0:
+            return
+        vectors = np.asarray(vectors, dtype=np.float32)
+        with self._locked(fcntl.LOCK_EX):
+            self._map()
+            if self.dim is None:
+                self.dim = int(vectors.shape[1])
+                self._db.execute("INSERT OR REPLACE INTO info (key, value) VALUES ('dim', ?)", (str(self.dim),))
+                self._map()
+            elif vectors.shape[1] != self.dim:
+                return
+
+            # Hit order first, so entries read since the last write are not the ones evicted
+            self._flush_touched()
+            batch = dict(zip(keys, vectors))
+            slots = self._lookup(list(batch))
+            new_keys = [key for key in batch if key not in slots][:self.capacity]
+            used = self._db.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+            # Eviction reuses the victim's slot, so slots 0..used-1 are taken and the next free one is `used`
+            free = list(range(used, min(self.capacity, used + len(new_keys))))
+            evicted = []
+            if len(new_keys) > len(free):
+                for old_key, slot in self._db.execute(
+                    "SELECT key, slot FROM entries ORDER BY used LIMIT ?", (len(new_keys) - len(free) + len(slots),)
+                ):
+                    if old_key not in batch and len(free) < len(new_keys):
+                        evicted.append((old_key,))
+                        free.append(slot)
+            slots.update(zip(new_keys, free))
+
+            tick = self._db.execute("SELECT COALESCE(MAX(used), 0) FROM entries").fetchone()[0]
+            rows = []
+            for key, vector in batch.items():
+                if key not in slots:
+                    continue
+                tick += 1
+                self._vectors[slots[key]] = vector
+                rows.append((key, slots[key], tick))
+
+            self._vectors.flush()
+            self._db.executemany("DELETE FROM entries WHERE key = ?", evicted)
+            self._db.executemany("INSERT OR REPLACE INTO entries (key, slot, used) VALUES (?, ?, ?)", rows)
+            self._db.commit()
+
+    def _lookup(self, keys: Sequence[str]) -> Dict[str, int]:
+        """Slots of the cached keys among ``keys``. Caller holds the lock."""
+        slots = {}
+        unique = list(dict.fromkeys(keys))
+        for start in range(0, len(unique), 500):
+            batch = unique[start:start + 500]
+            slots.update(self._db.execute(
+                f"SELECT key, slot FROM entries WHERE key IN ({','.join('?' * len(batch))})", batch
+            ).fetchall())
+        return slots
+
+    def _flush_touched(self):
+        # Hits only update the in-memory order; persist them as the newest ticks alongside the next write
+        tick = self._db.execute("SELECT COALESCE(MAX(used), 0) FROM entries").fetchone()[0]
+        self._db.executemany(
+            "UPDATE entries SET used = ? WHERE key = ?",
+            [(tick + i, key) for i, key in enumerate(self._touched, 1)],
+        )
+        self._touched.clear()
+
+    def stats(self) -> Dict:
+        entries = len(self)
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": entries,
+                "capacity": self.capacity,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 3) if total else 0.0,
+            }
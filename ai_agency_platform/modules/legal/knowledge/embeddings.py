@@ -0,0 +1,288 @@
+import asyncio
+import itertools
+import os
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Sequence
+
+import numpy as np
+
+from modules.legal.knowledge.embedding_backends import EMBEDDING_BACKEND, load_backend
+from modules.legal.knowledge.embedding_cache import EmbeddingCache, content_digest
+
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "all-MiniLM-L6-v2")
+
+# Request priorities: interactive queries are always batched ahead of bulk ingestion
+PRIORITY_QUERY = 0
+PRIORITY_INGEST = 1
+
+
+def model_key(backend: str, model_name: str) -> str:
+    """
+    Identifies the vectors a backend/model pair produces (embedding cache keys):
+    backends other than the reference one get their own namespace.
+    """
+    return model_name if backend == "sentence-transformers" else f"{backend}:{model_name}"
+
+
+class _Request:
+    __slots__ = ("texts", "future", "enqueued_at")
+
+    def __init__(self, texts: List[str]):
+        self.texts = texts
+        self.future: Future = Future()
+        self.enqueued_at = time.perf_counter()
+
+
+class EmbeddingEngine:
+    """
+    Process-wide embedding engine.
+
+    Concurrent ``embed``/``aembed`` calls are queued and coalesced into
+    micro-batches by a dispatcher thread, then encoded on a bounded thread
+    pool. While every worker is busy, new requests keep accumulating, so
+    batches grow with load instead of each caller paying for its own forward
+    pass. The model is loaded once, on first use, by ``backend`` (see
+    embedding_backends.BACKENDS; default EMBEDDING_BACKEND).
+
+    With a ``cache``, texts whose (model, content) digest has been embedded
+    before are served from it and never reach the model; repeated texts
+    within one call are embedded once.
+    """
+
+    def __init__(
+        self,
+        model_name: str = EMBEDDING_MODEL,
+        max_batch_size: int = 64,
+        max_workers: int = 2,
+        max_wait_ms: float = 0.0,
+        encode_fn: Optional[Callable[[List[str]], np.ndarray]] = None,
+        cache: Optional[EmbeddingCache] = None,
+        backend: str = None,
+    ):
+        self.model_name = model_name
+        self.backend = backend or EMBEDDING_BACKEND
+        self.cache = cache
+        self.max_batch_size = max_batch_size
+        self.max_workers = max_workers
+        self.max_wait = max_wait_ms / 1000.0
+        self._encode_fn = encode_fn
+        self._load_lock = threading.Lock()
+
+        self._queue: "queue.PriorityQueue" = queue.PriorityQueue()
+        self._sequence = itertools.count()
+        self._slots = threading.Semaphore(max_workers)
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="embed")
+        self._dispatcher: Optional[threading.Thread] = None
+        self._start_lock = threading.Lock()
+
+        self._stats_lock = threading.Lock()
+        self._batches = 0
+        self._texts = 0
+        self._batch_sizes = deque(maxlen=2048)
+        self._encode_ms = deque(maxlen=2048)
+        self._request_ms = deque(maxlen=2048)
+
+    # ------------------------------------------------------------------ #
+    # Public API
+    # ------------------------------------------------------------------ #
+
+    def __call__(self, texts: Sequence[str]) -> np.ndarray:
+        return self.embed(texts)
+
+    def embed(self, texts: Sequence[str], priority: int = PRIORITY_QUERY) -> np.ndarray:
+        """
+        Embeds texts, blocking the calling thread until the result is ready.
+        """
+        texts = list(texts)
+        cached, missing = self._lookup(texts)
+        futures = self._submit(missing, priority)
+        return self._merge(texts, cached, missing, self._gather([f.result() for f in futures]))
+
+    async def aembed(self, texts: Sequence[str], priority: int = PRIORITY_QUERY) -> np.ndarray:
+        """
+        Embeds texts without blocking the event loop.
+        """
+        texts = list(texts)
+        cached, missing = self._lookup(texts)
+        futures = self._submit(missing, priority)
+        parts = await asyncio.gather(*(asyncio.wrap_future(f) for f in futures))
+        # Cache writes touch disk, so keep them off the event loop
+        return await asyncio.to_thread(self._merge, texts, cached, missing, self._gather(parts))
+
+    def warm_up(self):
+        """Loads the model eagerly so the first request does not pay for it."""
+        self._encoder()(["warm up"])
+
+    def stats(self) -> Dict:
+        """
+        Batch-size and latency figures over the most recent requests.
+        """
+        with self._stats_lock:
+            batch_sizes = list(self._batch_sizes)
+            encode_ms = list(self._encode_ms)
+            request_ms = list(self._request_ms)
+            return {
+                "model": self.model_name,
+                "backend": self.backend,
+                "batches": self._batches,
+                "texts": self._texts,
+                "queue_depth": self._queue.qsize(),
+                "mean_batch_size": round(float(np.mean(batch_sizes)), 2) if batch_sizes else 0.0,
+                "max_batch_size": max(batch_sizes) if batch_sizes else 0,
+                "encode_ms": _percentiles(encode_ms),
+                "encode_ms_per_text": round(sum(encode_ms) / sum(batch_sizes), 3) if batch_sizes else 0.0,
+                "request_ms": _percentiles(request_ms),
+                "cache": self.cache.stats() if self.cache is not None else None,
+            }
+
+    # ------------------------------------------------------------------ #
+    # Internals
+    # ------------------------------------------------------------------ #
+
+    @property
+    def model_key(self) -> str:
+        return model_key(self.backend, self.model_name)
+
+    def _encoder(self) -> Callable[[List[str]], np.ndarray]:
+        if self._encode_fn is None:
+            with self._load_lock:
+                if self._encode_fn is None:
+                    print(f"[EmbeddingEngine] Loading model: {self.model_name} ({self.backend})")
+                    self._encode_fn = load_backend(self.backend, self.model_name)
+        return self._encode_fn
+
+    def _lookup(self, texts: List[str]):
+        """
+        Splits texts into cached vectors (by text) and the unique texts still to embed.
+        """
+        unique = list(dict.fromkeys(texts))
+        if self.cache is None:
+            return {}, unique
+        keys = {text: content_digest(text, self.model_key) for text in unique}
+        found = self.cache.get_many(list(keys.values()))
+        cached = {text: found[key] for text, key in keys.items() if key in found}
+        return cached, [text for text in unique if text not in cached]
+
+    def _merge(self, texts: List[str], cached: Dict[str, np.ndarray], missing: List[str], vectors: np.ndarray) -> np.ndarray:
+        if missing and self.cache is not None:
+            self.cache.put_many([content_digest(text, self.model_key) for text in missing], vectors)
+        by_text = dict(cached)
+        by_text.update(zip(missing, vectors))
+        if not texts:
+            return np.zeros((0, 0), dtype=np.float32)
+        return np.vstack([by_text[text] for text in texts]).astype(np.float32, copy=False)
+
+    def _submit(self, texts: Sequence[str], priority: int) -> List[Future]:
+        self._ensure_dispatcher()
+        texts = list(texts)
+        futures = []
+        # Large calls are split so a pending query never waits behind more than one batch
+        for start in range(0, len(texts), self.max_batch_size):
+            request = _Request(texts[start:start + self.max_batch_size])
+            self._queue.put((priority, next(self._sequence), request))
+            futures.append(request.future)
+        return futures
+
+    @staticmethod
+    def _gather(parts: List[np.ndarray]) -> np.ndarray:
+        if not parts:
+            return np.zeros((0, 0), dtype=np.float32)
+        return np.vstack(parts).astype(np.float32, copy=False)
+
+    def _ensure_dispatcher(self):
+        if self._dispatcher is not None:
+            return
+        with self._start_lock:
+            if self._dispatcher is None:
+                self._dispatcher = threading.Thread(target=self._dispatch_loop, name="embed-dispatcher", daemon=True)
+                self._dispatcher.start()
+
+    def _dispatch_loop(self):
+        carry = None
+        while True:
+            # Wait for a free worker first; requests queue up (and batch) meanwhile
+            self._slots.acquire()
+            first = carry if carry is not None else self._queue.get()
+            carry = None
+            batch = [first[2]]
+            size = len(first[2].texts)
+            deadline = time.perf_counter() + self.max_wait
+
+            while size < self.max_batch_size:
+                try:
+                    timeout = deadline - time.perf_counter()
+                    item = self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if size + len(item[2].texts) > self.max_batch_size:
+                    carry = item
+                    break
+                batch.append(item[2])
+                size += len(item[2].texts)
+
+            self._pool.submit(self._run_batch, batch)
+
+    def _run_batch(self, batch: List[_Request]):
+        try:
+            texts = [text for request in batch for text in request.texts]
+            started = time.perf_counter()
+            vectors = np.asarray(self._encoder()(texts), dtype=np.float32)
+            finished = time.perf_counter()
+
+            offset = 0
+            for request in batch:
+                request.future.set_result(vectors[offset:offset + len(request.texts)])
+                offset += len(request.texts)
+
+            with self._stats_lock:
+                self._batches += 1
+                self._texts += len(texts)
+                self._batch_sizes.append(len(texts))
+                self._encode_ms.append((finished - started) * 1000)
+                for request in batch:
+                    self._request_ms.append((finished - request.enqueued_at) * 1000)
+        except Exception as e:
+            for request in batch:
+                if not request.future.done():
+                    request.future.set_exception(e)
+        finally:
+            self._slots.release()
+
+
+def _percentiles(samples: List[float]) -> Dict[str, float]:
+    if not samples:
+        return {"p50": 0.0, "p99": 0.0}
+    return {
+        "p50": round(float(np.percentile(samples, 50)), 2),
+        "p99": round(float(np.percentile(samples, 99)), 2),
+    }
+
+
+_engine: Optional[EmbeddingEngine] = None
+_engine_lock = threading.Lock()
+
+
+def get_embedding_engine() -> EmbeddingEngine:
+    """
+    Returns the shared engine for this process, creating it on first use.
+    """
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                cache_dir = os.getenv("EMBEDDING_CACHE_DIR", os.path.join(os.getcwd(), "data", "embedding_cache"))
+                _engine = EmbeddingEngine(
+                    backend=EMBEDDING_BACKEND,
+                    cache=EmbeddingCache(
+                        os.path.join(cache_dir, model_key(EMBEDDING_BACKEND, EMBEDDING_MODEL).replace("/", "_").replace(":", "_")),
+                        capacity=int(os.getenv("EMBEDDING_CACHE_SIZE", "500000")),
+                    ),
+                    max_batch_size=int(os.getenv("EMBEDDING_BATCH_SIZE", "64")),
+                    max_workers=int(os.getenv("EMBEDDING_WORKERS", "2")),
+                    max_wait_ms=float(os.getenv("EMBEDDING_MAX_WAIT_MS", "0")),
+                )
+    return _engine
@@ -0,0 +1,1016 @@
+import fcntl
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from modules.legal.knowledge.dedup import band_buckets, minhash, similarity
+from modules.legal.knowledge.quantization import QUANTIZATIONS, approximate_scores, code_shape, quantize
+
+
+class MemmapIndex:
+    """
+    Persistent vector index backed by memory-mapped files.
+
+    On-disk layout (one directory per collection):
+        vectors.f32  - row-major float32 matrix, one L2-normalized row per chunk
+        alive.u8     - one byte per row, 0 once the row has been deleted
+        meta.sqlite  - chunk ids, documents, metadata, document versions, the index
+                       header and an FTS5 (BM25) inverted index over chunk text
+        codes.q      - with ``quantization``: int8 or packed binary codes per row
+        scales.f32   - with int8 quantization: one dequantization scale per row
+        partitions.i32 - one partition code (tenant and type, see the partitions
+                       table) per row, so partition filters are applied inside
+                       the scan instead of gathering the matching rows
+        index.lock   - flock'ed exclusively by writes and shared by reads, so
+                       several processes (API workers, the bulk CLI) can share
+                       the directory; each picks up the others' rows, capacity
+                       and compactions from the header when it takes the lock
+
+    Opening the index only maps the files and reads the header, so start-up
+    cost does not grow with the size of the corpus.
+
+    With ``quantization`` ("int8" or "binary"), search first scans the compact
+    codes, then re-ranks the best ``k * RERANK_OVERSAMPLE`` rows with their
+    float32 vectors, which are read from the memory map on demand; only the
+    codes need to stay resident (4x / 32x smaller than float32).
+
+    With ``dedup_threshold``, a new chunk whose MinHash signature matches an
+    indexed chunk of the same partition (tenant and type) at or above that
+    estimated Jaccard similarity gets no row of its own: it is recorded as a
+    reference to that row, and the row's record lists every source (see get).
+
+    Deleted rows are only masked; once they make up more than
+    ``compact_threshold`` of the rows, delete compacts the index (see compact),
+    so the files and the FTS index do not keep growing with churn.
+    """
+
+    VECTORS_FILE = "vectors.f32"
+    ALIVE_FILE = "alive.u8"
+    CODES_FILE = "codes.q"
+    SCALES_FILE = "scales.f32"
+    PARTITIONS_FILE = "partitions.i32"
+    META_FILE = "meta.sqlite"
+    LOCK_FILE = "index.lock"
+    MIN_CAPACITY = 1024
+    # Candidates re-ranked exactly per requested result
+    RERANK_OVERSAMPLE = {"int8": 4, "binary": 16}
+    # Rows scored per step of the approximate pass, bounding temporary memory
+    SCAN_BLOCK = 16384
+    # Dead rows tolerated regardless of compact_threshold, so small indexes are not rewritten on every delete
+    COMPACT_MIN_DEAD = 1024
+
+    def __init__(self, path: str, quantization: Optional[str] = None, dedup_threshold: Optional[float] = None, compact_threshold: Optional[float] = 0.25):
+        if quantization is not None and quantization not in QUANTIZATIONS:
+            raise ValueError(f"Unknown quantization: {quantization}")
+        if dedup_threshold is not None and not 0.0 < dedup_threshold <= 1.0:
+            raise ValueError(f"dedup_threshold must be in (0, 1], got {dedup_threshold}")
+        if compact_threshold is not None and not 0.0 < compact_threshold < 1.0:
+            raise ValueError(f"compact_threshold must be in (0, 1), got {compact_threshold}")
+        self.path = path
+        self.quantization = quantization
+        self.dedup_threshold = dedup_threshold
+        self.compact_threshold = compact_threshold
+        os.makedirs(path, exist_ok=True)
+        self._lock = threading.RLock()
+        self._lock_file = open(os.path.join(path, self.LOCK_FILE), "a+")
+        self._flock_depth = 0
+        self._flock_exclusive = False
+
+        self.dim: Optional[int] = None
+        self._rows = 0
+        self._capacity = 0
+        self._compactions = 0
+        self._vectors: Optional[np.memmap] = None
+        self._alive: Optional[np.memmap] = None
+        self._codes: Optional[np.memmap] = None
+        self._scales: Optional[np.memmap] = None
+        self._partitions: Optional[np.memmap] = None
+        self._partition_codes: Dict[Tuple, int] = {}
+
+        self._db = sqlite3.connect(os.path.join(path, self.META_FILE), check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        # REPLACE must fire delete triggers so the FTS index drops overwritten text
+        self._db.execute("PRAGMA recursive_triggers=ON")
+        with self._locked(exclusive=True, refresh=False):
+            self._create_tables()
+            self._refresh()
+            info = dict(self._db.execute("SELECT key, value FROM info").fetchall())
+            if self.dim is not None:
+                if info.get("quantization", "") != (quantization or ""):
+                    self._encode_existing()
+                if "partitions" not in info:
+                    self._encode_partitions()
+                if dedup_threshold is not None and info.get("dedup_threshold", "") != str(dedup_threshold):
+                    self._dedup_existing()
+
+    def _create_tables(self):
+        """Creates (or migrates) the metadata tables. Caller holds the write lock."""
+        self._db.execute("CREATE TABLE IF NOT EXISTS info (key TEXT PRIMARY KEY, value TEXT)")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS chunks ("
+            " row INTEGER PRIMARY KEY,"
+            " id TEXT UNIQUE NOT NULL,"
+            " document TEXT,"
+            " metadata TEXT)"
+        )
+        columns = {row[1] for row in self._db.execute("PRAGMA table_info(chunks)")}
+        if "doc_id" not in columns:
+            self._db.execute("ALTER TABLE chunks ADD COLUMN doc_id TEXT")
+        self._db.execute("CREATE INDEX IF NOT EXISTS chunks_doc_id ON chunks (doc_id)")
+        if "tenant" not in columns:
+            # Partition columns, backfilled from metadata for indexes created before them
+            self._db.execute("ALTER TABLE chunks ADD COLUMN tenant TEXT")
+            self._db.execute("ALTER TABLE chunks ADD COLUMN doc_type TEXT")
+            self._db.execute(
+                "UPDATE chunks SET tenant = json_extract(metadata, '$.tenant'), doc_type = json_extract(metadata, '$.type')"
+            )
+        self._db.execute("CREATE INDEX IF NOT EXISTS chunks_partition ON chunks (tenant, doc_type, row)")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS documents ("
+            " doc_id TEXT PRIMARY KEY,"
+            " version INTEGER NOT NULL,"
+            " chunks INTEGER NOT NULL,"
+            " updated_at REAL NOT NULL)"
+        )
+        self._db.execute("CREATE TABLE IF NOT EXISTS partitions (code INTEGER PRIMARY KEY, tenant TEXT, doc_type TEXT)")
+        self._create_lexical_index()
+        self._create_dedup_tables()
+        self._db.commit()
+
+    # ------------------------------------------------------------------ #
+    # Cross-process locking
+    # ------------------------------------------------------------------ #
+
+    @contextmanager
+    def _locked(self, exclusive: bool, refresh: bool = True):
+        """
+        The in-process lock plus an flock on LOCK_FILE: exclusive for writes,
+        shared for reads. Re-entrant within a thread (the outermost acquisition
+        sets the mode), and the outermost one catches up with other processes' writes.
+        """
+        with self._lock:
+            if self._flock_depth == 0:
+                fcntl.flock(self._lock_file, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+                self._flock_exclusive = exclusive
+            elif exclusive and not self._flock_exclusive:
+                raise RuntimeError("Index writes cannot nest inside a read")
+            self._flock_depth += 1
+            try:
+                if refresh and self._flock_depth == 1:
+                    self._refresh()
+                yield
+            finally:
+                self._flock_depth -= 1
+                if self._flock_depth == 0:
+                    fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+
+    def _write_lock(self):
+        return self._locked(exclusive=True)
+
+    def _read_lock(self):
+        return self._locked(exclusive=False)
+
+    def _refresh(self):
+        """
+        Re-reads the header, so rows appended, capacity grown, partitions
+        allocated and files replaced by compaction in another process are
+        seen before this one reads or allocates rows. Caller holds the flock.
+        """
+        info = dict(self._db.execute("SELECT key, value FROM info WHERE key IN ('dim', 'rows', 'capacity', 'compactions')"))
+        self._partition_codes = {
+            (tenant, doc_type): code for code, tenant, doc_type in self._db.execute("SELECT code, tenant, doc_type FROM partitions")
+        }
+        if "dim" not in info:
+            return
+        capacity, compactions = int(info["capacity"]), int(info.get("compactions", 0))
+        if self._vectors is None or (capacity, compactions) != (self._capacity, self._compactions):
+            self._flush()
+            self._vectors = self._alive = self._partitions = self._codes = self._scales = None
+            self.dim, self._capacity, self._compactions = int(info["dim"]), capacity, compactions
+            self._map()
+        self._rows = int(info["rows"])
+
+    # ------------------------------------------------------------------ #
+    # Storage management
+    # ------------------------------------------------------------------ #
+
+    def _map(self):
+        """(Re)maps the vector, liveness and code files at the current capacity."""
+        self._vectors = self._map_file(self.VECTORS_FILE, np.float32, (self._capacity, self.dim))
+        self._alive = self._map_file(self.ALIVE_FILE, np.uint8, (self._capacity,))
+        self._partitions = self._map_file(self.PARTITIONS_FILE, np.int32, (self._capacity,))
+        if self.quantization:
+            width, dtype = code_shape(self.quantization, self.dim)
+            self._codes = self._map_file(self.CODES_FILE, dtype, (self._capacity, width))
+            if self.quantization == "int8":
+                self._scales = self._map_file(self.SCALES_FILE, np.float32, (self._capacity,))
+
+    def _map_file(self, name: str, dtype, shape: Tuple[int, ...]) -> np.memmap:
+        file_path = os.path.join(self.path, name)
+        size = int(np.prod(shape)) * np.dtype(dtype).itemsize
+        with open(file_path, "ab") as f:
+            if f.tell() < size:
+                f.truncate(size)
+        return np.memmap(file_path, dtype=dtype, mode="r+", shape=shape)
+
+    def _encode(self, rows: np.ndarray, vectors: np.ndarray):
+        if not self.quantization:
+            return
+        codes, scales = quantize(self.quantization, vectors)
+        self._codes[rows] = codes
+        if scales is not None:
+            self._scales[rows] = scales
+
+    def _encode_existing(self):
+        """Builds codes for every stored row after the quantization setting changed."""
+        for start in range(0, self._rows, self.SCAN_BLOCK):
+            rows = np.arange(start, min(start + self.SCAN_BLOCK, self._rows))
+            self._encode(rows, np.asarray(self._vectors[rows]))
+        self._flush()
+        self._write_info()
+        self._db.commit()
+
+    def _partition_code(self, metadata: Optional[Dict]) -> int:
+        """Code of the metadata's (tenant, type) partition, allocated on first sight. Caller holds the lock."""
+        metadata = metadata or {}
+        partition = (metadata.get("tenant"), metadata.get("type"))
+        code = self._partition_codes.get(partition)
+        if code is None:
+            code = len(self._partition_codes)
+            self._db.execute("INSERT INTO partitions (code, tenant, doc_type) VALUES (?, ?, ?)", (code,) + partition)
+            self._partition_codes[partition] = code
+        return code
+
+    def _encode_partitions(self):
+        """Fills the partition code of every stored row (index created before partition codes existed)."""
+        for start in range(0, self._rows, self.SCAN_BLOCK):
+            for row, tenant, doc_type in self._db.execute(
+                "SELECT row, tenant, doc_type FROM chunks WHERE row >= ? AND row < ?", (start, start + self.SCAN_BLOCK)
+            ).fetchall():
+                self._partitions[row] = self._partition_code({"tenant": tenant, "type": doc_type})
+        self._flush()
+        self._write_info()
+        self._db.commit()
+
+    def _flush(self):
+        for mapped in (self._vectors, self._alive, self._partitions, self._codes, self._scales):
+            if mapped is not None:
+                mapped.flush()
+
+    def _ensure_capacity(self, needed: int):
+        if needed <= self._capacity:
+            return
+        new_capacity = max(self.MIN_CAPACITY, self._capacity * 2, needed)
+        if self._vectors is not None:
+            self._flush()
+            self._vectors = self._alive = self._partitions = self._codes = self._scales = None
+        self._capacity = new_capacity
+        self._map()
+
+    def _write_info(self):
+        self._db.executemany(
+            "INSERT OR REPLACE INTO info (key, value) VALUES (?, ?)",
+            [
+                ("dim", str(self.dim)), ("rows", str(self._rows)), ("capacity", str(self._capacity)),
+                ("quantization", self.quantization or ""),
+                ("dedup_threshold", "" if self.dedup_threshold is None else str(self.dedup_threshold)),
+                ("partitions", "1"), ("compactions", str(self._compactions)),
+            ],
+        )
+
+    def _create_lexical_index(self):
+        """
+        FTS5 table mirroring chunk text, kept in sync by triggers so the
+        inverted index is maintained incrementally with every write.
+        """
+        exists = self._db.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'chunks_fts'"
+        ).fetchone()
+        self._db.executescript(
+            """
+            CREATE VIRTUAL TABLE IF NOT EXISTS chunks_fts USING fts5(
+                document, content='chunks', content_rowid='row', tokenize='porter unicode61'
+            );
+            CREATE TRIGGER IF NOT EXISTS chunks_fts_insert AFTER INSERT ON chunks BEGIN
+                INSERT INTO chunks_fts (rowid, document) VALUES (new.row, new.document);
+            END;
+            CREATE TRIGGER IF NOT EXISTS chunks_fts_delete AFTER DELETE ON chunks BEGIN
+                INSERT INTO chunks_fts (chunks_fts, rowid, document) VALUES ('delete', old.row, old.document);
+            END;
+            CREATE TRIGGER IF NOT EXISTS chunks_fts_update AFTER UPDATE OF document ON chunks BEGIN
+                INSERT INTO chunks_fts (chunks_fts, rowid, document) VALUES ('delete', old.row, old.document);
+                INSERT INTO chunks_fts (rowid, document) VALUES (new.row, new.document);
+            END;
+            """
+        )
+        if not exists:
+            # Index created before lexical search existed: backfill once
+            self._db.execute("INSERT INTO chunks_fts (chunks_fts) VALUES ('rebuild')")
+
+    def _create_dedup_tables(self):
+        """
+        chunk_refs:    chunks collapsed into a near-duplicate row (no row of their own),
+                       with their text and vector for when they take the row over
+        minhash:       signature and partition of every row registered for deduplication
+        minhash_bands: LSH bucket keys of those signatures, one per band
+        """
+        self._db.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS chunk_refs (
+                id TEXT PRIMARY KEY,
+                row INTEGER NOT NULL,
+                doc_id TEXT,
+                metadata TEXT
+            );
+            CREATE INDEX IF NOT EXISTS chunk_refs_row ON chunk_refs (row);
+            CREATE INDEX IF NOT EXISTS chunk_refs_doc_id ON chunk_refs (doc_id);
+            CREATE TABLE IF NOT EXISTS minhash (
+                row INTEGER PRIMARY KEY,
+                partition TEXT NOT NULL,
+                signature BLOB NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS minhash_bands (bucket INTEGER NOT NULL, row INTEGER NOT NULL);
+            CREATE INDEX IF NOT EXISTS minhash_bands_bucket ON minhash_bands (bucket);
+            CREATE INDEX IF NOT EXISTS minhash_bands_row ON minhash_bands (row);
+            """
+        )
+        columns = {row[1] for row in self._db.execute("PRAGMA table_info(chunk_refs)")}
+        if "document" not in columns:
+            # References recorded before this keep the text and vector of their row when promoted
+            self._db.execute("ALTER TABLE chunk_refs ADD COLUMN document TEXT")
+            self._db.execute("ALTER TABLE chunk_refs ADD COLUMN vector BLOB")
+
+    def _bump_version(self):
+        self._db.execute(
+            "INSERT INTO info (key, value) VALUES ('corpus_version', '1') "
+            "ON CONFLICT (key) DO UPDATE SET value = CAST(value AS INTEGER) + 1"
+        )
+
+    @property
+    def corpus_version(self) -> int:
+        """
+        Counter bumped by every write that changes searchable chunks. It lives
+        in meta.sqlite, so writes from other processes are visible too.
+        """
+        with self._lock:
+            row = self._db.execute("SELECT value FROM info WHERE key = 'corpus_version'").fetchone()
+        return int(row[0]) if row else 0
+
+    def bind_model(self, model_key: str):
+        """
+        Records the embedding model (see embeddings.model_key) whose vectors the
+        index holds, and refuses another one: vectors of different models are
+        not comparable even when their dimensions match.
+        """
+        with self._write_lock():
+            row = self._db.execute("SELECT value FROM info WHERE key = 'model'").fetchone()
+            if row is not None and row[0] != model_key:
+                raise ValueError(
+                    f"Index at {self.path} holds {row[0]} embeddings, not {model_key}: "
+                    "re-index the collection (or use another one) to switch models"
+                )
+            if row is None:
+                # Indexes created before the model was recorded are assumed to match
+                self._db.execute("INSERT INTO info (key, value) VALUES ('model', ?)", (model_key,))
+                self._db.commit()
+
+    @property
+    def count(self) -> int:
+        """Number of live chunks in the index."""
+        with self._read_lock():
+            if self._alive is None:
+                return 0
+            return int(np.count_nonzero(self._alive[:self._rows]))
+
+    # ------------------------------------------------------------------ #
+    # Writes
+    # ------------------------------------------------------------------ #
+
+    def upsert(self, ids: Sequence[str], vectors: np.ndarray, documents: Sequence[str], metadatas: Sequence[Dict], doc_ids: Sequence[str] = None):
+        """
+        Inserts new chunks or overwrites existing ones (matched by id) in place.
+        ``doc_ids`` ties each chunk to a versioned document (see set_document).
+        With deduplication, a chunk moving to another partition (tenant or type)
+        is removed and indexed again, so it only ever collapses within its partition.
+        """
+        if not (len(ids) == len(vectors) == len(documents) == len(metadatas)):
+            raise ValueError("ids, vectors, documents and metadatas must have the same length")
+        if len(ids) == 0:
+            return
+        vectors = _normalize(np.asarray(vectors, dtype=np.float32))
+
+        with self._write_lock():
+            if self.dim is None:
+                self.dim = int(vectors.shape[1])
+            elif vectors.shape[1] != self.dim:
+                raise ValueError(f"Embedding dimension mismatch: index has {self.dim}, got {vectors.shape[1]}")
+
+            if self.dedup_threshold is not None:
+                moved = self._moved_partition(ids, metadatas)
+                if moved:
+                    self._delete(moved)
+            existing = self._rows_for_ids(ids)
+            refs = self._rows_for_ids(ids, table="chunk_refs")
+            rows, kept, collapsed = [], [], []
+            next_row = self._rows
+            for i, chunk_id in enumerate(ids):
+                row = existing.get(chunk_id)
+                if row is None and chunk_id in refs:
+                    collapsed.append((chunk_id, refs[chunk_id], i))
+                    continue
+                if row is None:
+                    signature = None
+                    if self.dedup_threshold is not None:
+                        partition = _partition_key(metadatas[i])
+                        signature = minhash(documents[i])
+                        match = self._near_duplicate(signature, partition) if signature is not None else None
+                        if match is not None:
+                            refs[chunk_id] = match
+                            collapsed.append((chunk_id, match, i))
+                            continue
+                    row = next_row
+                    existing[chunk_id] = row
+                    next_row += 1
+                    if signature is not None:
+                        # Registered right away, so later chunks of this batch can collapse into it
+                        self._register(row, signature, partition)
+                rows.append(row)
+                kept.append(i)
+
+            doc_ids = doc_ids or [None] * len(ids)
+            if rows:
+                self._ensure_capacity(next_row)
+                row_array = np.asarray(rows, dtype=np.int64)
+                self._vectors[row_array] = vectors[kept]
+                self._encode(row_array, vectors[kept])
+                self._alive[row_array] = 1
+                self._partitions[row_array] = [self._partition_code(metadatas[i]) for i in kept]
+                self._rows = next_row
+                self._db.executemany(
+                    "INSERT OR REPLACE INTO chunks (row, id, document, metadata, doc_id, tenant, doc_type) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    [
+                        (row, ids[i], documents[i], json.dumps(metadatas[i] or {}), doc_ids[i],
+                         (metadatas[i] or {}).get("tenant"), (metadatas[i] or {}).get("type"))
+                        for row, i in zip(rows, kept)
+                    ],
+                )
+                self._flush()
+            if collapsed:
+                self._db.executemany(
+                    "INSERT OR REPLACE INTO chunk_refs (id, row, doc_id, metadata, document, vector) VALUES (?, ?, ?, ?, ?, ?)",
+                    [
+                        (chunk_id, row, doc_ids[i], json.dumps(metadatas[i] or {}), documents[i], vectors[i].tobytes())
+                        for chunk_id, row, i in collapsed
+                    ],
+                )
+            self._write_info()
+            self._bump_version()
+            self._db.commit()
+
+    def delete(self, ids: Sequence[str]) -> int:
+        """
+        Removes chunks by id. Their rows are masked out of search, and
+        reclaimed once enough of them have accumulated (see compact).
+        A row that other chunks were collapsed into stays searchable: the
+        oldest of those references takes its place, with its own text and vector.
+        """
+        with self._write_lock():
+            removed = self._delete(ids)
+            if removed:
+                self._bump_version()
+                self._db.commit()
+                dead = self._rows - self.count
+                if self.compact_threshold is not None and dead >= self.COMPACT_MIN_DEAD and dead > self.compact_threshold * self._rows:
+                    self.compact()
+            return removed
+
+    def _delete(self, ids: Sequence[str]) -> int:
+        """delete without the version bump and commit. Caller holds the lock."""
+        refs = self._rows_for_ids(ids, table="chunk_refs")
+        self._db.executemany("DELETE FROM chunk_refs WHERE id = ?", [(chunk_id,) for chunk_id in refs])
+        rows = self._rows_for_ids(ids)
+        if not rows and not refs:
+            return 0
+        dead = []
+        for chunk_id, row in rows.items():
+            heir = self._db.execute(
+                "SELECT id, doc_id, metadata, document, vector FROM chunk_refs WHERE row = ? ORDER BY rowid LIMIT 1", (row,)
+            ).fetchone()
+            if heir is None:
+                dead.append(row)
+                continue
+            self._promote(row, *heir)
+        if dead:
+            self._alive[np.asarray(dead, dtype=np.int64)] = 0
+            self._alive.flush()
+            self._db.executemany("DELETE FROM chunks WHERE row = ?", [(row,) for row in dead])
+            self._unregister(dead)
+        return len(rows) + len(refs)
+
+    def _promote(self, row: int, chunk_id: str, doc_id: str, metadata: str, document: Optional[str], vector: Optional[bytes]):
+        """Hands ``row`` over to a chunk that was collapsed into it. Caller holds the lock."""
+        self._db.execute("DELETE FROM chunk_refs WHERE id = ?", (chunk_id,))
+        if document is None:
+            # Collapsed before reference texts were kept: it inherits the row's text and vector
+            self._db.execute("UPDATE chunks SET id = ?, doc_id = ?, metadata = ? WHERE row = ?", (chunk_id, doc_id, metadata, row))
+            return
+        self._db.execute(
+            "UPDATE chunks SET id = ?, doc_id = ?, metadata = ?, document = ? WHERE row = ?", (chunk_id, doc_id, metadata, document, row)
+        )
+        if vector is not None:
+            vector = np.frombuffer(vector, dtype=np.float32)[None, :]
+            self._vectors[row] = vector[0]
+            self._encode(np.asarray([row]), vector)
+            self._flush()
+        signature = minhash(document)
+        if signature is not None:
+            self._register(row, signature, _partition_key(json.loads(metadata or "{}")))
+
+    def compact(self) -> int:
+        """
+        Rewrites the live rows contiguously into new files, dropping the dead
+        ones, and renumbers them in the metadata tables and the FTS index.
+        Returns the number of rows reclaimed. Row numbers change: callers that
+        carry rows from one call to the next (search, then get) hold stable_rows.
+        Other processes sharing the directory remap on their next call.
+        """
+        with self._write_lock():
+            if self._alive is None:
+                return 0
+            live = np.flatnonzero(self._alive[:self._rows])
+            reclaimed = self._rows - len(live)
+            if reclaimed == 0:
+                return 0
+            started = time.perf_counter()
+            capacity = max(self.MIN_CAPACITY, len(live))
+            mapped = {
+                self.VECTORS_FILE: self._vectors, self.ALIVE_FILE: self._alive, self.PARTITIONS_FILE: self._partitions,
+                self.CODES_FILE: self._codes, self.SCALES_FILE: self._scales,
+            }
+            written = [name for name, source in mapped.items() if source is not None]
+            for name in written:
+                self._write_compacted(name, mapped[name], live, capacity)
+
+            self._db.execute("CREATE TEMP TABLE IF NOT EXISTS row_map (old INTEGER PRIMARY KEY, new INTEGER NOT NULL)")
+            self._db.execute("DELETE FROM row_map")
+            self._db.executemany("INSERT INTO row_map (old, new) VALUES (?, ?)", ((int(old), new) for new, old in enumerate(live)))
+            for table in ("chunks", "chunk_refs", "minhash", "minhash_bands"):
+                # Nothing should point at a dead row; anything that does would be left without one
+                self._db.execute(f"DELETE FROM {table} WHERE row NOT IN (SELECT old FROM row_map)")
+            for table in ("chunks", "minhash"):
+                # row is the primary key: moving through negative numbers first
+                # keeps a row from colliding with one that has not moved yet
+                self._db.execute(f"UPDATE {table} SET row = -1 - (SELECT new FROM row_map WHERE old = {table}.row)")
+                self._db.execute(f"UPDATE {table} SET row = -1 - row")
+            for table in ("chunk_refs", "minhash_bands"):
+                self._db.execute(f"UPDATE {table} SET row = (SELECT new FROM row_map WHERE old = {table}.row)")
+            self._db.execute("DROP TABLE row_map")
+            # The FTS index is keyed by row; renumbering bypasses its triggers
+            self._db.execute("INSERT INTO chunks_fts (chunks_fts) VALUES ('rebuild')")
+
+            self._vectors = self._alive = self._partitions = self._codes = self._scales = None
+            for name in written:
+                os.replace(os.path.join(self.path, name + ".compact"), os.path.join(self.path, name))
+            self._rows = len(live)
+            self._capacity = capacity
+            self._compactions += 1
+            self._map()
+            self._write_info()
+            self._bump_version()
+            self._db.commit()
+        print(f"[MemmapIndex] Compacted {self.path}: {reclaimed} dead rows reclaimed in {time.perf_counter() - started:.2f}s")
+        return reclaimed
+
+    def _write_compacted(self, name: str, source: np.memmap, live: np.ndarray, capacity: int):
+        """Writes the ``live`` rows of ``source`` to ``name``.compact, in blocks. Caller holds the lock."""
+        target = np.memmap(os.path.join(self.path, name + ".compact"), dtype=source.dtype, mode="w+", shape=(capacity,) + source.shape[1:])
+        for start in range(0, len(live), self.SCAN_BLOCK):
+            block = live[start:start + self.SCAN_BLOCK]
+            target[start:start + len(block)] = source[block]
+        target.flush()
+
+    @contextmanager
+    def stable_rows(self):
+        """
+        Keeps row numbers valid across several calls (e.g. search, then get):
+        compaction, and every other write to the index (in any process), waits until it exits.
+        """
+        with self._read_lock():
+            yield
+
+    def _moved_partition(self, ids: Sequence[str], metadatas: Sequence[Dict]) -> List[str]:
+        """Indexed ids (own rows or collapsed references) whose new metadata is in another partition."""
+        partitions = {chunk_id: _partition_key(metadata) for chunk_id, metadata in zip(ids, metadatas)}
+        unique_ids = list(partitions)
+        moved = []
+        for start in range(0, len(unique_ids), 500):
+            batch = unique_ids[start:start + 500]
+            placeholders = ",".join("?" * len(batch))
+            for chunk_id, metadata in self._db.execute(
+                f"SELECT id, metadata FROM chunks WHERE id IN ({placeholders})"
+                f" UNION ALL SELECT id, metadata FROM chunk_refs WHERE id IN ({placeholders})", batch + batch
+            ):
+                if _partition_key(json.loads(metadata or "{}")) != partitions[chunk_id]:
+                    moved.append(chunk_id)
+        return moved
+
+    # ------------------------------------------------------------------ #
+    # Near-duplicate detection
+    # ------------------------------------------------------------------ #
+
+    def _near_duplicate(self, signature: np.ndarray, partition: str) -> Optional[int]:
+        """
+        The registered row of ``partition`` most similar to ``signature``, if
+        its estimated Jaccard similarity reaches dedup_threshold. Caller holds the lock.
+        """
+        buckets = band_buckets(signature, partition)
+        candidates = [
+            r[0] for r in self._db.execute(
+                f"SELECT DISTINCT row FROM minhash_bands WHERE bucket IN ({','.join('?' * len(buckets))})", buckets
+            )
+        ]
+        best, best_score = None, self.dedup_threshold
+        for start in range(0, len(candidates), 500):
+            batch = candidates[start:start + 500]
+            for row, row_partition, blob in self._db.execute(
+                f"SELECT row, partition, signature FROM minhash WHERE row IN ({','.join('?' * len(batch))})", batch
+            ):
+                score = similarity(signature, np.frombuffer(blob, dtype=np.uint32))
+                if row_partition == partition and score >= best_score:
+                    best, best_score = row, score
+        return best
+
+    def _register(self, row: int, signature: np.ndarray, partition: str):
+        self._unregister([row])
+        self._db.execute(
+            "INSERT INTO minhash (row, partition, signature) VALUES (?, ?, ?)", (row, partition, signature.tobytes())
+        )
+        self._db.executemany(
+            "INSERT INTO minhash_bands (bucket, row) VALUES (?, ?)",
+            [(bucket, row) for bucket in band_buckets(signature, partition)],
+        )
+
+    def _unregister(self, rows: Sequence[int]):
+        self._db.executemany("DELETE FROM minhash WHERE row = ?", [(row,) for row in rows])
+        self._db.executemany("DELETE FROM minhash_bands WHERE row = ?", [(row,) for row in rows])
+
+    def _dedup_existing(self):
+        """
+        Signs every row that has no signature yet (e.g. indexed before
+        deduplication was enabled), collapsing it into an earlier near-duplicate.
+        """
+        collapsed = 0
+        for start in range(0, self._rows, self.SCAN_BLOCK):
+            unsigned = self._db.execute(
+                "SELECT row, id, document, metadata, doc_id FROM chunks"
+                " WHERE row >= ? AND row < ? AND row NOT IN (SELECT row FROM minhash) ORDER BY row",
+                (start, start + self.SCAN_BLOCK),
+            ).fetchall()
+            for row, chunk_id, document, metadata, doc_id in unsigned:
+                partition = _partition_key(json.loads(metadata or "{}"))
+                signature = minhash(document or "")
+                if signature is None:
+                    continue
+                match = self._near_duplicate(signature, partition)
+                if match is None:
+                    self._register(row, signature, partition)
+                    continue
+                self._db.execute("DELETE FROM chunks WHERE row = ?", (row,))
+                self._db.execute(
+                    "INSERT OR REPLACE INTO chunk_refs (id, row, doc_id, metadata, document, vector) VALUES (?, ?, ?, ?, ?, ?)",
+                    (chunk_id, match, doc_id, metadata, document, np.asarray(self._vectors[row]).tobytes()),
+                )
+                self._alive[row] = 0
+                collapsed += 1
+        self._flush()
+        self._write_info()
+        if collapsed:
+            self._bump_version()
+        self._db.commit()
+
+    def dedup_stats(self) -> Dict:
+        """Rows in the index versus chunks they stand for, including collapsed references."""
+        with self._lock:
+            references = self._db.execute("SELECT COUNT(*) FROM chunk_refs").fetchone()[0]
+        rows = self.count
+        return {
+            "threshold": self.dedup_threshold,
+            "rows": rows,
+            "references": references,
+            "chunks": rows + references,
+            "reduction": round(references / (rows + references), 4) if rows + references else 0.0,
+        }
+
+    def document_chunk_ids(self, doc_id: str) -> List[str]:
+        return list(self.document_chunks(doc_id))
+
+    def document_chunks(self, doc_id: str) -> Dict[str, Dict]:
+        """Metadata of every chunk of a document, by chunk id (collapsed references included)."""
+        with self._lock:
+            return {
+                chunk_id: json.loads(metadata or "{}") for chunk_id, metadata in self._db.execute(
+                    "SELECT id, metadata FROM chunks WHERE doc_id = ? UNION ALL SELECT id, metadata FROM chunk_refs WHERE doc_id = ?",
+                    (doc_id, doc_id),
+                )
+            }
+
+    def get_document(self, doc_id: str) -> Optional[Dict]:
+        with self._lock:
+            row = self._db.execute(
+                "SELECT version, chunks, updated_at FROM documents WHERE doc_id = ?", (doc_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        return {"doc_id": doc_id, "version": row[0], "chunks": row[1], "updated_at": row[2]}
+
+    def set_document(self, doc_id: str, version: int, chunks: int):
+        with self._write_lock():
+            self._db.execute(
+                "INSERT OR REPLACE INTO documents (doc_id, version, chunks, updated_at) VALUES (?, ?, ?, ?)",
+                (doc_id, version, chunks, time.time()),
+            )
+            self._db.commit()
+
+    def delete_document(self, doc_id: str) -> int:
+        with self._write_lock():
+            removed = self.delete(self.document_chunk_ids(doc_id))
+            self._db.execute("DELETE FROM documents WHERE doc_id = ?", (doc_id,))
+            self._db.commit()
+            return removed
+
+    def _rows_for_ids(self, ids: Sequence[str], table: str = "chunks") -> Dict[str, int]:
+        """Rows of the given chunk ids; with ``table="chunk_refs"``, the rows collapsed ids point to."""
+        rows = {}
+        unique_ids = list(dict.fromkeys(ids))
+        for start in range(0, len(unique_ids), 500):
+            batch = unique_ids[start:start + 500]
+            placeholders = ",".join("?" * len(batch))
+            for chunk_id, row in self._db.execute(
+                f"SELECT id, row FROM {table} WHERE id IN ({placeholders})", batch
+            ):
+                rows[chunk_id] = row
+        return rows
+
+    # ------------------------------------------------------------------ #
+    # Reads
+    # ------------------------------------------------------------------ #
+
+    def search(self, query_vectors: np.ndarray, k: int, rows: Optional[Sequence[int]] = None, where: Optional[Dict] = None) -> List[List[Tuple[int, float]]]:
+        """
+        Cosine search. Returns, per query, up to ``k`` (row, similarity) pairs.
+        With ``rows``, only those candidate rows are scored. ``where`` filters
+        on the partition fields only (see is_partition_filter); it is applied
+        to the partition codes during the scan. Similarities are always exact;
+        with quantization only the candidate selection is approximate.
+        """
+        query_vectors = _normalize(np.atleast_2d(np.asarray(query_vectors, dtype=np.float32)))
+        with self._read_lock():
+            if self._vectors is None or self._rows == 0 or k <= 0:
+                return [[] for _ in range(len(query_vectors))]
+            allowed = self._allowed_partitions(where) if where else None
+            if allowed is not None and not allowed.any():
+                return [[] for _ in range(len(query_vectors))]
+            if rows is None:
+                candidates = np.arange(self._rows)
+            else:
+                candidates = np.asarray(rows, dtype=np.int64)
+                candidates = candidates[candidates < self._rows]
+            shortlist = k * self.RERANK_OVERSAMPLE[self.quantization] if self.quantization else None
+            if shortlist is None or len(candidates) <= shortlist:
+                return self._exact(query_vectors, k, None if rows is None else candidates, allowed)
+
+            # Approximate pass over the compact codes, then exact re-rank of the shortlist
+            approx = self._approximate(query_vectors, candidates, contiguous=rows is None, allowed=allowed)
+            results = []
+            for query, column in zip(query_vectors, approx.T):
+                top = _top_k(column, shortlist)
+                top = candidates[top[np.isfinite(column[top])]]
+                results.append(self._exact(query[None, :], k, np.sort(top))[0])
+            return results
+
+    def _exact(self, query_vectors: np.ndarray, k: int, rows: Optional[np.ndarray] = None, allowed: Optional[np.ndarray] = None) -> List[List[Tuple[int, float]]]:
+        """Exact float32 scoring of all rows, or only ``rows``. Caller holds the lock."""
+        if rows is None:
+            candidates = None
+            scores = self._vectors[:self._rows] @ query_vectors.T
+            scores[self._excluded(slice(0, self._rows), allowed)] = -np.inf
+        else:
+            candidates = rows
+            scores = self._vectors[candidates] @ query_vectors.T
+            scores[self._excluded(candidates, allowed)] = -np.inf
+
+        results = []
+        for column in scores.T:
+            top = _top_k(column, k)
+            row_ids = top if candidates is None else candidates[top]
+            results.append([
+                (int(row), float(column[i])) for i, row in zip(top, row_ids) if np.isfinite(column[i])
+            ])
+        return results
+
+    def _approximate(self, query_vectors: np.ndarray, candidates: np.ndarray, contiguous: bool = False, allowed: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        Approximate scores of ``candidates`` from the codes, in blocks; dead rows
+        and rows outside the ``allowed`` partitions get -inf. ``contiguous``
+        means candidates are rows 0..n-1 (sliced, not gathered).
+        """
+        scores = np.empty((len(candidates), len(query_vectors)), dtype=np.float32)
+        for start in range(0, len(candidates), self.SCAN_BLOCK):
+            end = min(start + self.SCAN_BLOCK, len(candidates))
+            block = slice(start, end) if contiguous else candidates[start:end]
+            scales = self._scales[block] if self._scales is not None else None
+            scores[start:end] = approximate_scores(self.quantization, self._codes[block], scales, query_vectors)
+            scores[start:end][self._excluded(block, allowed)] = -np.inf
+        return scores
+
+    def _excluded(self, block, allowed: Optional[np.ndarray]) -> np.ndarray:
+        """Rows of ``block`` that are dead or, with ``allowed`` (indexed by partition code), outside the filter."""
+        excluded = self._alive[block] == 0
+        if allowed is not None:
+            excluded |= ~allowed[self._partitions[block]]
+        return excluded
+
+    def _allowed_partitions(self, where: Dict) -> Optional[np.ndarray]:
+        """
+        Boolean table, indexed by partition code, of the partitions matching a
+        partition filter; None when every partition matches (no filtering needed).
+        Caller holds the lock.
+        """
+        if not is_partition_filter(where):
+            raise ValueError(f"search filters on partition fields only ({', '.join(PARTITION_COLUMNS)}), got {sorted(where)}")
+        clause, params = _where_sql(where)
+        matching = [r[0] for r in self._db.execute(f"SELECT code FROM partitions WHERE {clause}", params)]
+        if len(matching) == len(self._partition_codes):
+            return None
+        allowed = np.zeros(len(self._partition_codes), dtype=bool)
+        allowed[matching] = True
+        return allowed
+
+    def recall_at_k(self, query_vectors: np.ndarray, k: int = 10) -> Dict:
+        """
+        Compares quantized search with exact float32 search over the same
+        queries and reports recall@k and the resident memory per vector.
+        """
+        query_vectors = _normalize(np.atleast_2d(np.asarray(query_vectors, dtype=np.float32)))
+        with self._read_lock():
+            found = self.search(query_vectors, k)
+            expected = self._exact(query_vectors, k) if self._vectors is not None else [[] for _ in query_vectors]
+        recalls = [
+            len({row for row, _ in got} & {row for row, _ in want}) / len(want)
+            for got, want in zip(found, expected) if want
+        ]
+        float_bytes = (self.dim or 0) * 4
+        if self.quantization and self.dim:
+            code_bytes = code_shape(self.quantization, self.dim)[0] + (4 if self.quantization == "int8" else 0)
+        else:
+            code_bytes = float_bytes
+        return {
+            "quantization": self.quantization or "none",
+            "k": k,
+            "queries": len(recalls),
+            "recall_at_k": round(float(np.mean(recalls)), 4) if recalls else None,
+            "rows": self._rows,
+            "float32_bytes_per_vector": float_bytes,
+            "resident_bytes_per_vector": code_bytes,
+            "compression": round(float_bytes / code_bytes, 2) if code_bytes else None,
+        }
+
+    def sample_vectors(self, n: int, seed: int = 0) -> np.ndarray:
+        """Up to ``n`` stored (live) vectors chosen at random, e.g. as evaluation queries."""
+        with self._read_lock():
+            if self._vectors is None or self._rows == 0:
+                return np.zeros((0, self.dim or 0), dtype=np.float32)
+            live = np.flatnonzero(self._alive[:self._rows])
+            chosen = np.random.default_rng(seed).choice(live, size=min(n, len(live)), replace=False)
+            return np.asarray(self._vectors[np.sort(chosen)])
+
+    def lexical_search(self, match: str, k: int, where: Optional[Dict] = None) -> List[Tuple[int, float]]:
+        """
+        BM25 search over chunk text. ``match`` is an FTS5 MATCH expression
+        (see lexical.fts_query). Returns up to ``k`` (row, score) pairs, best
+        first; scores are positive, higher is better. ``where`` restricts hits
+        to chunks whose metadata matches (see filter_rows).
+        """
+        if not match or k <= 0:
+            return []
+        sql = "SELECT rowid, bm25(chunks_fts) AS score FROM chunks_fts WHERE chunks_fts MATCH ?"
+        params: List = [match]
+        if where:
+            clause, where_params = _filter_sql(where)
+            sql += f" AND rowid IN ({clause})"
+            params.extend(where_params)
+        with self._read_lock():
+            hits = self._db.execute(sql + " ORDER BY score LIMIT ?", params + [k]).fetchall()
+        return [(int(row), -float(score)) for row, score in hits]
+
+    def filter_rows(self, where: Dict) -> List[int]:
+        """
+        Rows whose metadata matches ``where``: ``{"field": value}`` for equality,
+        ``{"field": [v1, v2]}`` for any of several values (None matches a missing
+        field); fields are AND-ed. Filters on the partition fields ("tenant",
+        "type") are answered from an index, other fields scan the metadata,
+        including that of chunks collapsed into a row (a row matches if any
+        chunk it stands for does). Rows come back in ascending order, so
+        gathering their vectors reads the memory map front to back.
+        """
+        clause, params = _filter_sql(where)
+        with self._read_lock():
+            return [r[0] for r in self._db.execute(f"{clause} ORDER BY row", params)]
+
+    def get(self, rows: Sequence[int]) -> Dict[int, Dict]:
+        """
+        Fetches ``{"id", "text", "metadata", "sources"}`` for the given rows.
+        ``sources`` holds the metadata (plus "id") of every chunk the row stands
+        for: its own first, then the near-duplicates collapsed into it.
+        """
+        found = {}
+        rows = list(dict.fromkeys(int(r) for r in rows))
+        with self._read_lock():
+            for start in range(0, len(rows), 500):
+                batch = rows[start:start + 500]
+                placeholders = ",".join("?" * len(batch))
+                for row, chunk_id, doc, meta in self._db.execute(
+                    f"SELECT row, id, document, metadata FROM chunks WHERE row IN ({placeholders})", batch
+                ):
+                    metadata = json.loads(meta)
+                    found[row] = {"id": chunk_id, "text": doc, "metadata": metadata, "sources": [dict(metadata, id=chunk_id)]}
+                for row, chunk_id, meta in self._db.execute(
+                    f"SELECT row, id, metadata FROM chunk_refs WHERE row IN ({placeholders}) ORDER BY rowid", batch
+                ):
+                    if row in found:
+                        found[row]["sources"].append(dict(json.loads(meta), id=chunk_id))
+        return found
+
+    def close(self):
+        with self._lock:
+            self._flush()
+            self._db.close()
+            self._lock_file.close()
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+# Metadata fields stored in their own indexed columns of the chunks table
+PARTITION_COLUMNS = {"tenant": "tenant", "type": "doc_type"}
+
+
+def is_partition_filter(where: Optional[Dict]) -> bool:
+    """``where`` filters on partition fields only, so search can apply it from the partition codes."""
+    return bool(where) and all(field in PARTITION_COLUMNS for field in where)
+
+
+def _partition_key(metadata: Optional[Dict]) -> str:
+    """Near-duplicates are only collapsed within one tenant and document type."""
+    metadata = metadata or {}
+    return json.dumps([metadata.get("tenant"), metadata.get("type")])
+
+
+def _filter_sql(where: Dict) -> Tuple[str, List]:
+    """
+    Query for the rows matching ``where``. Collapsed references share their
+    row's partition, so only filters on other fields need to look at them.
+    """
+    clause, params = _where_sql(where)
+    if is_partition_filter(where):
+        return f"SELECT row FROM chunks WHERE {clause}", params
+    ref_clause, ref_params = _where_sql(where, partition_columns=False)
+    return f"SELECT row FROM chunks WHERE {clause} UNION SELECT row FROM chunk_refs WHERE {ref_clause}", params + ref_params
+
+
+def _where_sql(where: Dict, partition_columns: bool = True) -> Tuple[str, List]:
+    clauses, params = [], []
+    for field, value in where.items():
+        if field in PARTITION_COLUMNS and partition_columns:
+            column, column_params = PARTITION_COLUMNS[field], []
+        else:
+            column, column_params = "json_extract(metadata, ?)", ['$."' + str(field).replace('"', '""') + '"']
+        values = list(value) if isinstance(value, (list, tuple, set)) else [value]
+        present = [v for v in values if v is not None]
+        parts = []
+        if present:
+            parts.append(f"{column} IN ({','.join('?' * len(present))})")
+            params.extend(column_params + present)
+        if len(present) < len(values):
+            parts.append(f"{column} IS NULL")
+            params.extend(column_params)
+        clauses.append("(" + " OR ".join(parts) + ")" if parts else "0")
+    return " AND ".join(clauses) or "1", params
+
+
+def _top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    """Indices of the ``k`` highest scores, best first."""
+    if k >= len(scores):
+        return np.argsort(-scores)
+    candidates = np.argpartition(-scores, k)[:k]
+    return candidates[np.argsort(-scores[candidates])]
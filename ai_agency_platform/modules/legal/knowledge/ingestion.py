@@ -1,67 +1,315 @@
+import bisect
+import codecs
+import io
+import itertools
+import mmap
+import multiprocessing
 import os
-from typing import List
+import threading
+import zipfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+from xml.etree import ElementTree
 import pypdf
-from docx import Document
+
+from modules.legal.knowledge.chunker import TokenChunker
+from modules.legal.knowledge.page_cache import PageCache, file_digest
+
+# Processes extracting PDF pages in parallel, and pages handed to each per task
+PDF_WORKERS = int(os.getenv("PDF_WORKERS", str(min(4, os.cpu_count() or 1))))
+PDF_PAGES_PER_TASK = int(os.getenv("PDF_PAGES_PER_TASK", "16"))
+# How parsing processes are started. Never fork: the pools are created from
+# threaded processes (API server, ingestion pipeline), and a child forked while
+# another thread holds a lock (logging, the embedding queue...) can deadlock.
+PARSE_START_METHOD = os.getenv("PARSE_START_METHOD") or (
+    "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+)
+
+# WordprocessingML namespace of word/document.xml
+W_NS = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+# Bytes of a text file decoded per step
+TXT_BLOCK_SIZE = 1024 * 1024
+
+_pdf_pool: Optional[ProcessPoolExecutor] = None
+_pdf_pool_lock = threading.Lock()
+
+
+def parse_process_pool(max_workers: int) -> ProcessPoolExecutor:
+    """Process pool for parsing, started with PARSE_START_METHOD."""
+    return ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context(PARSE_START_METHOD))
+
+
+def _get_pdf_pool(max_workers: int) -> ProcessPoolExecutor:
+    """Process pool shared by all PDF extractions in this process."""
+    global _pdf_pool
+    with _pdf_pool_lock:
+        if _pdf_pool is None:
+            _pdf_pool = parse_process_pool(max_workers)
+        return _pdf_pool
+
+
+def _extract_pages(path: str, numbers: List[int], reader: pypdf.PdfReader = None) -> List[Tuple[int, str]]:
+    """
+    Worker-process entry point: extracts the text of the given 1-based pages.
+    """
+    reader = reader or pypdf.PdfReader(path)
+    return [(number, reader.pages[number - 1].extract_text() or "") for number in numbers]
+
+
+def iter_pdf_pages(
+    path: str,
+    max_workers: int = None,
+    pages_per_task: int = None,
+    page_cache: PageCache = None,
+) -> Iterator[Tuple[int, str]]:
+    """
+    Yields ``(page_number, text)`` for every page of a PDF, in page order.
+
+    Page ranges are extracted on a process pool, at most two tasks per worker
+    ahead of the consumer, so the first pages are available while later ones
+    are still being parsed. With ``page_cache``, pages extracted by an earlier
+    (e.g. failed) attempt are served from the cache and not parsed again.
+    """
+    max_workers = max_workers or PDF_WORKERS
+    pages_per_task = pages_per_task or PDF_PAGES_PER_TASK
+    reader = pypdf.PdfReader(path)
+    page_count = len(reader.pages)
+
+    digest = file_digest(path) if page_cache else None
+    cached = page_cache.get(digest) if page_cache else {}
+    missing = [number for number in range(1, page_count + 1) if number not in cached]
+    tasks = [missing[i:i + pages_per_task] for i in range(0, len(missing), pages_per_task)]
+
+    if max_workers <= 1 or len(tasks) <= 1:
+        # Not worth a round trip to the pool: extract in this process, lazily
+        extracted = (_extract_pages(path, task, reader) for task in tasks)
+    else:
+        extracted = _pooled(_get_pdf_pool(max_workers), path, tasks, ahead=max_workers * 2)
+
+    ready = dict(cached)
+    for number in range(1, page_count + 1):
+        while number not in ready:
+            pages = next(extracted)
+            if page_cache:
+                page_cache.put(digest, dict(pages))
+            ready.update(pages)
+        yield number, ready.pop(number)
+
+
+def _pooled(pool: ProcessPoolExecutor, path: str, tasks: List[List[int]], ahead: int) -> Iterator[List[Tuple[int, str]]]:
+    """Task results in submission order, keeping at most ``ahead`` tasks in flight."""
+    remaining = iter(tasks)
+    pending = deque(pool.submit(_extract_pages, path, task) for task in itertools.islice(remaining, ahead))
+    try:
+        while pending:
+            result = pending.popleft().result()
+            task = next(remaining, None)
+            if task is not None:
+                pending.append(pool.submit(_extract_pages, path, task))
+            yield result
+    finally:
+        for future in pending:
+            future.cancel()
+
+
+def iter_docx_paragraphs(path: str) -> Iterator[str]:
+    """
+    Yields the text of each paragraph of a DOCX file (body and tables, in
+    document order) by incrementally parsing ``word/document.xml`` straight
+    from the archive. Finished elements are discarded as parsing proceeds, so
+    memory stays flat no matter how long the document is.
+    """
+    with zipfile.ZipFile(path) as archive, archive.open("word/document.xml") as xml:
+        body = None
+        depth = 0
+        parts: List[str] = []
+        for event, elem in ElementTree.iterparse(xml, events=("start", "end")):
+            if event == "start":
+                depth += 1
+                if elem.tag == W_NS + "body":
+                    body, body_depth = elem, depth
+                continue
+
+            depth -= 1
+            tag = elem.tag
+            if tag == W_NS + "t":
+                parts.append(elem.text or "")
+            elif tag == W_NS + "tab":
+                parts.append("\t")
+            elif tag in (W_NS + "br", W_NS + "cr"):
+                parts.append("\n")
+            elif tag == W_NS + "p":
+                yield "".join(parts)
+                parts = []
+                elem.clear()
+            if body is not None and depth == body_depth:
+                # A top-level block (paragraph, table, ...) is done: drop it from the tree
+                body.clear()
+
+
+def iter_text_blocks(path: str, encoding: str = "utf-8", block_size: int = None) -> Iterator[str]:
+    """
+    Yields a text file as decoded blocks of about ``block_size`` bytes.
+    The file is memory-mapped and decoded incrementally (multi-byte
+    characters and CR LF pairs split across blocks are handled), with
+    universal newlines as in ``open(path, "r")``.
+    """
+    block_size = block_size or TXT_BLOCK_SIZE
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            decoder = io.IncrementalNewlineDecoder(codecs.getincrementaldecoder(encoding)("strict"), translate=True)
+            for start in range(0, len(mapped), block_size):
+                text = decoder.decode(mapped[start:start + block_size])
+                if text:
+                    yield text
+            tail = decoder.decode(b"", final=True)
+            if tail:
+                yield tail
+
 
 class DocumentParser:
     """
-    Parses various document formats into text chunks.
+    Parses various document formats into text chunks sized for the embedding model.
     Supported: PDF, DOCX, TXT.
     """
 
-    def parse_file(self, file_path: str) -> List[str]:
+    SUPPORTED_EXTENSIONS = (".pdf", ".docx", ".txt")
+
+    def __init__(self, strict: bool = False, chunker: TokenChunker = None, pdf_workers: int = None, page_cache: PageCache = None):
+        # In strict mode parse errors propagate instead of yielding no chunks
+        self.strict = strict
+        self._chunker = chunker
+        # 1 extracts PDF pages in-process (e.g. when already running in a worker process)
+        self.pdf_workers = pdf_workers
+        self.page_cache = page_cache
+        # Chunking statistics for the most recently parsed file
+        self.last_stats: Dict = {}
+
+    @property
+    def chunker(self) -> TokenChunker:
+        # Created on first use: extracting segments alone never loads the tokenizer
+        if self._chunker is None:
+            self._chunker = TokenChunker()
+        return self._chunker
+
+    def parse_file(self, file_path: str, on_page: Optional[Callable[[int], None]] = None) -> List[str]:
         """
         Reads a file and returns a list of text chunks.
+        ``on_page(page_number)`` is called as each PDF page is extracted.
         """
-        ext = os.path.splitext(file_path)[1].lower()
-        
-        if ext == ".pdf":
-            return self._parse_pdf(file_path)
-        elif ext == ".docx":
-            return self._parse_docx(file_path)
-        elif ext == ".txt":
-            return self._parse_txt(file_path)
-        else:
-            raise ValueError(f"Unsupported file format: {ext}")
+        return list(self.iter_chunks(file_path, on_page))
 
-    def _parse_pdf(self, path: str) -> List[str]:
-        print(f"[DocumentParser] Parsing PDF: {path}")
-        chunks = []
-        try:
-            reader = pypdf.PdfReader(path)
-            for i, page in enumerate(reader.pages):
-                text = page.extract_text()
-                if text:
-                    # Naive chunking by page for MVP
-                    chunks.append(f"[Page {i+1}] {text}")
-        except Exception as e:
-            print(f"Error parsing PDF: {e}")
-        return chunks
+    def iter_chunks(self, file_path: str, on_page: Optional[Callable[[int], None]] = None) -> Iterator[str]:
+        """
+        Streaming parse_file: PDF chunks are yielded as soon as the pages they
+        span have been extracted, so embedding can start on the first pages
+        while later ones are still being parsed. ``last_stats`` is set once
+        the iterator is exhausted.
+        """
+        kind = self._kind(file_path)
+        return self._parse(file_path, kind, on_page)
 
-    def _parse_docx(self, path: str) -> List[str]:
-        print(f"[DocumentParser] Parsing DOCX: {path}")
-        chunks = []
+    def _parse(self, path: str, kind: str, on_page: Optional[Callable[[int], None]]) -> Iterator[str]:
+        print(f"[DocumentParser] Parsing {kind}: {path}")
         try:
-            doc = Document(path)
-            current_chunk = ""
-            for para in doc.paragraphs:
-                if len(current_chunk) > 1000:
-                    chunks.append(current_chunk)
-                    current_chunk = ""
-                current_chunk += para.text + "\n"
-            if current_chunk:
-                chunks.append(current_chunk)
+            yield from self.chunk_segments(path, self.iter_segments(path, on_page))
         except Exception as e:
-            print(f"Error parsing DOCX: {e}")
-        return chunks
+            if self.strict:
+                raise
+            print(f"Error parsing {kind}: {e}")
 
-    def _parse_txt(self, path: str) -> List[str]:
-        print(f"[DocumentParser] Parsing TXT: {path}")
-        try:
-            with open(path, 'r', encoding='utf-8') as f:
-                text = f.read()
-                # Naive chunking by 1000 chars
-                return [text[i:i+1000] for i in range(0, len(text), 1000)]
-        except Exception as e:
-            print(f"Error parsing TXT: {e}")
-            return []
+    def iter_segments(self, file_path: str, on_page: Optional[Callable[[int], None]] = None) -> Iterator[Tuple[Optional[int], str]]:
+        """
+        Raw text of a file in reading order, without chunking:
+        ``(page_number, text)`` per non-empty PDF page, ``(None, paragraph)``
+        for DOCX and ``(None, block)`` for TXT.
+        """
+        kind = self._kind(file_path)
+        if kind == "PDF":
+            return self._pdf_pages(file_path, on_page)
+        if kind == "DOCX":
+            return ((None, text) for text in iter_docx_paragraphs(file_path))
+        return ((None, text) for text in iter_text_blocks(file_path))
+
+    def chunk_segments(self, file_path: str, segments: Iterable[Tuple[Optional[int], str]]) -> Iterator[str]:
+        """
+        Chunks the output of iter_segments (possibly produced elsewhere, e.g.
+        in another process). PDF chunks are tagged with the page they start on.
+        """
+        kind = self._kind(file_path)
+        if kind == "PDF":
+            # Chunk across page breaks; each chunk is tagged with the page it starts on
+            for number, chunk in self._chunk_stream(segments, baseline_per_segment=True):
+                yield f"[Page {number}] {chunk}"
+        else:
+            for _, chunk in self._chunk_stream(segments, separator="\n" if kind == "DOCX" else ""):
+                yield chunk
+
+    def _pdf_pages(self, path: str, on_page: Optional[Callable[[int], None]] = None) -> Iterator[Tuple[int, str]]:
+        for number, text in iter_pdf_pages(path, self.pdf_workers, page_cache=self.page_cache):
+            if on_page:
+                on_page(number)
+            if text:
+                yield number, text
+
+    def _kind(self, path: str) -> str:
+        ext = os.path.splitext(path)[1].lower()
+        if ext not in self.SUPPORTED_EXTENSIONS:
+            raise ValueError(f"Unsupported file format: {ext}")
+        return ext[1:].upper()
+
+    # Buffered characters before the stream is re-chunked; keeps re-splitting
+    # cost linear when segments (e.g. DOCX paragraphs) are much smaller than a chunk
+    STREAM_FLUSH_CHARS = 8192
+
+    def _chunk_stream(
+        self, segments: Iterable[Tuple[object, str]], separator: str = "\n", baseline_per_segment: bool = False
+    ) -> Iterator[Tuple[object, str]]:
+        """
+        Token-budgeted chunking of text that arrives in ``(label, text)``
+        segments (e.g. PDF pages), each followed by ``separator``. Yields
+        ``(label of the segment the chunk starts in, chunk)``.
+
+        Only the unfinished tail is kept: once enough text is buffered, every
+        chunk but the last is final and emitted, and chunking resumes from the
+        start of the last one. Records the comparison with the old slicing in
+        ``last_stats`` when the stream ends (``baseline_per_segment``: the old
+        parser produced one chunk per segment).
+        """
+        buffer = ""
+        buffer_offset = 0
+        # Start offsets and labels of the segments that overlap the buffer
+        segment_offsets: List[int] = []
+        labels: List[object] = []
+        segment_count = 0
+        chunk_tokens: List[int] = []
+
+        def emit(pieces):
+            for start, chunk, tokens in pieces:
+                chunk_tokens.append(tokens)
+                index = bisect.bisect_right(segment_offsets, buffer_offset + start) - 1
+                yield labels[max(index, 0)], chunk
+
+        for label, text in segments:
+            segment_offsets.append(buffer_offset + len(buffer))
+            labels.append(label)
+            segment_count += 1
+            buffer += text + separator
+            if len(buffer) < self.STREAM_FLUSH_CHARS:
+                continue
+            pieces = self.chunker.split(buffer)
+            if len(pieces) > 1:
+                yield from emit(pieces[:-1])
+                cut = pieces[-1][0]
+                buffer = buffer[cut:]
+                buffer_offset += cut
+                # Forget segments that end before the buffer
+                keep = max(bisect.bisect_right(segment_offsets, buffer_offset) - 1, 0)
+                del segment_offsets[:keep], labels[:keep]
+
+        yield from emit(self.chunker.split(buffer))
+        text_length = buffer_offset + len(buffer)
+        self.last_stats = self.chunker.stats(text_length, chunk_tokens, segment_count if baseline_per_segment else None)
@@ -0,0 +1,232 @@
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+from modules.legal.knowledge.bulk import BulkIngestor
+from modules.legal.knowledge.chunker import with_embedding_savings
+from modules.legal.knowledge.page_cache import get_page_cache
+from modules.legal.knowledge.pipeline import IngestionPipeline
+from modules.legal.knowledge.vector_store import VectorStore
+
+
+class IngestionJob:
+    """
+    Status and progress of one background ingestion.
+    """
+
+    def __init__(self, filename: str, path: str, metadata: Dict, kind: str = "file"):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.filename = filename
+        self.path = path
+        self.metadata = metadata
+        self.status = "queued"
+        self.error: Optional[str] = None
+        self.pages_parsed = 0
+        self.chunks_total = 0
+        self.chunks_embedded = 0
+        self.chunks_indexed = 0
+        self.files_total = 0
+        self.files_parsed = 0
+        self.files_failed = 0
+        self.report: Optional[Dict] = None
+        self.chunk_stats: Optional[Dict] = None
+        self.document_id: Optional[str] = None
+        self.pipeline: Optional[IngestionPipeline] = None
+        self._lock = threading.Lock()
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+
+    def on_progress(self, stage: str, count: int):
+        """Progress callback shared by IngestionPipeline, VectorStore and BulkIngestor; called from many threads."""
+        with self._lock:
+            if stage == "page_parsed":
+                self.pages_parsed += count
+            elif stage == "chunked":
+                self.chunks_total += count
+            elif stage == "embedded":
+                self.chunks_embedded += count
+            elif stage == "indexed":
+                self.chunks_indexed += count
+            elif stage == "files_total":
+                self.files_total = count
+            elif stage == "file_parsed":
+                self.files_parsed += count
+            elif stage == "file_failed":
+                self.files_failed += count
+
+    def to_dict(self) -> Dict:
+        progress = {
+            "pages_parsed": self.pages_parsed,
+            "chunks_total": self.chunks_total,
+            "chunks_embedded": self.chunks_embedded,
+            "chunks_indexed": self.chunks_indexed,
+        }
+        if self.kind == "bulk":
+            progress.update({
+                "files_total": self.files_total,
+                "files_parsed": self.files_parsed,
+                "files_failed": self.files_failed,
+            })
+        return {
+            "job_id": self.id,
+            "kind": self.kind,
+            "document_id": self.document_id,
+            "filename": self.filename,
+            "status": self.status,
+            "error": self.error,
+            "progress": progress,
+            "report": self.report,
+            "chunk_stats": self.chunk_stats,
+            "stages": self.pipeline.stats() if self.pipeline else None,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+
+
+class IngestionJobManager:
+    """
+    Runs ingestion jobs on a bounded worker pool and tracks their progress.
+    Finished jobs are kept (up to ``history``) so clients can poll for results.
+    Jobs write to ``store`` (default: a VectorStore on the default collection).
+
+    Jobs for the same document id run one at a time, in submission order: two
+    concurrent versions would each treat the other's chunks as stale and
+    delete them.
+    """
+
+    def __init__(self, max_workers: int = 2, history: int = 1000, store: VectorStore = None):
+        self.history = history
+        self.store = store
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="ingest")
+        self._jobs: "OrderedDict[str, IngestionJob]" = OrderedDict()
+        self._lock = threading.Lock()
+        # Document ids with a job queued or running, and the jobs waiting behind it
+        self._waiting: Dict[str, "deque[IngestionJob]"] = {}
+
+    def submit(self, path: str, filename: str, metadata: Dict = None, document_id: str = None) -> IngestionJob:
+        """
+        Queues a spooled file for ingestion. The file is deleted once the job ends.
+        ``document_id`` (default: the filename) identifies the document across
+        versions, so re-uploads only re-index the chunks that changed.
+        """
+        job = IngestionJob(filename, path, metadata or {"source": filename, "type": "document"})
+        job.document_id = document_id or filename
+        with self._lock:
+            self._jobs[job.id] = job
+            self._trim()
+            waiting = self._waiting.get(job.document_id)
+            if waiting is not None:
+                # Started by the job ahead of it once that one ends
+                waiting.append(job)
+                return job
+            self._waiting[job.document_id] = deque()
+        self._pool.submit(self._run, job)
+        return job
+
+    def submit_bulk(self, path: str, filename: str, doc_type: str = "document", tenant: str = None) -> IngestionJob:
+        """
+        Queues a spooled zip archive for bulk ingestion (see BulkIngestor).
+        """
+        job = IngestionJob(filename, path, {"type": doc_type, "tenant": tenant}, kind="bulk")
+        with self._lock:
+            self._jobs[job.id] = job
+            self._trim()
+        self._pool.submit(self._run_bulk, job)
+        return job
+
+    def get(self, job_id: str) -> Optional[IngestionJob]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def list(self) -> List[IngestionJob]:
+        with self._lock:
+            return list(self._jobs.values())
+
+    def _trim(self):
+        while len(self._jobs) > self.history:
+            oldest_id, oldest = next(iter(self._jobs.items()))
+            if oldest.status in ("queued", "running"):
+                break
+            del self._jobs[oldest_id]
+
+    def _run(self, job: IngestionJob):
+        job.status = "running"
+        job.started_at = time.time()
+        try:
+            # Pages are chunked and embedded while later ones are still being extracted;
+            # a parse error fails the job instead of indexing a truncated version
+            store = self.store or VectorStore()
+            job.pipeline = IngestionPipeline(store=store, page_cache=get_page_cache(), progress=job.on_progress)
+            doc = job.pipeline.run([(job.path, job.document_id, job.metadata)])[0]
+            if doc.error is not None:
+                raise doc.error
+            job.report = doc.report
+            job.chunk_stats = with_embedding_savings(doc.chunk_stats, store.embedding_engine.stats())
+            job.status = "completed"
+        except Exception as e:
+            self._fail(job, e)
+        finally:
+            self._finish(job)
+            self._start_next(job.document_id)
+
+    def _start_next(self, document_id: str):
+        """Starts the next job queued for a document, if any."""
+        with self._lock:
+            waiting = self._waiting[document_id]
+            if not waiting:
+                del self._waiting[document_id]
+                return
+            job = waiting.popleft()
+        self._pool.submit(self._run, job)
+
+    def _run_bulk(self, job: IngestionJob):
+        job.status = "running"
+        job.started_at = time.time()
+        try:
+            ingestor = BulkIngestor(store=self.store, doc_type=job.metadata["type"], tenant=job.metadata["tenant"])
+            job.pipeline = ingestor.pipeline
+            report = ingestor.ingest(job.path, progress=job.on_progress)
+            job.report = report
+            job.chunks_total = report["chunks_added"]
+            job.status = "completed"
+        except Exception as e:
+            self._fail(job, e)
+        finally:
+            self._finish(job)
+
+    @staticmethod
+    def _fail(job: IngestionJob, error: Exception):
+        job.status = "failed"
+        job.error = str(error)
+        print(f"[IngestionJobManager] Job {job.id} failed: {error}")
+
+    @staticmethod
+    def _finish(job: IngestionJob):
+        job.finished_at = time.time()
+        try:
+            os.remove(job.path)
+        except OSError:
+            pass
+
+
+_manager: Optional[IngestionJobManager] = None
+_manager_lock = threading.Lock()
+
+
+def get_job_manager() -> IngestionJobManager:
+    """
+    Returns the shared job manager for this process.
+    """
+    global _manager
+    if _manager is None:
+        with _manager_lock:
+            if _manager is None:
+                _manager = IngestionJobManager(max_workers=int(os.getenv("INGEST_WORKERS", "2")))
+    return _manager
@@ -0,0 +1,52 @@
+import re
+from typing import Dict, Hashable, List, Sequence
+
+# Quoted phrases and bare terms (letters/digits, optionally joined by . - /) in a user query
+QUERY_TOKEN = re.compile(r'"([^"]+)"|([\w§]+(?:[.\-/][\w]+)*)')
+
+# Statute/case citations: "42 U.S.C. § 1983", "Cal. Civ. Code 1542", "Section 2.3", "123 F.3d 456"
+CITATION_PATTERN = re.compile(
+    r"§|\b\d+\s+U\.?S\.?C\.?|\bU\.S\.C\b|\b(?:Section|Sec\.|Art\.|Article|Rule)\s+\d|\b\d+\s+[A-Z][\w.]*\s+\d+\b"
+)
+
+# Words that carry no lexical signal in legal queries
+STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "for", "from", "in", "is", "it",
+    "of", "on", "or", "that", "the", "this", "to", "was", "with",
+}
+
+
+def fts_query(text: str) -> str:
+    """
+    Turns free text into an FTS5 MATCH expression: every quoted phrase and
+    non-stopword term becomes a quoted token, OR-ed together, so user input
+    can never be interpreted as FTS5 syntax.
+    """
+    parts = []
+    for phrase, term in QUERY_TOKEN.findall(text):
+        token = (phrase or term).strip()
+        if not token or token.lower() in STOPWORDS:
+            continue
+        if token == "§":
+            continue
+        parts.append('"' + token.replace('"', '""') + '"')
+    return " OR ".join(dict.fromkeys(parts))
+
+
+def is_citation_query(text: str) -> bool:
+    """
+    True for queries that reference a specific statute, section or reporter
+    citation, where exact lexical matches beat semantic similarity.
+    """
+    return bool(CITATION_PATTERN.search(text))
+
+
+def reciprocal_rank_fusion(rankings: Sequence[Sequence[Hashable]], k: int = 60) -> List[Hashable]:
+    """
+    Fuses ranked lists: score(d) = sum over lists of 1 / (k + rank(d)).
+    """
+    scores: Dict[Hashable, float] = {}
+    for ranking in rankings:
+        for rank, key in enumerate(ranking, 1):
+            scores[key] = scores.get(key, 0.0) + 1.0 / (k + rank)
+    return sorted(scores, key=lambda key: scores[key], reverse=True)
@@ -0,0 +1,110 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, Optional
+
+
+def file_digest(path: str, block_size: int = 1024 * 1024) -> str:
+    """
+    Stable digest of a file's bytes, read in blocks.
+    """
+    h = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+class PageCache:
+    """
+    Persistent cache of extracted page text, keyed by document content digest.
+
+    Pages are stored as they are extracted, so when ingesting a document is
+    retried (after a crash, a failed embedding call, ...) only pages that were
+    never extracted are parsed again. The least recently used documents are
+    dropped once more than ``max_documents`` are cached.
+    """
+
+    FILE = "pages.sqlite"
+
+    def __init__(self, path: str, max_documents: int = 256):
+        self.path = path
+        self.max_documents = max_documents
+        os.makedirs(path, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(os.path.join(path, self.FILE), check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("CREATE TABLE IF NOT EXISTS documents (digest TEXT PRIMARY KEY, used REAL NOT NULL)")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS pages ("
+            " digest TEXT NOT NULL,"
+            " page INTEGER NOT NULL,"
+            " text TEXT NOT NULL,"
+            " PRIMARY KEY (digest, page))"
+        )
+        self._db.commit()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, digest: str) -> Dict[int, str]:
+        """
+        All cached pages of a document as ``{page_number: text}``.
+        """
+        with self._lock:
+            pages = dict(self._db.execute("SELECT page, text FROM pages WHERE digest = ?", (digest,)))
+            if pages:
+                self.hits += 1
+                self._db.execute("UPDATE documents SET used = ? WHERE digest = ?", (time.time(), digest))
+                self._db.commit()
+            else:
+                self.misses += 1
+            return pages
+
+    def put(self, digest: str, pages: Dict[int, str]):
+        """
+        Stores newly extracted pages of a document.
+        """
+        if not pages:
+            return
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO documents (digest, used) VALUES (?, ?)", (digest, time.time()))
+            self._db.executemany(
+                "INSERT OR REPLACE INTO pages (digest, page, text) VALUES (?, ?, ?)",
+                [(digest, number, text) for number, text in pages.items()],
+            )
+            stale = [
+                row[0] for row in self._db.execute(
+                    "SELECT digest FROM documents ORDER BY used DESC LIMIT -1 OFFSET ?", (self.max_documents,)
+                )
+            ]
+            for old in stale:
+                self._db.execute("DELETE FROM pages WHERE digest = ?", (old,))
+                self._db.execute("DELETE FROM documents WHERE digest = ?", (old,))
+            self._db.commit()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            documents = self._db.execute("SELECT COUNT(*) FROM documents").fetchone()[0]
+            return {"documents": documents, "hits": self.hits, "misses": self.misses}
+
+
+_cache: Optional[PageCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_page_cache() -> PageCache:
+    """
+    Returns the shared page-text cache for this process.
+    """
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = PageCache(
+                    os.getenv("PAGE_CACHE_DIR", os.path.join(os.getcwd(), "data", "page_cache")),
+                    max_documents=int(os.getenv("PAGE_CACHE_DOCUMENTS", "256")),
+                )
+    return _cache
@@ -0,0 +1,477 @@
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from modules.legal.knowledge.chunker import TokenChunker
+from modules.legal.knowledge.embeddings import PRIORITY_INGEST
+from modules.legal.knowledge.ingestion import PARSE_START_METHOD, DocumentParser, parse_process_pool
+from modules.legal.knowledge.page_cache import PageCache
+from modules.legal.knowledge.vector_store import DocumentUpdate, VectorStore
+
+# Marks the end of a queue's input (one per worker) and of a document's segments
+_STOP = object()
+_END = object()
+
+
+# Segments per batch sent back from a parse process, and batches buffered per document
+PARSE_BATCH_SEGMENTS = int(os.getenv("PARSE_BATCH_SEGMENTS", "32"))
+PARSE_BATCHES_AHEAD = 2
+
+
+def _extract_segments(path: str, out, batch_size: int):
+    """
+    Worker-process entry point: streams the raw text segments of one file to
+    ``out`` (a bounded manager queue) in lists of ``batch_size``, then None.
+    Only a couple of batches are ever in flight, however long the file is.
+    """
+    batch = []
+    try:
+        for segment in DocumentParser(strict=True, pdf_workers=1).iter_segments(path):
+            batch.append(segment)
+            if len(batch) >= batch_size:
+                out.put(batch)
+                batch = []
+        if batch:
+            out.put(batch)
+    finally:
+        out.put(None)
+
+
+class PipelineDocument:
+    """
+    One document moving through the pipeline, and its outcome.
+    """
+
+    def __init__(self, path: str, doc_id: str, metadata: Dict):
+        self.path = path
+        self.doc_id = doc_id
+        self.metadata = metadata
+        self.update: Optional[DocumentUpdate] = None
+        self.report: Optional[Dict] = None
+        self.chunk_stats: Dict = {}
+        self.error: Optional[BaseException] = None
+        # Chunk ids already written to the index, removed again if the document fails
+        self.written: List[str] = []
+        self._lock = threading.Lock()
+        self._batches_sent = 0
+        self._batches_done = 0
+        self._batches_total: Optional[int] = None
+
+    def fail(self, error: BaseException):
+        with self._lock:
+            if self.error is None:
+                self.error = error
+
+    def _batch_sent(self):
+        with self._lock:
+            self._batches_sent += 1
+
+    def _batch_done(self) -> bool:
+        with self._lock:
+            self._batches_done += 1
+            return self._batches_done == self._batches_total
+
+    def _ended(self) -> bool:
+        """Called once no more batches will be sent; True if all are already written."""
+        with self._lock:
+            self._batches_total = self._batches_sent
+            return self._batches_done == self._batches_total
+
+
+class _Segments:
+    """Segments of one document, handed from its parse worker to a chunk worker."""
+
+    def __init__(self, doc: PipelineDocument, maxsize: int):
+        self.doc = doc
+        self.queue: "queue.Queue" = queue.Queue(maxsize=maxsize)
+
+
+class _Batch:
+    """New chunks of one document on their way to the index."""
+
+    def __init__(self, doc: PipelineDocument, ids: List[str], texts: List[str], metadatas: List[Dict]):
+        self.doc = doc
+        self.ids = ids
+        self.texts = texts
+        self.metadatas = metadatas
+        self.vectors: Optional[np.ndarray] = None
+
+
+class _DocumentEnd:
+    """Follows a document's last batch through the embed and index stages."""
+
+    def __init__(self, doc: PipelineDocument):
+        self.doc = doc
+
+
+class Stage:
+    """
+    A pipeline stage: a bounded input queue drained by ``workers`` threads.
+
+    Tracks items processed and where worker time goes: ``active_s`` doing
+    work, ``starved_s`` waiting for input in the middle of an item and
+    ``blocked_s`` waiting for room in the next stage's queue. The stage with
+    the highest utilization is the bottleneck; a stage that is mostly
+    blocked is being held back by the one after it.
+    """
+
+    def __init__(self, name: str, workers: int, queue_size: int):
+        self.name = name
+        self.workers = max(1, workers)
+        self.queue: "queue.Queue" = queue.Queue(maxsize=queue_size)
+        self.queue_size = queue_size
+        self.items = 0
+        self.max_depth = 0
+        self.busy_s = 0.0
+        self.blocked_s = 0.0
+        self.starved_s = 0.0
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self._lock = threading.Lock()
+
+    def put(self, item, producer: "Stage" = None):
+        started = time.perf_counter()
+        self.queue.put(item)
+        depth = self.queue.qsize()
+        with self._lock:
+            self.max_depth = max(self.max_depth, depth)
+        if producer is not None:
+            producer.record(blocked=time.perf_counter() - started)
+
+    def record(self, items: int = 0, busy: float = 0.0, blocked: float = 0.0, starved: float = 0.0):
+        with self._lock:
+            self.items += items
+            self.busy_s += busy
+            self.blocked_s += blocked
+            self.starved_s += starved
+
+    def stats(self) -> Dict:
+        with self._lock:
+            end = self.finished_at or time.perf_counter()
+            wall = end - self.started_at if self.started_at else 0.0
+            active = max(0.0, self.busy_s - self.blocked_s - self.starved_s)
+            return {
+                "workers": self.workers,
+                "items": self.items,
+                "items_per_sec": round(self.items / wall, 2) if wall else 0.0,
+                "active_s": round(active, 3),
+                "blocked_s": round(self.blocked_s, 3),
+                "starved_s": round(self.starved_s, 3),
+                "utilization": round(active / (wall * self.workers), 3) if wall else 0.0,
+                "queue_depth": self.queue.qsize(),
+                "max_queue_depth": self.max_depth,
+                "queue_size": self.queue_size,
+            }
+
+
+class IngestionPipeline:
+    """
+    Ingests documents through four overlapping stages connected by bounded queues:
+
+        parse  - extracts raw text segments (pages, paragraphs, blocks); runs in
+                 threads, or drives a process pool when ``parse_processes`` is set
+        chunk  - token-budgets segments into chunks and diffs them against the
+                 document's current version; only new chunks continue
+        embed  - embeds new chunks, combining queued batches up to ``batch_size``
+        index  - writes vectors to the index; once a document's last batch is
+                 written, stale chunks are removed and the version recorded
+
+    A slow stage fills its input queue and blocks the stages before it, so
+    memory stays bounded. ``stats()`` reports per-stage throughput, time split
+    and queue depth while the pipeline runs and after it finishes.
+
+    ``progress(stage, n)`` receives "page_parsed", "file_parsed", "chunked",
+    "embedded", "indexed" and "file_failed" events.
+    """
+
+    def __init__(
+        self,
+        store: VectorStore = None,
+        parse_workers: int = None,
+        chunk_workers: int = None,
+        embed_workers: int = None,
+        index_workers: int = None,
+        queue_size: int = None,
+        batch_size: int = None,
+        parse_processes: int = 0,
+        chunker: TokenChunker = None,
+        page_cache: PageCache = None,
+        progress: Callable[[str, int], None] = None,
+    ):
+        self.store = store or VectorStore()
+        self.batch_size = batch_size or VectorStore.WRITE_BATCH_SIZE
+        self.parse_processes = parse_processes
+        self.chunker = chunker or TokenChunker()
+        self.page_cache = page_cache
+        self.progress = progress
+        queue_size = queue_size or int(os.getenv("INGEST_QUEUE_SIZE", "8"))
+        self.parse = Stage("parse", parse_workers or parse_processes or int(os.getenv("INGEST_PARSE_WORKERS", "2")), queue_size)
+        self.chunk = Stage("chunk", chunk_workers or int(os.getenv("INGEST_CHUNK_WORKERS", "2")), queue_size)
+        self.embed = Stage("embed", embed_workers or int(os.getenv("INGEST_EMBED_WORKERS", "2")), queue_size)
+        self.index = Stage("index", index_workers or int(os.getenv("INGEST_INDEX_WORKERS", "1")), queue_size)
+        self.stages = [self.parse, self.chunk, self.embed, self.index]
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._manager = None
+
+    def stats(self) -> Dict:
+        return {stage.name: stage.stats() for stage in self.stages}
+
+    def run(self, documents: Sequence[Tuple[str, str, Dict]]) -> List[PipelineDocument]:
+        """
+        Ingests ``(path, doc_id, metadata)`` triples as versioned documents
+        (see VectorStore.upsert_document). Blocks until all are done and
+        returns their outcomes in input order; failures are recorded on the
+        document rather than raised.
+        """
+        docs = [PipelineDocument(path, doc_id, metadata) for path, doc_id, metadata in documents]
+        if self.parse_processes:
+            self._pool = parse_process_pool(self.parse_processes)
+            self._manager = multiprocessing.get_context(PARSE_START_METHOD).Manager()
+        try:
+            workers = {
+                self.parse: self._parse_worker,
+                self.chunk: self._chunk_worker,
+                self.embed: self._embed_worker,
+                self.index: self._index_worker,
+            }
+            threads = {}
+            for stage, target in workers.items():
+                stage.started_at = time.perf_counter()
+                threads[stage] = [
+                    threading.Thread(target=target, name=f"ingest-{stage.name}-{i}", daemon=True)
+                    for i in range(stage.workers)
+                ]
+                for thread in threads[stage]:
+                    thread.start()
+
+            for doc in docs:
+                self.parse.put(doc)
+            # Shut stages down front to back, so each drains its input first
+            for stage in self.stages:
+                for _ in range(stage.workers):
+                    stage.put(_STOP)
+                for thread in threads[stage]:
+                    thread.join()
+                stage.finished_at = time.perf_counter()
+        finally:
+            if self._pool is not None:
+                self._pool.shutdown()
+                self._pool = None
+            if self._manager is not None:
+                self._manager.shutdown()
+                self._manager = None
+        return docs
+
+    def _emit(self, stage: str, count: int):
+        if self.progress and count:
+            self.progress(stage, count)
+
+    # ------------------------------------------------------------------ #
+    # Stages
+    # ------------------------------------------------------------------ #
+
+    def _parse_worker(self):
+        while True:
+            doc = self.parse.queue.get()
+            if doc is _STOP:
+                return
+            started = time.perf_counter()
+            segments = _Segments(doc, maxsize=self.parse.queue_size * 4)
+            self.chunk.put(segments, producer=self.parse)
+            count = 0
+            try:
+                if self._pool is not None:
+                    parsed = self._pooled_segments(doc.path)
+                else:
+                    parser = DocumentParser(strict=True, page_cache=self.page_cache)
+                    parsed = parser.iter_segments(doc.path, on_page=lambda number: self._emit("page_parsed", 1))
+                for segment in parsed:
+                    self._put_segment(segments, segment)
+                    count += 1
+                self._emit("file_parsed", 1)
+            except Exception as e:
+                self._put_segment(segments, e)
+            self._put_segment(segments, _END)
+            self.parse.record(items=count, busy=time.perf_counter() - started)
+
+    def _pooled_segments(self, path: str) -> Iterator[Tuple[Optional[int], str]]:
+        """Segments of ``path`` as a pool process extracts them, a batch at a time."""
+        out = self._manager.Queue(maxsize=PARSE_BATCHES_AHEAD)
+        future = self._pool.submit(_extract_segments, path, out, PARSE_BATCH_SEGMENTS)
+        while True:
+            try:
+                batch = out.get(timeout=1.0)
+            except queue.Empty:
+                # A worker that died (e.g. killed) never sends its end marker
+                if future.done() and out.empty():
+                    future.result()
+                    raise RuntimeError(f"Parse process exited without finishing {path}")
+                continue
+            if batch is None:
+                break
+            yield from batch
+        # Raises the worker's parse error, if any
+        future.result()
+
+    def _put_segment(self, segments: _Segments, item):
+        started = time.perf_counter()
+        segments.queue.put(item)
+        self.parse.record(blocked=time.perf_counter() - started)
+
+    def _chunk_worker(self):
+        while True:
+            segments = self.chunk.queue.get()
+            if segments is _STOP:
+                return
+            started = time.perf_counter()
+            doc = segments.doc
+            count = 0
+            ids, texts, metas = [], [], []
+            try:
+                parser = DocumentParser(strict=True, chunker=self.chunker)
+                doc.update = self.store.begin_document(doc.doc_id, doc.metadata)
+                for chunk in parser.chunk_segments(doc.path, self._segments(segments)):
+                    count += 1
+                    chunk_id, meta = doc.update.add(chunk)
+                    if meta is not None:
+                        ids.append(chunk_id)
+                        texts.append(chunk)
+                        metas.append(meta)
+                    if len(ids) >= self.batch_size:
+                        self._send_batch(doc, ids, texts, metas)
+                        ids, texts, metas = [], [], []
+                self._send_batch(doc, ids, texts, metas)
+                doc.chunk_stats = parser.last_stats
+            except Exception as e:
+                doc.fail(e)
+                self._drain(segments)
+            self._emit("chunked", count)
+            self.embed.put(_DocumentEnd(doc), producer=self.chunk)
+            self.chunk.record(items=count, busy=time.perf_counter() - started)
+
+    def _segments(self, segments: _Segments):
+        while True:
+            started = time.perf_counter()
+            item = segments.queue.get()
+            self.chunk.record(starved=time.perf_counter() - started)
+            if item is _END:
+                return
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+
+    @staticmethod
+    def _drain(segments: _Segments):
+        """Consumes a failed document's remaining segments so its parse worker can finish."""
+        while segments.queue.get() is not _END:
+            pass
+
+    def _send_batch(self, doc: PipelineDocument, ids: List[str], texts: List[str], metas: List[Dict]):
+        if ids:
+            doc._batch_sent()
+            self.embed.put(_Batch(doc, ids, texts, metas), producer=self.chunk)
+
+    def _embed_worker(self):
+        while True:
+            items, stop = self._take(self.embed, lambda item: len(item.ids) if isinstance(item, _Batch) else 0)
+            if not items:
+                return
+            started = time.perf_counter()
+            batches = [item for item in items if isinstance(item, _Batch) and item.doc.error is None]
+            texts = [text for batch in batches for text in batch.texts]
+            if texts:
+                try:
+                    # One engine call for every batch taken, across documents
+                    vectors = self.store.embedding_engine.embed(texts, priority=PRIORITY_INGEST)
+                    offset = 0
+                    for batch in batches:
+                        batch.vectors = vectors[offset:offset + len(batch.ids)]
+                        offset += len(batch.ids)
+                    self._emit("embedded", len(texts))
+                except Exception as e:
+                    for batch in batches:
+                        batch.doc.fail(e)
+            # Ends are forwarded after the batches taken with them
+            self.index.put(items, producer=self.embed)
+            self.embed.record(items=len(texts), busy=time.perf_counter() - started)
+            if stop:
+                return
+
+    def _index_worker(self):
+        while True:
+            taken, stop = self._take(self.index, lambda items: sum(len(i.ids) for i in items if isinstance(i, _Batch)))
+            started = time.perf_counter()
+            items = [item for group in taken for item in group]
+            batches = [item for item in items if isinstance(item, _Batch)]
+            ready = [batch for batch in batches if batch.vectors is not None and batch.doc.error is None]
+            written = sum(len(batch.ids) for batch in ready)
+            if ready:
+                try:
+                    # One index write (and commit) for every batch taken
+                    self.store.index.upsert(
+                        [chunk_id for batch in ready for chunk_id in batch.ids],
+                        np.concatenate([batch.vectors for batch in ready]),
+                        [text for batch in ready for text in batch.texts],
+                        [meta for batch in ready for meta in batch.metadatas],
+                        doc_ids=[batch.doc.doc_id for batch in ready for _ in batch.ids],
+                    )
+                    for batch in ready:
+                        batch.doc.written.extend(batch.ids)
+                    self._emit("indexed", written)
+                except Exception as e:
+                    written = 0
+                    for batch in ready:
+                        batch.doc.fail(e)
+
+            complete = [batch.doc for batch in batches if batch.doc._batch_done()]
+            complete += [item.doc for item in items if isinstance(item, _DocumentEnd) and item.doc._ended()]
+            for doc in complete:
+                self._finish(doc)
+            self.index.record(items=written, busy=time.perf_counter() - started)
+            if stop:
+                return
+
+    def _finish(self, doc: PipelineDocument):
+        if doc.error is None:
+            try:
+                doc.report = self.store.finish_document(doc.update)
+                return
+            except Exception as e:
+                doc.fail(e)
+        print(f"[IngestionPipeline] {doc.path} failed: {doc.error}")
+        # Chunks of the failed version that reached the index before the failure;
+        # the previous version's chunks are left as they were
+        added = [chunk_id for chunk_id in doc.written if doc.update is None or chunk_id not in doc.update.existing]
+        if added:
+            try:
+                self.store.index.delete(added)
+            except Exception as e:
+                print(f"[IngestionPipeline] Could not remove {len(added)} chunks of failed {doc.path}: {e}")
+        self._emit("file_failed", 1)
+
+    def _take(self, stage: Stage, size: Callable[[object], int]) -> Tuple[List, bool]:
+        """
+        Blocks for one item, then takes whatever else is already queued, up to
+        ``batch_size`` chunks. Returns the items and whether a stop was seen.
+        """
+        item = stage.queue.get()
+        if item is _STOP:
+            return [], True
+        items = [item]
+        total = size(item)
+        while total < self.batch_size:
+            try:
+                item = stage.queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is _STOP:
+                return items, True
+            items.append(item)
+            total += size(item)
+        return items, False
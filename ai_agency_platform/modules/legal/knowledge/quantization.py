@@ -0,0 +1,87 @@
+import argparse
+import json
+import os
+import sys
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+# Allow running as a script from the platform root
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", ".."))
+
+# Supported compact code formats for the approximate search pass
+QUANTIZATIONS = ("int8", "binary")
+
+
+def code_shape(quantization: str, dim: int) -> Tuple[int, np.dtype]:
+    """Bytes per vector and dtype of the codes for ``quantization``."""
+    if quantization == "int8":
+        return dim, np.dtype(np.int8)
+    if quantization == "binary":
+        return (dim + 7) // 8, np.dtype(np.uint8)
+    raise ValueError(f"Unknown quantization: {quantization}")
+
+
+def quantize(quantization: str, vectors: np.ndarray) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+    """
+    Encodes L2-normalized float vectors as compact codes.
+
+    int8:   per-vector symmetric scaling, ``v ~= code * scale`` (4x smaller)
+    binary: one sign bit per dimension, packed (32x smaller)
+
+    Returns ``(codes, scales)``; scales is None for binary codes.
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if quantization == "int8":
+        peak = np.abs(vectors).max(axis=1)
+        scales = np.where(peak > 0, peak / 127.0, 1.0).astype(np.float32)
+        codes = np.clip(np.rint(vectors / scales[:, None]), -127, 127).astype(np.int8)
+        return codes, scales
+    if quantization == "binary":
+        return np.packbits(vectors > 0, axis=1), None
+    raise ValueError(f"Unknown quantization: {quantization}")
+
+
+def approximate_scores(quantization: str, codes: np.ndarray, scales: Optional[np.ndarray], queries: np.ndarray) -> np.ndarray:
+    """
+    Approximate similarity of every code row to every query, shape
+    ``(len(codes), len(queries))``; higher is more similar.
+
+    Both formats are scored asymmetrically against the float queries: int8
+    codes are dequantized, and for binary codes ``bits . q`` ranks rows like
+    ``signs . q`` (since ``signs = 2 * bits - 1`` and ``sum(q)`` is fixed per query).
+
+    Codes save memory, not time: numpy's integer matmul has no BLAS path and
+    is slower still than dequantizing, so the scan is no faster than exact
+    float32 search and quantization stays opt-in for indexes that outgrow RAM.
+    """
+    if quantization == "int8":
+        return (codes.astype(np.float32) @ queries.T) * scales[:, None]
+    if quantization == "binary":
+        bits = np.unpackbits(codes, axis=1, count=queries.shape[1])
+        return bits.astype(np.float32) @ queries.T
+    raise ValueError(f"Unknown quantization: {quantization}")
+
+
+def main(argv: List[str] = None):
+    from modules.legal.knowledge.index import MemmapIndex
+
+    parser = argparse.ArgumentParser(
+        description="Quantize a collection's search index and report recall@k against exact float32 search."
+    )
+    parser.add_argument("path", help="Collection directory (e.g. data/vector_store/legal_knowledge)")
+    parser.add_argument("--quantization", choices=QUANTIZATIONS, default="int8")
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--queries", type=int, default=200, help="Stored vectors sampled as queries")
+    args = parser.parse_args(argv)
+
+    # Opening with a quantization builds (and persists) the codes for existing rows
+    index = MemmapIndex(args.path, quantization=args.quantization)
+    report = index.recall_at_k(index.sample_vectors(args.queries), args.k)
+    print(json.dumps(report, indent=2))
+    index.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,101 @@
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Hashable, List, Optional, Tuple
+
+
+def retrieval_key(spec: Dict, scope: str = "") -> Tuple:
+    """
+    Cache key for a VectorStore.query_many spec: the collection searched
+    (``scope``, e.g. the index path), the query with case and whitespace
+    normalized, plus every option that changes the results.
+    """
+    query = " ".join(str(spec["query"]).lower().split())
+    where = json.dumps(spec.get("where") or {}, sort_keys=True, default=str)
+    return (scope, query, spec.get("n_results", 3), spec.get("mode", "hybrid"), bool(spec.get("prefilter")), where)
+
+
+class RetrievalCache:
+    """
+    In-memory LRU cache of retrieval results with a time-to-live.
+
+    Every entry is tagged with the corpus version it was computed against;
+    a lookup under a different version is a miss, so results are invalidated
+    exactly when ingestion changes the index.
+    """
+
+    def __init__(self, max_entries: int = 1024, ttl_s: float = 300.0):
+        self.max_entries = max_entries
+        self.ttl_s = ttl_s
+        self._entries: "OrderedDict[Hashable, Tuple[int, float, List[Dict]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self.expired = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable, version: int) -> Optional[List[Dict]]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                entry_version, stored_at, results = entry
+                if entry_version != version:
+                    self.stale += 1
+                elif time.monotonic() - stored_at > self.ttl_s:
+                    self.expired += 1
+                else:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return results
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, key: Hashable, version: int, results: List[Dict]):
+        with self._lock:
+            self._entries[key] = (version, time.monotonic(), results)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_s": self.ttl_s,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "stale": self.stale,
+                "expired": self.expired,
+                "evictions": self.evictions,
+            }
+
+
+_cache: Optional[RetrievalCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_retrieval_cache() -> RetrievalCache:
+    """
+    Returns the shared retrieval cache for this process.
+    """
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = RetrievalCache(
+                    max_entries=int(os.getenv("RETRIEVAL_CACHE_SIZE", "1024")),
+                    ttl_s=float(os.getenv("RETRIEVAL_CACHE_TTL_S", "300")),
+                )
+    return _cache
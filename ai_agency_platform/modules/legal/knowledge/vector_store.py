@@ -1,61 +1,392 @@
-import chromadb
-from chromadb.utils import embedding_functions
-from typing import List, Dict
+import asyncio
+import json
+import os
+import threading
+from typing import Callable, Dict, Iterable, List, Tuple
+
+import numpy as np
+
+from modules.legal.knowledge.embedding_cache import content_digest
+from modules.legal.knowledge.embeddings import EmbeddingEngine, PRIORITY_INGEST, get_embedding_engine
+from modules.legal.knowledge.index import MemmapIndex, is_partition_filter
+from modules.legal.knowledge.lexical import fts_query, reciprocal_rank_fusion
+
+# Root directory for persisted collections (mount a volume here in containers)
+VECTOR_STORE_DIR = os.getenv("VECTOR_STORE_DIR", os.path.join(os.getcwd(), "data", "vector_store"))
+# Compact codes for the search pass: "int8", "binary" or empty for exact float32 search
+VECTOR_QUANTIZATION = os.getenv("VECTOR_QUANTIZATION", "") or None
+# Estimated Jaccard similarity at which new chunks collapse into an indexed
+# near-duplicate of the same tenant and type (e.g. 0.9); empty disables it
+VECTOR_DEDUP_THRESHOLD = float(os.getenv("VECTOR_DEDUP_THRESHOLD", "") or 0) or None
+# Fraction of deleted rows at which the index is compacted; 0 disables compaction
+VECTOR_COMPACT_THRESHOLD = float(os.getenv("VECTOR_COMPACT_THRESHOLD", "0.25")) or None
+
+# Values of the "type" metadata field; together with "tenant" they partition a
+# collection, and searches filtered on them only scan their own slice
+DOCUMENT_TYPES = ("case_law", "statute", "precedent", "contract", "document")
+
+# One open index per collection directory, shared by every VectorStore in the process
+_indexes: Dict[str, MemmapIndex] = {}
+_indexes_lock = threading.Lock()
+
+
+def get_index(collection_name: str, persist_directory: str = None, quantization: str = None, dedup_threshold: float = None) -> MemmapIndex:
+    """
+    Returns the process-wide index for a collection, opening it on first use
+    (the quantization and dedup threshold of the first open apply for the
+    life of the process).
+    """
+    path = os.path.abspath(os.path.join(persist_directory or VECTOR_STORE_DIR, collection_name))
+    with _indexes_lock:
+        index = _indexes.get(path)
+        if index is None:
+            index = MemmapIndex(
+                path,
+                quantization=quantization or VECTOR_QUANTIZATION,
+                dedup_threshold=dedup_threshold or VECTOR_DEDUP_THRESHOLD,
+                compact_threshold=VECTOR_COMPACT_THRESHOLD,
+            )
+            _indexes[path] = index
+        return index
+
+
+def _chunk_id(doc_id: str, chunk: str, seen: Dict[str, int]) -> str:
+    digest = content_digest(chunk)
+    occurrence = seen.get(digest, 0)
+    seen[digest] = occurrence + 1
+    return f"{doc_id}#{digest}#{occurrence}"
+
+
+# Metadata fields set by the store itself rather than by the document's metadata
+_DOCUMENT_FIELDS = ("doc_id", "version", "chunk")
+
+
+def _retagged(stored: Dict, metadata: Dict) -> bool:
+    """A stored chunk's metadata differs from the (JSON-normalized) document metadata."""
+    return {k: v for k, v in stored.items() if k not in _DOCUMENT_FIELDS} != metadata
+
+
+class DocumentUpdate:
+    """
+    A new version of a document being indexed chunk by chunk (see
+    VectorStore.begin_document): records every chunk id of the new version
+    and tells which chunks are new, or carry changed metadata, and need writing.
+    """
+
+    def __init__(self, doc_id: str, metadata: Dict, existing: Dict[str, Dict], current: Dict = None):
+        self.doc_id = doc_id
+        self.existing = existing
+        self.current = current
+        # Only used by written chunks, whose existence means the document changed
+        self.base = dict(metadata or {}, doc_id=doc_id, version=(current["version"] if current else 0) + 1)
+        self.metadata = json.loads(json.dumps(metadata or {}))
+        self.ids: List[str] = []
+        self.added = 0
+        self.updated = 0
+        self._seen: Dict[str, int] = {}
+
+    def add(self, chunk: str) -> Tuple[str, Dict]:
+        """
+        Registers the next chunk. Returns ``(chunk_id, metadata)`` if it is new
+        or its metadata changed (e.g. another type or tenant), or
+        ``(chunk_id, None)`` if the current version already has it as is.
+        """
+        chunk_id = _chunk_id(self.doc_id, chunk, self._seen)
+        self.ids.append(chunk_id)
+        stored = self.existing.get(chunk_id)
+        if stored is not None and not _retagged(stored, self.metadata):
+            return chunk_id, None
+        if stored is None:
+            self.added += 1
+        else:
+            self.updated += 1
+        return chunk_id, dict(self.base, chunk=len(self.ids) - 1)
+
 
 class VectorStore:
     """
-    Manages embedding generation and retrieval using ChromaDB.
+    Manages embedding generation and hybrid (BM25 + vector) retrieval over a
+    persistent, memory-mapped index.
+    All instances pointing at the same collection share one index per process, and
+    all instances share the process-wide EmbeddingEngine unless one is passed in.
+    ``quantization`` ("int8"/"binary", default VECTOR_QUANTIZATION) keeps only
+    compact codes resident and re-ranks candidates with the float32 vectors.
+    ``dedup_threshold`` (default VECTOR_DEDUP_THRESHOLD) collapses near-duplicate
+    chunks into one indexed entry; results list every source in "sources".
+    A collection only accepts the embedding model it was built with (ValueError otherwise).
     """
-    
-    def __init__(self, collection_name: str = "legal_knowledge"):
-        self.client = chromadb.Client() # In-memory for MVP
-        # Use a lightweight, open-source embedding model
-        self.embedding_fn = embedding_functions.SentenceTransformerEmbeddingFunction(
-            model_name="all-MiniLM-L6-v2"
-        )
-        self.collection = self.client.get_or_create_collection(
-            name=collection_name,
-            embedding_function=self.embedding_fn
-        )
-
-    def add_documents(self, documents: List[str], metadatas: List[Dict] = None):
+
+    def __init__(self, collection_name: str = "legal_knowledge", persist_directory: str = None, embedding_engine: EmbeddingEngine = None, quantization: str = None, dedup_threshold: float = None):
+        self.embedding_engine = embedding_engine or get_embedding_engine()
+        self.index = get_index(collection_name, persist_directory, quantization, dedup_threshold)
+        self.index.bind_model(self.embedding_engine.model_key)
+
+    @property
+    def corpus_version(self) -> int:
+        """Changes whenever chunks are added, replaced or removed (see MemmapIndex.corpus_version)."""
+        return self.index.corpus_version
+
+    def recall_report(self, queries: List[str], k: int = 10) -> Dict:
+        """
+        recall@k of the (quantized) search against exact float32 search for
+        real query texts, plus resident bytes per vector.
+        """
+        return self.index.recall_at_k(self.embedding_engine.embed(queries), k)
+
+    def _prepare(self, documents: List[str], metadatas: List[Dict] = None):
+        if metadatas is None:
+            metadatas = [{"source": "unknown"} for _ in documents]
+
+        # Stable ids: re-ingesting the same file overwrites its chunks instead of duplicating them.
+        # A "chunk" metadata field (position within the source) takes precedence over list position.
+        ids = [
+            f"doc_{meta.get('chunk', i)}_{content_digest(doc, str(meta.get('source', '')))}"
+            for i, (doc, meta) in enumerate(zip(documents, metadatas))
+        ]
+        return ids, metadatas
+
+    # Chunks embedded and written per step of add_documents
+    WRITE_BATCH_SIZE = 256
+
+    def add_documents(self, documents: List[str], metadatas: List[Dict] = None, progress: Callable[[str, int], None] = None):
         """
         Adds documents to the vector store.
+        Work is done in batches; ``progress(stage, n)`` is called with stage
+        "embedded" or "indexed" after each batch.
         """
         if not documents:
             return
-            
-        ids = [f"doc_{i}_{hash(doc)}" for i, doc in enumerate(documents)]
-        
-        if metadatas is None:
-            metadatas = [{"source": "unknown"} for _ in documents]
-            
+
+        ids, metadatas = self._prepare(documents, metadatas)
         print(f"[VectorStore] Adding {len(documents)} chunks to collection.")
-        self.collection.add(
-            documents=documents,
-            metadatas=metadatas,
-            ids=ids
-        )
+        self._write(ids, documents, metadatas, progress)
+
+    def _write(self, ids: List[str], documents: List[str], metadatas: List[Dict], progress=None, doc_ids: List[str] = None):
+        for start in range(0, len(documents), self.WRITE_BATCH_SIZE):
+            end = start + self.WRITE_BATCH_SIZE
+            embeddings = self.embedding_engine.embed(documents[start:end], priority=PRIORITY_INGEST)
+            if progress:
+                progress("embedded", len(embeddings))
+            self.index.upsert(
+                ids[start:end], embeddings, documents[start:end], metadatas[start:end],
+                doc_ids=doc_ids[start:end] if doc_ids else None,
+            )
+            if progress:
+                progress("indexed", len(embeddings))
 
-    def query(self, query_text: str, n_results: int = 3) -> List[Dict]:
+    def upsert_document(self, doc_id: str, chunks: Iterable[str], metadata: Dict = None, progress: Callable[[str, int], None] = None) -> Dict:
+        """
+        Indexes a new version of a document, touching only the chunks that changed.
+
+        Chunk ids are derived from the document id and each chunk's content
+        hash (not its position), so an edit re-embeds only new/changed chunks,
+        chunks absent from the new version are deleted, and everything else is
+        left in place. New chunks are written before stale ones are removed, so
+        readers never see the document disappear mid-update.
+
+        ``chunks`` may be a generator (e.g. DocumentParser.iter_chunks): new
+        chunks are embedded and written in batches as they arrive, and stale
+        ones are only removed once it is exhausted, so a parse that fails
+        part-way leaves the previous version searchable.
+        """
+        update = self.begin_document(doc_id, metadata)
+        batch_ids, batch_texts, batch_metas = [], [], []
+        for chunk in chunks:
+            chunk_id, meta = update.add(chunk)
+            if meta is None:
+                continue
+            batch_ids.append(chunk_id)
+            batch_texts.append(chunk)
+            batch_metas.append(meta)
+            if len(batch_ids) >= self.WRITE_BATCH_SIZE:
+                self._write_batch(doc_id, batch_ids, batch_texts, batch_metas, progress)
+        self._write_batch(doc_id, batch_ids, batch_texts, batch_metas, progress)
+        return self.finish_document(update)
+
+    def begin_document(self, doc_id: str, metadata: Dict = None) -> DocumentUpdate:
+        """
+        Starts indexing a new version of a document chunk by chunk; new chunks
+        reported by DocumentUpdate.add are written by the caller, then
+        finish_document removes stale chunks and records the version.
+        """
+        return DocumentUpdate(doc_id, metadata, self.index.document_chunks(doc_id), self.index.get_document(doc_id))
+
+    def finish_document(self, update: DocumentUpdate) -> Dict:
+        """
+        Completes a DocumentUpdate once all its new chunks are written. Returns the diff report.
+        """
+        stale = set(update.existing).difference(update.ids)
+        removed = self.index.delete(list(stale)) if stale else 0
+        changed = bool(update.added or update.updated or stale or not update.current)
+        version = update.base["version"] if changed else update.current["version"]
+        if changed:
+            self.index.set_document(update.doc_id, version, len(update.ids))
+        return {
+            "doc_id": update.doc_id,
+            "version": version,
+            "added": update.added,
+            "updated": update.updated,
+            "removed": removed,
+            "unchanged": len(update.ids) - update.added - update.updated,
+        }
+
+    def _write_batch(self, doc_id: str, ids: List[str], texts: List[str], metas: List[Dict], progress=None):
+        """Writes and clears one pending batch of a streamed document."""
+        if ids:
+            self._write(list(ids), list(texts), list(metas), progress, doc_ids=[doc_id] * len(ids))
+            ids.clear()
+            texts.clear()
+            metas.clear()
+
+    def delete_document(self, doc_id: str) -> int:
+        """
+        Removes every chunk of a document. Returns the number of chunks removed.
+        """
+        return self.index.delete_document(doc_id)
+
+    # Candidates taken from each ranking (x n_results) before rank fusion
+    FUSION_DEPTH = 4
+    # Upper bound on lexical candidates used to prefilter the vector search
+    PREFILTER_LIMIT = 1000
+
+    def query(self, query_text: str, n_results: int = 3, mode: str = "hybrid", prefilter: bool = False, where: Dict = None) -> List[Dict]:
         """
         Retrieves relevant documents for a query.
+
+        mode:
+            "hybrid"  - BM25 and vector rankings fused by reciprocal rank (default)
+            "vector"  - embedding similarity only
+            "lexical" - BM25 only; no query embedding, for exact terms/citations
+        prefilter: restrict the vector search to rows that match lexically
+            (falls back to the full index when nothing matches).
+        where: metadata filter applied before ranking, e.g. ``{"type": "statute"}``.
+
+        Distances are cosine distances (0 = identical); in lexical mode they
+        are 1 - BM25 score relative to the best hit.
+        """
+        return self.query_many([query_text], n_results=n_results, mode=mode, prefilter=prefilter, where=where)[0]
+
+    async def aquery(self, query_text: str, n_results: int = 3, mode: str = "hybrid", prefilter: bool = False, where: Dict = None) -> List[Dict]:
         """
-        print(f"[VectorStore] Querying: {query_text}")
-        results = self.collection.query(
-            query_texts=[query_text],
-            n_results=n_results
-        )
-        
+        Async variant of query.
+        """
+        return (await self.aquery_many([query_text], n_results=n_results, mode=mode, prefilter=prefilter, where=where))[0]
+
+    def query_many(self, queries: List, n_results: int = 3, mode: str = "hybrid", prefilter: bool = False, where: Dict = None) -> List[List[Dict]]:
+        """
+        Runs several queries together: all query embeddings are computed in a
+        single batch, and unfiltered vector searches share one matrix product.
+
+        Each query is either a string or a dict with a "query" key and optional
+        "n_results", "mode", "prefilter" and "where" overrides of the keyword
+        defaults. Returns one result list (as from query) per query, in order.
+        """
+        specs = self._specs(queries, n_results, mode, prefilter, where)
+        texts = self._embedding_texts(specs)
+        embeddings = dict(zip(texts, self.embedding_engine.embed(texts))) if texts else {}
+        return self._run(specs, embeddings)
+
+    async def aquery_many(self, queries: List, n_results: int = 3, mode: str = "hybrid", prefilter: bool = False, where: Dict = None) -> List[List[Dict]]:
+        """
+        Async variant of query_many.
+        """
+        specs = self._specs(queries, n_results, mode, prefilter, where)
+        texts = self._embedding_texts(specs)
+        embeddings = dict(zip(texts, await self.embedding_engine.aembed(texts))) if texts else {}
+        return await asyncio.to_thread(self._run, specs, embeddings)
+
+    @staticmethod
+    def _specs(queries: List, n_results: int, mode: str, prefilter: bool, where: Dict) -> List[Dict]:
+        defaults = {"n_results": n_results, "mode": mode, "prefilter": prefilter, "where": where}
+        specs = []
+        for query in queries:
+            spec = dict(defaults, **query) if isinstance(query, dict) else dict(defaults, query=query)
+            if spec["mode"] not in ("hybrid", "vector", "lexical"):
+                raise ValueError(f"Unknown query mode: {spec['mode']}")
+            print(f"[VectorStore] Querying: {spec['query']}")
+            specs.append(spec)
+        return specs
+
+    @staticmethod
+    def _embedding_texts(specs: List[Dict]) -> List[str]:
+        return list(dict.fromkeys(spec["query"] for spec in specs if spec["mode"] != "lexical"))
+
+    def _run(self, specs: List[Dict], embeddings: Dict[str, np.ndarray]) -> List[List[Dict]]:
+        # Rows found by one index call are looked up by later ones: no compaction in between
+        with self.index.stable_rows():
+            return self._run_specs(specs, embeddings)
+
+    def _run_specs(self, specs: List[Dict], embeddings: Dict[str, np.ndarray]) -> List[List[Dict]]:
+        results: List[List[Dict]] = [[] for _ in specs]
+        plans = []
+        for i, spec in enumerate(specs):
+            if spec["mode"] == "lexical":
+                results[i] = self._lexical(spec["query"], spec["n_results"], spec["where"])
+                continue
+            depth = spec["n_results"] * self.FUSION_DEPTH if spec["mode"] == "hybrid" else spec["n_results"]
+            lexical = []
+            if spec["mode"] == "hybrid" or spec["prefilter"]:
+                limit = self.PREFILTER_LIMIT if spec["prefilter"] else depth
+                lexical = self.index.lexical_search(fts_query(spec["query"]), limit, where=spec["where"])
+            candidates = None
+            if spec["prefilter"] and lexical:
+                candidates = [row for row, _ in lexical]
+            elif spec["where"] and not is_partition_filter(spec["where"]):
+                candidates = self.index.filter_rows(spec["where"])
+            plans.append((i, spec, embeddings[spec["query"]], depth, lexical, candidates))
+
+        # Queries over the whole index (or partitions of it, masked during the
+        # scan) are scored in one pass per distinct partition filter
+        shared: Dict[str, List] = {}
+        for plan in plans:
+            if plan[5] is None:
+                shared.setdefault(json.dumps(plan[1]["where"] or {}, sort_keys=True, default=list), []).append(plan)
+        vector_hits = {}
+        for group in shared.values():
+            hits = self.index.search(
+                np.stack([plan[2] for plan in group]), max(plan[3] for plan in group), where=group[0][1]["where"] or None,
+            )
+            vector_hits.update({plan[0]: column[:plan[3]] for plan, column in zip(group, hits)})
+        for i, spec, embedding, depth, lexical, candidates in plans:
+            if candidates is not None:
+                vector_hits[i] = self.index.search(embedding, depth, rows=candidates)[0]
+            results[i] = self._fuse(embedding, spec, vector_hits[i], lexical[:depth])
+        return results
+
+    def _lexical(self, query_text: str, n_results: int, where: Dict = None) -> List[Dict]:
+        hits = self.index.lexical_search(fts_query(query_text), n_results, where=where)
+        best = hits[0][1] if hits else 1.0
+        return self._records([(row, score / best if best > 0 else 0.0) for row, score in hits])
+
+    def _fuse(self, embedding, spec: Dict, vector_hits: List[Tuple[int, float]], lexical: List[Tuple[int, float]]) -> List[Dict]:
+        n_results = spec["n_results"]
+        if spec["mode"] != "hybrid":
+            return self._records(vector_hits[:n_results])
+
+        ranked = reciprocal_rank_fusion([[row for row, _ in vector_hits], [row for row, _ in lexical]])
+        ranked = ranked[:n_results]
+        similarity = dict(vector_hits)
+        missing = [row for row in ranked if row not in similarity]
+        if missing:
+            # Lexical-only hits still get a true cosine distance
+            similarity.update(self.index.search(embedding, len(missing), rows=missing)[0])
+        return self._records([(row, similarity.get(row, 0.0)) for row in ranked])
+
+    def _records(self, hits: List[Tuple[int, float]]) -> List[Dict]:
+        records = self.index.get([row for row, _ in hits])
+
         # Flatten results structure
         flattened = []
-        if results['documents']:
-            for i, doc in enumerate(results['documents'][0]):
-                meta = results['metadatas'][0][i] if results['metadatas'] else {}
-                flattened.append({
-                    "text": doc,
-                    "metadata": meta,
-                    "distance": results['distances'][0][i] if 'distances' in results and results['distances'] else 0
-                })
-                
+        for row, similarity in hits:
+            record = records.get(row)
+            if record is None:
+                continue
+            flattened.append({
+                "id": record["id"],
+                "text": record["text"],
+                "metadata": record["metadata"],
+                "sources": record["sources"],
+                "distance": 1.0 - similarity
+            })
+
         return flattened
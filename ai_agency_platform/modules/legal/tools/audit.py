@@ -1,4 +1,5 @@
 import datetime
+from collections import deque
 from typing import Dict, Any
 
 class AuditLogger:
@@ -6,12 +7,16 @@ class AuditLogger:
     Logs every step of the workflow with input/output snapshots for traceability.
     """
 
+    # Most recent entries kept across runs; each run's full trail lives in its state
+    MAX_ENTRIES = 1000
+
     def __init__(self):
-        self.logs = []
+        self.logs = deque(maxlen=self.MAX_ENTRIES)
 
-    def log_step(self, step_name: str, input_snapshot: Any, output_snapshot: Any):
+    def log_step(self, step_name: str, input_snapshot: Any, output_snapshot: Any) -> Dict:
         """
-        Records a log entry for a specific workflow step.
+        Records a log entry for a specific workflow step and returns it, so a
+        workflow run can keep its own trail (the logger is shared by all runs).
         """
         entry = {
             "step": step_name,
@@ -21,6 +26,7 @@ class AuditLogger:
         }
         self.logs.append(entry)
         print(f"[AuditLogger] Logged step: {step_name}")
-        
+        return entry
+
     def get_logs(self) -> list:
-        return self.logs
+        return list(self.logs)
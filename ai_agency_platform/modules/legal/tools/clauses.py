@@ -0,0 +1,61 @@
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, Hashable, List, Tuple, TypeVar
+
+from modules.legal.knowledge.embedding_cache import content_digest
+
+T = TypeVar("T")
+
+_MISSING = object()
+
+
+def split_clauses(content: str) -> List[str]:
+    """
+    Splits a document into clauses, one per non-empty line: drafts put every
+    numbered clause, heading and refinement note on its own line.
+    """
+    return [line for line in content.splitlines() if line.strip()]
+
+
+class ClauseAnalysisCache:
+    """
+    LRU cache of per-clause analysis results keyed by clause content hash.
+
+    Analyzers check a document clause by clause and rebuild the document-level
+    result from the clause results, so after an edit only new or changed
+    clauses are analyzed again; unchanged ones (including boilerplate shared
+    between drafts) are served from the cache.
+    """
+
+    def __init__(self, max_entries: int = 8192):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Tuple[Hashable, str], object]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def analyze(self, analysis: Hashable, content: str, analyze_clause: Callable[[str], T]) -> List[T]:
+        """
+        Results of ``analyze_clause`` for every clause of ``content``, in order.
+        ``analysis`` identifies the check and its parameters (part of the key).
+        """
+        clauses = split_clauses(content)
+        keys = [(analysis, content_digest(clause)) for clause in clauses]
+        with self._lock:
+            results = [self._entries.get(key, _MISSING) for key in keys]
+            for key, result in zip(keys, results):
+                if result is not _MISSING:
+                    self._entries.move_to_end(key)
+        missing = {key: clause for key, clause, result in zip(keys, clauses, results) if result is _MISSING}
+        computed = {key: analyze_clause(clause) for key, clause in missing.items()}
+        with self._lock:
+            self.hits += len(keys) - len(missing)
+            self.misses += len(missing)
+            self._entries.update(computed)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return [computed[key] if result is _MISSING else result for key, result in zip(keys, results)]
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
@@ -1,10 +1,17 @@
 from typing import List, Dict, Tuple
 
+from modules.legal.tools.clauses import ClauseAnalysisCache
+
 class ComplianceAnalyzer:
     """
     Analyzes legal documents for compliance with specific rules and required clauses.
+    Clauses are checked one by one through a ClauseAnalysisCache, so re-analyzing
+    a refined draft only checks the clauses that changed.
     """
 
+    def __init__(self, cache: ClauseAnalysisCache = None):
+        self.cache = cache or ClauseAnalysisCache()
+
     def analyze_document(self, content: str, rules: List[str]) -> Tuple[float, List[str]]:
         """
         Checks the document content against a list of rules/required clauses.
@@ -12,18 +19,22 @@ class ComplianceAnalyzer:
         """
         print(f"[ComplianceAnalyzer] Analyzing document against {len(rules)} rules.")
         
-        missing_clauses = []
-        passed_checks = 0
-        
         # Simple string matching for MVP. 
         # In production, this would use an LLM or semantic search.
-        content_lower = content.lower()
+        # Simple keyword check based on rule description
+        keywords = tuple(dict.fromkeys(self._keyword(rule) for rule in rules))
+        
+        # A rule is satisfied when any clause mentions it
+        found = set().union(*self.cache.analyze(
+            ("compliance", keywords), content,
+            lambda clause: frozenset(k for k in keywords if k in clause.lower()),
+        ))
+        
+        missing_clauses = []
+        passed_checks = 0
         
         for rule in rules:
-            # Simple keyword check based on rule description
-            keyword = rule.lower().split(":")[0] if ":" in rule else rule.lower()
-            
-            if keyword in content_lower:
+            if self._keyword(rule) in found:
                 passed_checks += 1
             else:
                 missing_clauses.append(rule)
@@ -31,3 +42,7 @@ class ComplianceAnalyzer:
         score = passed_checks / len(rules) if rules else 1.0
         
         return score, missing_clauses
+
+    @staticmethod
+    def _keyword(rule: str) -> str:
+        return rule.lower().split(":")[0] if ":" in rule else rule.lower()
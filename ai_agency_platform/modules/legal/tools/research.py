@@ -1,3 +1,4 @@
+import asyncio
 import json
 from typing import List, Dict
 import os
@@ -7,6 +8,8 @@ import sys
 sys.path.append(os.path.join(os.getcwd(), "..", "..", ".."))
 
 from modules.legal.knowledge.vector_store import VectorStore
+from modules.legal.knowledge.lexical import is_citation_query
+from modules.legal.knowledge.result_cache import RetrievalCache, get_retrieval_cache, retrieval_key
 
 class LegalResearcher:
     """
@@ -14,49 +17,161 @@ class LegalResearcher:
     Connects to the VectorStore to retrieve relevant ingested documents.
     """
 
-    def __init__(self):
+    # Document types searched by each kind of lookup; "document" and None
+    # (chunks indexed without a type) cover generic uploads
+    CASE_LAW_TYPES = ["case_law", "precedent", "document", None]
+    STATUTE_TYPES = ["statute", "document", None]
+
+    def __init__(self, store: VectorStore = None, cache: RetrievalCache = None):
         try:
-            self.store = VectorStore()
+            self.store = store or VectorStore()
         except:
             print("VectorStore not available, falling back to mock.")
             self.store = None
+        self.cache = cache or get_retrieval_cache()
+
+    @property
+    def corpus_version(self) -> int:
+        """Version of the searched corpus (0 without a store); changes on every ingestion."""
+        return self.store.corpus_version if self.store else 0
 
-    def search_case_law(self, query: str) -> List[Dict]:
+    def warm_up(self):
+        """Loads the embedding model (the index is opened with the store) so the first search does not pay for it."""
+        if self.store:
+            self.store.embedding_engine.warm_up()
+
+    def search_case_law(self, query: str, tenant: str = None) -> List[Dict]:
         """
-        Searches for case law in the Vector Store.
+        Searches for case law in the Vector Store: the shared corpus plus,
+        when given, the tenant's own documents.
         """
         if not self.store:
             return self._mock_case_law(query)
             
         print(f"[LegalResearcher] RAG Search for case law: {query}")
-        results = self.store.query(query, n_results=3)
-        
+        results = self._query_many([self._case_law_query(query, tenant)])[0]
+        return self._format_cases(results)
+
+    def retrieve_statutes(self, query: str, tenant: str = None) -> List[Dict]:
+        """
+        Searches for statutes/rules in the Vector Store.
+        """
+        if not self.store:
+            return self._mock_statutes(query)
+            
+        print(f"[LegalResearcher] RAG Search for statutes: {query}")
+        results = self._query_many([self._statute_query(query, tenant)])[0]
+        return self._format_statutes(results)
+
+    async def asearch_case_law(self, query: str, tenant: str = None) -> List[Dict]:
+        """
+        Async variant of search_case_law.
+        """
+        if not self.store:
+            return self._mock_case_law(query)
+        results = (await self._aquery_many([self._case_law_query(query, tenant)]))[0]
+        return self._format_cases(results)
+
+    async def aretrieve_statutes(self, query: str, tenant: str = None) -> List[Dict]:
+        """
+        Async variant of retrieve_statutes.
+        """
+        if not self.store:
+            return self._mock_statutes(query)
+        results = (await self._aquery_many([self._statute_query(query, tenant)]))[0]
+        return self._format_statutes(results)
+
+    def _query_many(self, specs: List[Dict]) -> List[List[Dict]]:
+        """
+        store.query_many behind the retrieval cache: only cache misses reach the
+        store (still as one batch), and results are tagged with the corpus
+        version read before the search, so a concurrent ingest can only make
+        them stale, never wrongly fresh.
+        """
+        version = self.store.corpus_version
+        # The cache is shared by every store in the process: keys name the collection
+        keys = [retrieval_key(spec, self.store.index.path) for spec in specs]
+        results = [self.cache.get(key, version) for key in keys]
+        missing = [i for i, cached in enumerate(results) if cached is None]
+        if missing:
+            fetched = self.store.query_many([specs[i] for i in missing])
+            for i, found in zip(missing, fetched):
+                self.cache.put(keys[i], version, found)
+                results[i] = found
+        return results
+
+    async def _aquery_many(self, specs: List[Dict]) -> List[List[Dict]]:
+        """
+        Async _query_many: the query embedding is awaited on the engine and the
+        index reads (which may wait for an ingest holding the index lock) run
+        on worker threads, so the event loop is never blocked.
+        """
+        version = await asyncio.to_thread(lambda: self.store.corpus_version)
+        # The cache is shared by every store in the process: keys name the collection
+        keys = [retrieval_key(spec, self.store.index.path) for spec in specs]
+        results = [self.cache.get(key, version) for key in keys]
+        missing = [i for i, cached in enumerate(results) if cached is None]
+        if missing:
+            fetched = await self.store.aquery_many([specs[i] for i in missing])
+            for i, found in zip(missing, fetched):
+                self.cache.put(keys[i], version, found)
+                results[i] = found
+        return results
+
+    def cache_stats(self) -> Dict:
+        return self.cache.stats()
+
+    @staticmethod
+    def _mode(query: str) -> str:
+        # Exact citations are answered from the inverted index without an embedding pass
+        return "lexical" if is_citation_query(query) else "hybrid"
+
+    @staticmethod
+    def _partition(doc_types: List[str], tenant: str = None) -> Dict:
+        # Untenanted documents are the shared corpus; other tenants' documents are never visible
+        return {"type": doc_types, "tenant": [tenant, None] if tenant else None}
+
+    def _case_law_query(self, query: str, tenant: str = None) -> Dict:
+        return {"query": query, "n_results": 3, "mode": self._mode(query), "where": self._partition(self.CASE_LAW_TYPES, tenant)}
+
+    def _statute_query(self, query: str, tenant: str = None) -> Dict:
+        # Hybrid retrieval matches exact statutory terms directly, so the query
+        # no longer needs padding with generic "statute rule law" keywords
+        return {
+            "query": query, "n_results": 2, "mode": self._mode(query), "prefilter": True,
+            "where": self._partition(self.STATUTE_TYPES, tenant),
+        }
+
+    @staticmethod
+    def _sources(res: Dict, default: str) -> List[str]:
+        # A collapsed near-duplicate stands for several documents; all stay citable
+        sources = res.get('sources') or [res['metadata']]
+        return list(dict.fromkeys(source.get('source', default) for source in sources))
+
+    @classmethod
+    def _format_cases(cls, results: List[Dict]) -> List[Dict]:
         # Format for context
         formatted = []
         for res in results:
+            sources = cls._sources(res, 'Unknown Document')
             formatted.append({
-                "case_name": res['metadata'].get('source', 'Unknown Document'),
+                "case_name": sources[0],
                 "citation": "Ingested Document",
                 "summary": res['text'],
+                "sources": sources,
                 "relevance_score": 1.0 - res['distance']
             })
         return formatted
 
-    def retrieve_statutes(self, query: str) -> List[Dict]:
-        """
-        Searches for statutes/rules in the Vector Store.
-        """
-        if not self.store:
-            return self._mock_statutes(query)
-            
-        print(f"[LegalResearcher] RAG Search for statutes: {query}")
-        results = self.store.query(query + " statute rule law", n_results=2)
-        
+    @classmethod
+    def _format_statutes(cls, results: List[Dict]) -> List[Dict]:
         formatted = []
         for res in results:
+            sources = cls._sources(res, 'Unknown Statute')
             formatted.append({
-                "statute_name": res['metadata'].get('source', 'Unknown Statute'),
+                "statute_name": sources[0],
                 "text": res['text'],
+                "sources": sources,
                 "relevance_score": 1.0 - res['distance']
             })
         return formatted
@@ -80,18 +195,45 @@ class LegalResearcher:
         """
         summary = "Legal Research Summary (from RAG):\n\n"
         for item in findings:
+            also = item.get("sources", [])[1:]
+            also = f" (also in: {', '.join(also)})" if also else ""
             if "case_name" in item:
-                summary += f"- Source: {item['case_name']}\n  Content: {item['summary'][:300]}...\n"
+                summary += f"- Source: {item['case_name']}{also}\n  Content: {item['summary'][:300]}...\n"
             elif "statute_name" in item:
-                summary += f"- Source: {item['statute_name']}\n  Text: {item['text'][:300]}...\n"
+                summary += f"- Source: {item['statute_name']}{also}\n  Text: {item['text'][:300]}...\n"
         return summary
 
-    def get_structured_context(self, query: str) -> Dict:
+    def get_structured_context(self, query: str, tenant: str = None) -> Dict:
         """
         Orchestrates the research process and returns a structured context.
         """
-        cases = self.search_case_law(query)
-        statutes = self.retrieve_statutes(query)
+        if self.store:
+            # One embedding batch and one index pass for both searches
+            print(f"[LegalResearcher] RAG Search for case law and statutes: {query}")
+            results = self._query_many([self._case_law_query(query, tenant), self._statute_query(query, tenant)])
+        else:
+            results = None
+        return self._structured_context(query, results)
+
+    async def aget_structured_context(self, query: str, tenant: str = None) -> Dict:
+        """
+        Async variant of get_structured_context.
+        """
+        if self.store:
+            print(f"[LegalResearcher] RAG Search for case law and statutes: {query}")
+            results = await self._aquery_many([self._case_law_query(query, tenant), self._statute_query(query, tenant)])
+        else:
+            results = None
+        return self._structured_context(query, results)
+
+    def _structured_context(self, query: str, results: List[List[Dict]] = None) -> Dict:
+        if results is not None:
+            case_results, statute_results = results
+            cases = self._format_cases(case_results)
+            statutes = self._format_statutes(statute_results)
+        else:
+            cases = self._mock_case_law(query)
+            statutes = self._mock_statutes(query)
         findings = cases + statutes
         summary = self.summarize_findings(findings)
         
@@ -1,10 +1,20 @@
 from typing import Dict, List
 
+from modules.legal.tools.clauses import ClauseAnalysisCache
+
 class RiskAnalyzer:
     """
     Analyzes legal documents for potential risks and vulnerabilities.
+    Clauses are checked one by one through a ClauseAnalysisCache, so re-analyzing
+    a refined draft only checks the clauses that changed.
     """
 
+    # Terms whose absence from every clause is a vulnerability
+    TERMS = ("indemnify", "liability", "termination")
+
+    def __init__(self, cache: ClauseAnalysisCache = None):
+        self.cache = cache or ClauseAnalysisCache()
+
     def analyze_risk(self, content: str) -> Dict:
         """
         Classifies the risk level and identifies specific vulnerabilities.
@@ -15,17 +25,20 @@ class RiskAnalyzer:
         risk_level = "Low"
         
         # Simple keyword-based risk detection for MVP
-        content_lower = content.lower()
+        present = set().union(*self.cache.analyze(
+            ("risk", self.TERMS), content,
+            lambda clause: frozenset(term for term in self.TERMS if term in clause.lower()),
+        ))
         
-        if "indemnify" not in content_lower:
+        if "indemnify" not in present:
             risks.append("Missing indemnification clause")
             risk_level = "Medium"
             
-        if "liability" not in content_lower:
+        if "liability" not in present:
             risks.append("Missing limitation of liability")
             risk_level = "High"
             
-        if "termination" not in content_lower:
+        if "termination" not in present:
             risks.append("Missing termination clause")
             if risk_level != "High":
                 risk_level = "Medium"
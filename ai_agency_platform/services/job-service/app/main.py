@@ -0,0 +1,86 @@
+import asyncio
+import os
+import sys
+from contextlib import asynccontextmanager
+
+from fastapi import FastAPI, HTTPException
+from fastapi.middleware.cors import CORSMiddleware
+
+# The platform root holds 'shared'; the pipeline worker runs in-process with the memory queue
+PLATFORM_ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "..")
+sys.path.append(PLATFORM_ROOT)
+sys.path.append(os.path.join(PLATFORM_ROOT, "workers", "pipeline-worker"))
+
+from shared.clients.job_queue import FINISHED, JOB_QUEUE_BACKEND, get_job_queue
+from shared.schemas.job import JobCreate, JobResponse
+
+# Pipeline workers started inside this process; with the memory queue nothing else can reach the jobs
+JOB_INPROCESS_WORKERS = int(os.getenv("JOB_INPROCESS_WORKERS", "1" if JOB_QUEUE_BACKEND == "memory" else "0"))
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    stop = asyncio.Event()
+    workers = []
+    if JOB_INPROCESS_WORKERS:
+        from worker import PipelineWorker
+        from tasks import run_pipeline
+        workers = [
+            asyncio.create_task(PipelineWorker(run_pipeline, get_job_queue()).run(stop))
+            for _ in range(JOB_INPROCESS_WORKERS)
+        ]
+    yield
+    stop.set()
+    await asyncio.gather(*workers, return_exceptions=True)
+
+
+app = FastAPI(title="AI Agency Job Service", lifespan=lifespan)
+
+app.add_middleware(
+    CORSMiddleware,
+    allow_origins=["*"],
+    allow_credentials=True,
+    allow_methods=["*"],
+    allow_headers=["*"],
+)
+
+
+def _get_job(job_id: str):
+    job = get_job_queue().get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+
+@app.post("/jobs", status_code=202, response_model=JobResponse)
+async def create_job(request: JobCreate):
+    """
+    Queues an agency run and returns at once; poll GET /jobs/{id} for progress.
+    """
+    job = await asyncio.to_thread(get_job_queue().enqueue, request.pipeline, request.input, request.max_attempts)
+    return job.to_dict()
+
+
+@app.get("/jobs/{job_id}", response_model=JobResponse)
+async def get_job(job_id: str):
+    return (await asyncio.to_thread(_get_job, job_id)).to_dict()
+
+
+@app.get("/jobs/{job_id}/result")
+async def get_job_result(job_id: str):
+    job = await asyncio.to_thread(_get_job, job_id)
+    if job.status not in FINISHED:
+        raise HTTPException(status_code=409, detail=f"Job is {job.status}")
+    if job.status == "failed":
+        raise HTTPException(status_code=500, detail={"error": job.error, "attempts": job.attempts})
+    return job.output
+
+
+@app.get("/jobs")
+async def queue_stats():
+    return {"backend": JOB_QUEUE_BACKEND, "jobs": await asyncio.to_thread(get_job_queue().stats)}
+
+
+@app.get("/health")
+def health_check():
+    return {"status": "ok"}
@@ -0,0 +1,168 @@
+import asyncio
+import os
+import sys
+import time
+
+# The service root and the platform root ('shared'), plus the pipeline worker
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', '..'))
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+sys.path.append(ROOT)
+sys.path.append(os.path.join(ROOT, 'workers', 'pipeline-worker'))
+
+from shared.clients.job_queue import InMemoryJobQueue, PermanentJobError, SqliteJobQueue
+
+
+def test_sqlite_queue_leases_retries_and_fences_stale_workers(tmp_path, monkeypatch):
+    import shared.clients.job_queue as job_queue
+    monkeypatch.setattr(job_queue, "JOB_RETRY_DELAY_S", 0)
+    path = str(tmp_path / "jobs.sqlite")
+    queue = SqliteJobQueue(path, max_attempts=2)
+    jobs = [queue.enqueue("legal", {"prompt": f"NDA {i}"}) for i in range(3)]
+
+    # Oldest first, at most `limit`, and a leased job is invisible to others
+    claimed = queue.claim("a", 2, visibility_s=0.05)
+    assert [job.id for job in claimed] == [jobs[0].id, jobs[1].id]
+    assert [job.id for job in SqliteJobQueue(path).claim("b", 5, visibility_s=60)] == [jobs[2].id]
+    assert queue.heartbeat("a", [jobs[0].id], visibility_s=60) == [jobs[0].id]
+
+    # jobs[1] was not renewed: its lease expires and another worker takes it over
+    time.sleep(0.1)
+    other = SqliteJobQueue(path)
+    retried = other.claim("b", 5, visibility_s=60)
+    assert [(job.id, job.attempts) for job in retried] == [(jobs[1].id, 2)]
+    assert not queue.complete("a", jobs[1].id, {"stale": True})
+    assert queue.heartbeat("a", [jobs[1].id], visibility_s=60) == []
+
+    # Last attempt failed: the job fails for good
+    assert other.fail("b", jobs[1].id, "boom")
+    assert queue.get(jobs[1].id).status == "failed" and queue.get(jobs[1].id).error == "boom"
+    assert queue.complete("a", jobs[0].id, {"document": "..."})
+    assert queue.get(jobs[0].id).output == {"document": "..."}
+
+    # A permanent error fails the job without using its remaining attempts
+    retryable = queue.enqueue("legal", {"prompt": "NDA"})
+    assert [job.id for job in queue.claim("a", 5, visibility_s=60)] == [retryable.id]
+    assert queue.fail("a", retryable.id, "HTTPStatusError: 422", retry=False)
+    assert queue.get(retryable.id).status == "failed" and queue.get(retryable.id).attempts == 1
+
+    # Released (prefetched, never started) jobs keep their attempt
+    queue.release("b", [jobs[2].id])
+    assert queue.get(jobs[2].id).status == "queued" and queue.get(jobs[2].id).attempts == 0
+    assert queue.stats() == {"completed": 1, "failed": 2, "queued": 1}
+
+
+def test_workers_prefetch_retry_and_scale_out(monkeypatch):
+    import shared.clients.job_queue as job_queue
+    from worker import PipelineWorker
+    monkeypatch.setattr(job_queue, "JOB_RETRY_DELAY_S", 0)
+    queue = InMemoryJobQueue(max_attempts=3)
+    jobs = [queue.enqueue("legal", {"prompt": f"NDA {i}"}) for i in range(16)]
+    seen = []
+    running = {"now": 0, "peak": 0}
+
+    async def handler(job):
+        seen.append((job.id, job.attempts))
+        running["now"] += 1
+        running["peak"] = max(running["peak"], running["now"])
+        try:
+            await asyncio.sleep(0.1)  # stands in for the agency run
+        finally:
+            running["now"] -= 1
+        if job.id == jobs[0].id and job.attempts == 1:
+            raise TimeoutError("pipeline service timed out")
+        return {"document": job.input["prompt"]}
+
+    async def run_workers(n):
+        stop = asyncio.Event()
+        workers = [PipelineWorker(handler, queue, concurrency=4, prefetch=2, poll_interval_s=0.01) for _ in range(n)]
+        tasks = [asyncio.create_task(worker.run(stop)) for worker in workers]
+        while any(queue.get(job.id).status not in ("completed", "failed") for job in jobs):
+            await asyncio.sleep(0.01)
+        stop.set()
+        await asyncio.gather(*tasks)
+        return workers
+
+    workers = asyncio.run(run_workers(2))
+    # Runs overlap beyond one worker's 4 slots, never beyond both workers' 8
+    assert 4 < running["peak"] <= 8
+    assert all(worker.processed for worker in workers)
+    assert all(queue.get(job.id).output == {"document": job.input["prompt"]} for job in jobs)
+    assert queue.get(jobs[0].id).attempts == 2 and (jobs[0].id, 2) in seen
+    assert sum(worker.processed for worker in workers) == 16 and sum(worker.failed for worker in workers) == 1
+    assert queue.stats() == {"completed": 16}
+
+
+def test_job_api_enqueues_and_serves_results(tmp_path, monkeypatch):
+    import shared.clients.job_queue as job_queue
+    from fastapi.testclient import TestClient
+    from app.main import app
+    queue = SqliteJobQueue(str(tmp_path / "jobs.sqlite"))
+    monkeypatch.setattr(job_queue, "_queue", queue)
+
+    with TestClient(app) as client:
+        response = client.post("/jobs", json={"pipeline": "legal", "input": {"prompt": "Draft an NDA"}})
+        assert response.status_code == 202
+        job_id = response.json()["id"]
+        assert client.get(f"/jobs/{job_id}").json()["status"] == "queued"
+        assert client.get(f"/jobs/{job_id}/result").status_code == 409
+
+        [job] = queue.claim("worker", 1, visibility_s=60)
+        queue.complete("worker", job.id, {"status": "success", "output": {"document": "NDA"}})
+        assert client.get(f"/jobs/{job_id}").json()["status"] == "completed"
+        assert client.get(f"/jobs/{job_id}/result").json()["output"] == {"document": "NDA"}
+        assert client.get("/jobs/missing").status_code == 404
+        assert client.post("/jobs", json={"pipeline": "marketing", "input": {}}).status_code == 422
+        assert client.get("/jobs").json()["jobs"] == {"completed": 1}
+
+
+def test_run_pipeline_resumes_only_failed_runs(monkeypatch):
+    import httpx
+    import tasks
+    runs = {}
+    calls = []
+
+    def service(request):
+        calls.append((request.method, request.url.path))
+        rid = request.url.path.split("/")[2] if request.url.path.startswith("/runs/") else None
+        if request.url.path == "/run-agency":
+            if "rejected" in request.content.decode():
+                return httpx.Response(422, json={"detail": "bad request"})
+            return httpx.Response(200, json={"status": "success", "run": "started"})
+        if rid not in runs:
+            return httpx.Response(404, json={"detail": "Run not found"})
+        if request.method == "GET":
+            return httpx.Response(200, json={"run_id": rid, "status": runs[rid]})
+        return httpx.Response(200, json={"status": "success", "run": "resumed"})
+
+    monkeypatch.setattr(tasks, "_client", httpx.AsyncClient(base_url="http://pipeline", transport=httpx.MockTransport(service)))
+    queue = InMemoryJobQueue()
+
+    def attempt(job, n):
+        job.attempts = n
+        return asyncio.run(tasks.run_pipeline(job))
+
+    job = queue.enqueue("legal", {"prompt": "NDA"})
+    assert attempt(job, 1)["run"] == "started" and calls == [("POST", "/run-agency")]
+    # Retry of a run that never checkpointed starts it; a failed run is resumed
+    assert attempt(job, 2)["run"] == "started"
+    runs[tasks.run_id(job)] = "failed"
+    assert attempt(job, 3)["run"] == "resumed"
+    # Cut off by a pipeline-service restart: resumed as well
+    runs[tasks.run_id(job)] = "interrupted"
+    assert attempt(job, 4)["run"] == "resumed"
+    # The previous attempt is still running it (lease expired): never a second concurrent run
+    runs[tasks.run_id(job)] = "running"
+    calls.clear()
+    try:
+        attempt(job, 5)
+        assert False, "in-progress run started again"
+    except RuntimeError:
+        pass
+    assert calls == [("GET", f"/runs/{tasks.run_id(job)}")]
+
+    for rejected in (queue.enqueue("legal", {"prompt": "rejected"}), queue.enqueue("marketing", {})):
+        try:
+            attempt(rejected, 1)
+            assert False, "rejected job would be retried"
+        except PermanentJobError:
+            pass
@@ -0,0 +1,353 @@
+import asyncio
+import os
+import random
+import sqlite3
+import threading
+import time
+import zlib
+from typing import Any, AsyncIterator, Dict, Iterator, Optional, Sequence, Tuple
+
+from langchain_core.runnables import RunnableConfig
+from langgraph.checkpoint.base import (
+    WRITES_IDX_MAP,
+    BaseCheckpointSaver,
+    ChannelVersions,
+    Checkpoint,
+    CheckpointMetadata,
+    CheckpointTuple,
+    get_checkpoint_id,
+    get_checkpoint_metadata,
+)
+from langgraph.checkpoint.serde.jsonplus import JsonPlusSerializer
+
+# Local database holding the checkpoints of every graph run in this service
+CHECKPOINT_DB = os.getenv("CHECKPOINT_DB", os.path.join(os.getcwd(), "data", "checkpoints.sqlite"))
+# Runs untouched for longer than this are deleted (0 keeps them forever)
+CHECKPOINT_TTL_S = float(os.getenv("CHECKPOINT_TTL_S", str(7 * 24 * 3600)))
+
+
+class CompressedSerializer(JsonPlusSerializer):
+    """
+    LangGraph's msgpack encoding, zlib-compressed above ``min_size`` bytes
+    (state is mostly text: drafts, retrieved passages, messages).
+    """
+
+    def __init__(self, min_size: int = 512, level: int = 1):
+        super().__init__()
+        self.min_size = min_size
+        self.level = level
+
+    def dumps_typed(self, obj: Any) -> Tuple[str, bytes]:
+        type_, data = super().dumps_typed(obj)
+        if len(data) >= self.min_size:
+            return type_ + "+zlib", zlib.compress(data, self.level)
+        return type_, data
+
+    def loads_typed(self, data: Tuple[str, bytes]) -> Any:
+        type_, payload = data
+        if type_.endswith("+zlib"):
+            type_, payload = type_[:-len("+zlib")], zlib.decompress(payload)
+        return super().loads_typed((type_, payload))
+
+
+class SqliteCheckpointer(BaseCheckpointSaver):
+    """
+    Durable LangGraph checkpointer in a single SQLite database (WAL mode).
+
+    A checkpoint is written after every superstep, and the outputs of nodes
+    that finished in a superstep that failed are kept as pending writes. Re-
+    invoking a graph with the same ``thread_id`` (the run id) and no input
+    therefore resumes after the last completed node, across process restarts.
+    Channel values are stored once per version, so a checkpoint only adds the
+    channels that changed since the previous one.
+    """
+
+    # Writes between two sweeps for runs older than ttl_s
+    PRUNE_EVERY = 1000
+
+    def __init__(self, path: str = None, ttl_s: float = None):
+        super().__init__(serde=CompressedSerializer())
+        self.path = path or CHECKPOINT_DB
+        self.ttl_s = CHECKPOINT_TTL_S if ttl_s is None else ttl_s
+        # Opened on first use, not when the graphs are compiled at import (see _db)
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.RLock()
+        self._writes_since_prune = 0
+
+    @property
+    def _db(self) -> sqlite3.Connection:
+        if self._conn is None:
+            with self._lock:
+                if self._conn is None:
+                    self._open()
+        return self._conn
+
+    def _open(self):
+        """Connects, creates the tables and sweeps expired runs. Caller holds the lock."""
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        db = sqlite3.connect(self.path, check_same_thread=False)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        db.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS threads (
+                thread_id TEXT PRIMARY KEY,
+                updated_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS threads_updated_at ON threads (updated_at);
+            CREATE TABLE IF NOT EXISTS checkpoints (
+                thread_id TEXT NOT NULL,
+                checkpoint_ns TEXT NOT NULL,
+                checkpoint_id TEXT NOT NULL,
+                parent_id TEXT,
+                type TEXT NOT NULL,
+                checkpoint BLOB NOT NULL,
+                metadata_type TEXT NOT NULL,
+                metadata BLOB NOT NULL,
+                PRIMARY KEY (thread_id, checkpoint_ns, checkpoint_id)
+            );
+            CREATE TABLE IF NOT EXISTS blobs (
+                thread_id TEXT NOT NULL,
+                checkpoint_ns TEXT NOT NULL,
+                channel TEXT NOT NULL,
+                version TEXT NOT NULL,
+                type TEXT NOT NULL,
+                value BLOB,
+                PRIMARY KEY (thread_id, checkpoint_ns, channel, version)
+            );
+            CREATE TABLE IF NOT EXISTS writes (
+                thread_id TEXT NOT NULL,
+                checkpoint_ns TEXT NOT NULL,
+                checkpoint_id TEXT NOT NULL,
+                task_id TEXT NOT NULL,
+                idx INTEGER NOT NULL,
+                channel TEXT NOT NULL,
+                type TEXT NOT NULL,
+                value BLOB,
+                task_path TEXT NOT NULL,
+                PRIMARY KEY (thread_id, checkpoint_ns, checkpoint_id, task_id, idx)
+            );
+            """
+        )
+        db.commit()
+        self._conn = db
+        if self.ttl_s:
+            self.prune(self.ttl_s)
+
+    # ------------------------------------------------------------------ #
+    # Reads
+    # ------------------------------------------------------------------ #
+
+    def get_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+        checkpoint_id = get_checkpoint_id(config)
+        sql = (
+            "SELECT checkpoint_id, parent_id, type, checkpoint, metadata_type, metadata FROM checkpoints"
+            " WHERE thread_id = ? AND checkpoint_ns = ?"
+        )
+        params = [thread_id, checkpoint_ns]
+        if checkpoint_id:
+            sql += " AND checkpoint_id = ?"
+            params.append(checkpoint_id)
+        with self._lock:
+            row = self._db.execute(sql + " ORDER BY checkpoint_id DESC LIMIT 1", params).fetchone()
+            if row is None:
+                return None
+            return self._tuple(thread_id, checkpoint_ns, row)
+
+    def list(
+        self,
+        config: Optional[RunnableConfig],
+        *,
+        filter: Optional[Dict[str, Any]] = None,
+        before: Optional[RunnableConfig] = None,
+        limit: Optional[int] = None,
+    ) -> Iterator[CheckpointTuple]:
+        sql = (
+            "SELECT thread_id, checkpoint_ns, checkpoint_id, parent_id, type, checkpoint, metadata_type, metadata"
+            " FROM checkpoints WHERE 1"
+        )
+        params = []
+        if config:
+            sql += " AND thread_id = ?"
+            params.append(config["configurable"]["thread_id"])
+            if config["configurable"].get("checkpoint_ns") is not None:
+                sql += " AND checkpoint_ns = ?"
+                params.append(config["configurable"]["checkpoint_ns"])
+            if get_checkpoint_id(config):
+                sql += " AND checkpoint_id = ?"
+                params.append(get_checkpoint_id(config))
+        if before and get_checkpoint_id(before):
+            sql += " AND checkpoint_id < ?"
+            params.append(get_checkpoint_id(before))
+        with self._lock:
+            rows = self._db.execute(sql + " ORDER BY thread_id, checkpoint_ns, checkpoint_id DESC", params).fetchall()
+        for thread_id, checkpoint_ns, *row in rows:
+            if limit is not None and limit <= 0:
+                return
+            metadata = self.serde.loads_typed((row[4], row[5]))
+            if filter and not all(metadata.get(key) == value for key, value in filter.items()):
+                continue
+            if limit is not None:
+                limit -= 1
+            with self._lock:
+                found = self._tuple(thread_id, checkpoint_ns, row)
+            yield found
+
+    def _tuple(self, thread_id: str, checkpoint_ns: str, row: Sequence) -> CheckpointTuple:
+        """Builds a CheckpointTuple from a checkpoints row. Caller holds the lock."""
+        checkpoint_id, parent_id, type_, data, metadata_type, metadata = row
+        checkpoint = self.serde.loads_typed((type_, data))
+        values = {}
+        for channel, version in checkpoint["channel_versions"].items():
+            blob = self._db.execute(
+                "SELECT type, value FROM blobs WHERE thread_id = ? AND checkpoint_ns = ? AND channel = ? AND version = ?",
+                (thread_id, checkpoint_ns, channel, str(version)),
+            ).fetchone()
+            if blob is not None and blob[0] != "empty":
+                values[channel] = self.serde.loads_typed(blob)
+        writes = self._db.execute(
+            "SELECT task_id, channel, type, value FROM writes"
+            " WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id = ? ORDER BY task_id, idx",
+            (thread_id, checkpoint_ns, checkpoint_id),
+        ).fetchall()
+        return CheckpointTuple(
+            config={"configurable": {"thread_id": thread_id, "checkpoint_ns": checkpoint_ns, "checkpoint_id": checkpoint_id}},
+            checkpoint={**checkpoint, "channel_values": values},
+            metadata=self.serde.loads_typed((metadata_type, metadata)),
+            parent_config=(
+                {"configurable": {"thread_id": thread_id, "checkpoint_ns": checkpoint_ns, "checkpoint_id": parent_id}}
+                if parent_id else None
+            ),
+            pending_writes=[(task_id, channel, self.serde.loads_typed((t, v))) for task_id, channel, t, v in writes],
+        )
+
+    # ------------------------------------------------------------------ #
+    # Writes
+    # ------------------------------------------------------------------ #
+
+    def put(
+        self,
+        config: RunnableConfig,
+        checkpoint: Checkpoint,
+        metadata: CheckpointMetadata,
+        new_versions: ChannelVersions,
+    ) -> RunnableConfig:
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+        stored = checkpoint.copy()
+        values = stored.pop("channel_values")
+        blobs = [
+            (thread_id, checkpoint_ns, channel, str(version))
+            + (self.serde.dumps_typed(values[channel]) if channel in values else ("empty", None))
+            for channel, version in new_versions.items()
+        ]
+        type_, data = self.serde.dumps_typed(stored)
+        metadata_type, metadata_data = self.serde.dumps_typed(get_checkpoint_metadata(config, metadata))
+        with self._lock:
+            self._db.executemany("INSERT OR REPLACE INTO blobs VALUES (?, ?, ?, ?, ?, ?)", blobs)
+            self._db.execute(
+                "INSERT OR REPLACE INTO checkpoints VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    thread_id, checkpoint_ns, checkpoint["id"], config["configurable"].get("checkpoint_id"),
+                    type_, data, metadata_type, metadata_data,
+                ),
+            )
+            self._touch(thread_id)
+            self._db.commit()
+        self._maybe_prune()
+        return {"configurable": {"thread_id": thread_id, "checkpoint_ns": checkpoint_ns, "checkpoint_id": checkpoint["id"]}}
+
+    def put_writes(self, config: RunnableConfig, writes: Sequence[Tuple[str, Any]], task_id: str, task_path: str = "") -> None:
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+        checkpoint_id = config["configurable"]["checkpoint_id"]
+        rows = [
+            (thread_id, checkpoint_ns, checkpoint_id, task_id, WRITES_IDX_MAP.get(channel, idx), channel)
+            + self.serde.dumps_typed(value) + (task_path,)
+            for idx, (channel, value) in enumerate(writes)
+        ]
+        # Special writes (errors, interrupts...) are replaced; regular ones are written once
+        verb = "INSERT OR REPLACE" if all(channel in WRITES_IDX_MAP for channel, _ in writes) else "INSERT OR IGNORE"
+        with self._lock:
+            self._db.executemany(f"{verb} INTO writes VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+            self._touch(thread_id)
+            self._db.commit()
+
+    def delete_thread(self, thread_id: str) -> None:
+        with self._lock:
+            self._delete([thread_id])
+            self._db.commit()
+
+    def prune(self, max_age_s: float) -> int:
+        """Deletes runs not written to in the last ``max_age_s`` seconds. Returns how many."""
+        with self._lock:
+            stale = [
+                r[0] for r in self._db.execute("SELECT thread_id FROM threads WHERE updated_at < ?", (time.time() - max_age_s,))
+            ]
+            self._delete(stale)
+            self._db.commit()
+        return len(stale)
+
+    def _delete(self, thread_ids: Sequence[str]):
+        for table in ("checkpoints", "blobs", "writes", "threads"):
+            self._db.executemany(f"DELETE FROM {table} WHERE thread_id = ?", [(t,) for t in thread_ids])
+
+    def _touch(self, thread_id: str):
+        self._db.execute("INSERT OR REPLACE INTO threads (thread_id, updated_at) VALUES (?, ?)", (thread_id, time.time()))
+
+    def _maybe_prune(self):
+        self._writes_since_prune += 1
+        if self.ttl_s and self._writes_since_prune >= self.PRUNE_EVERY:
+            self._writes_since_prune = 0
+            self.prune(self.ttl_s)
+
+    def get_next_version(self, current: Optional[str], channel: None) -> str:
+        # Zero-padded so versions (and checkpoint ids) sort as text
+        current_v = 0 if current is None else current if isinstance(current, int) else int(current.split(".")[0])
+        return f"{current_v + 1:032}.{random.random():016}"
+
+    # ------------------------------------------------------------------ #
+    # Async API: the same operations on a worker thread
+    # ------------------------------------------------------------------ #
+
+    async def aget_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        return await asyncio.to_thread(self.get_tuple, config)
+
+    async def alist(
+        self,
+        config: Optional[RunnableConfig],
+        *,
+        filter: Optional[Dict[str, Any]] = None,
+        before: Optional[RunnableConfig] = None,
+        limit: Optional[int] = None,
+    ) -> AsyncIterator[CheckpointTuple]:
+        found = await asyncio.to_thread(lambda: list(self.list(config, filter=filter, before=before, limit=limit)))
+        for item in found:
+            yield item
+
+    async def aput(self, config: RunnableConfig, checkpoint: Checkpoint, metadata: CheckpointMetadata, new_versions: ChannelVersions) -> RunnableConfig:
+        return await asyncio.to_thread(self.put, config, checkpoint, metadata, new_versions)
+
+    async def aput_writes(self, config: RunnableConfig, writes: Sequence[Tuple[str, Any]], task_id: str, task_path: str = "") -> None:
+        await asyncio.to_thread(self.put_writes, config, writes, task_id, task_path)
+
+    async def adelete_thread(self, thread_id: str) -> None:
+        await asyncio.to_thread(self.delete_thread, thread_id)
+
+
+_checkpointer: Optional[SqliteCheckpointer] = None
+_checkpointer_lock = threading.Lock()
+
+
+def get_checkpointer() -> SqliteCheckpointer:
+    """
+    Returns the checkpointer shared by the graphs of this process.
+    """
+    global _checkpointer
+    if _checkpointer is None:
+        with _checkpointer_lock:
+            if _checkpointer is None:
+                _checkpointer = SqliteCheckpointer()
+    return _checkpointer
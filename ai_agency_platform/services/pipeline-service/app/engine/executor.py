@@ -0,0 +1,86 @@
+import asyncio
+import os
+import threading
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple
+
+from modules.legal.knowledge.result_cache import RetrievalCache
+
+
+def run_key(agency_type: str, prompt: str, tenant: Optional[str] = None) -> Tuple:
+    """
+    Identity of an agency request: requests with the same key (and corpus
+    version) produce the same run. Whitespace in the prompt is normalized.
+    """
+    return (agency_type, " ".join(prompt.split()), tenant)
+
+
+class RunExecutor:
+    """
+    Executes agency runs once per distinct request.
+
+    A request identical to one still running (same ``run_key`` and corpus
+    version) waits for that run instead of starting its own; finished results
+    go into a bounded LRU cache with a time-to-live, tagged with the corpus
+    version so ingestion invalidates them. Failed runs are not cached: every
+    caller waiting on one gets its error, and the next request runs again.
+    """
+
+    def __init__(self, max_entries: int = 256, ttl_s: float = 600.0):
+        self.cache = RetrievalCache(max_entries=max_entries, ttl_s=ttl_s)
+        self._inflight: Dict[Tuple[Hashable, int], asyncio.Future] = {}
+        self.executed = 0
+        self.coalesced = 0
+
+    async def execute(self, key: Hashable, version: int, run: Callable[[], Awaitable[Dict[str, Any]]]) -> Tuple[Dict[str, Any], str]:
+        """
+        Result of ``run()`` for ``key`` at corpus ``version``, and where it came
+        from: "cache", "coalesced" (joined an identical run in flight) or "run".
+        """
+        cached = self.cache.get(key, version)
+        if cached is not None:
+            return cached, "cache"
+        inflight = self._inflight.get((key, version))
+        if inflight is not None:
+            self.coalesced += 1
+            # Shielded: a caller that goes away does not cancel the run the others wait on
+            return await asyncio.shield(inflight), "coalesced"
+
+        self.executed += 1
+        task = asyncio.ensure_future(self._run(key, version, run))
+        self._inflight[(key, version)] = task
+        return await asyncio.shield(task), "run"
+
+    async def _run(self, key: Hashable, version: int, run: Callable[[], Awaitable[Dict[str, Any]]]) -> Dict[str, Any]:
+        try:
+            result = await run()
+            self.cache.put(key, version, result)
+            return result
+        finally:
+            del self._inflight[(key, version)]
+
+    def stats(self) -> Dict:
+        return {
+            "executed": self.executed,
+            "coalesced": self.coalesced,
+            "in_flight": len(self._inflight),
+            "cache": self.cache.stats(),
+        }
+
+
+_executor: Optional[RunExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def get_run_executor() -> RunExecutor:
+    """
+    Returns the run executor shared by the requests of this process.
+    """
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = RunExecutor(
+                    max_entries=int(os.getenv("RUN_CACHE_SIZE", "256")),
+                    ttl_s=float(os.getenv("RUN_CACHE_TTL_S", "600")),
+                )
+    return _executor
@@ -0,0 +1,139 @@
+import asyncio
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, Optional
+
+# Build and warm every registered tool in the app lifespan (0: build on first use only)
+TOOL_WARMUP = os.getenv("TOOL_WARMUP", "1") == "1"
+# Delay before retrying a failed warm-up, doubled on every further failure up to the max
+TOOL_WARMUP_RETRY_S = float(os.getenv("TOOL_WARMUP_RETRY_S", "5"))
+TOOL_WARMUP_RETRY_MAX_S = float(os.getenv("TOOL_WARMUP_RETRY_MAX_S", "300"))
+
+
+class ToolRegistry:
+    """
+    Named tools built on first use instead of at import.
+
+    ``register`` only records a factory (and an optional ``warm`` hook, e.g.
+    loading a model); ``get`` builds the tool the first time it is needed,
+    once, however many callers race for it. ``warm_up`` builds and warms
+    tools ahead of traffic, so the process can start serving (and answer
+    health checks) at once while the first requests still find warm tools.
+    """
+
+    def __init__(self):
+        self._factories: Dict[str, Callable[[], Any]] = {}
+        self._warmers: Dict[str, Optional[Callable[[Any], None]]] = {}
+        # Built tools by name; replace an entry to substitute a tool (e.g. in tests)
+        self.instances: Dict[str, Any] = {}
+        self._locks: Dict[str, threading.Lock] = {}
+        self._state: Dict[str, Dict] = {}
+        self._lock = threading.Lock()
+
+    def register(self, name: str, factory: Callable[[], Any], warm: Callable[[Any], None] = None):
+        with self._lock:
+            self._factories[name] = factory
+            self._warmers[name] = warm
+            self._locks[name] = threading.Lock()
+            self._state[name] = {"state": "cold", "build_ms": None, "warm_ms": None, "error": None}
+
+    def get(self, name: str) -> Any:
+        """The tool called ``name``, built on first use."""
+        tool = self.instances.get(name)
+        if tool is not None:
+            return tool
+        if name not in self._factories:
+            raise KeyError(f"Unknown tool: {name}")
+        with self._locks[name]:
+            if name not in self.instances:
+                self._build(name)
+            return self.instances[name]
+
+    async def aget(self, name: str) -> Any:
+        """``get`` that builds on a worker thread, so a cold tool never blocks the event loop."""
+        tool = self.instances.get(name)
+        if tool is not None:
+            return tool
+        return await asyncio.to_thread(self.get, name)
+
+    def warm(self, name: str):
+        """Builds the tool and runs its warm hook (once)."""
+        with self._locks[name]:
+            if name not in self.instances:
+                self._build(name)
+            if self._state[name]["state"] == "ready":
+                return
+            warm = self._warmers[name]
+            if warm is not None:
+                self._state[name]["state"] = "warming"
+                started = time.perf_counter()
+                try:
+                    warm(self.instances[name])
+                except Exception as e:
+                    self._state[name].update(state="failed", error=f"{type(e).__name__}: {e}")
+                    raise
+                self._state[name]["warm_ms"] = round((time.perf_counter() - started) * 1000, 1)
+            self._state[name].update(state="ready", error=None)
+
+    async def warm_up(self, names: Iterable[str] = None, retry_s: float = None):
+        """
+        Warms the given tools (default: all) side by side on worker threads.
+        A tool that fails to warm is reported by ``status`` and tried again
+        with exponential backoff (from ``retry_s``, default TOOL_WARMUP_RETRY_S)
+        until it is ready, so a transient failure (e.g. a model download timing
+        out) does not keep the process unready; first use still builds it meanwhile.
+        Returns once every tool is warm; cancel it to stop retrying.
+        """
+        names = list(names or self._factories)
+        delay = TOOL_WARMUP_RETRY_S if retry_s is None else retry_s
+        while True:
+            results = await asyncio.gather(*(asyncio.to_thread(self.warm, name) for name in names), return_exceptions=True)
+            failed = [(name, result) for name, result in zip(names, results) if isinstance(result, Exception)]
+            if not failed:
+                return
+            for name, error in failed:
+                print(f"[ToolRegistry] Warm-up of {name} failed: {error}; retrying in {delay:g}s")
+            names = [name for name, _ in failed]
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, TOOL_WARMUP_RETRY_MAX_S)
+
+    @property
+    def ready(self) -> bool:
+        """Every registered tool is built and warm."""
+        with self._lock:
+            return all(state["state"] == "ready" for state in self._state.values())
+
+    def status(self) -> Dict[str, Dict]:
+        with self._lock:
+            return {name: dict(state) for name, state in self._state.items()}
+
+    def _build(self, name: str):
+        """Caller holds the tool's lock."""
+        print(f"[ToolRegistry] Building {name}")
+        started = time.perf_counter()
+        try:
+            tool = self._factories[name]()
+        except Exception as e:
+            self._state[name].update(state="failed", error=f"{type(e).__name__}: {e}")
+            raise
+        self._state[name].update(build_ms=round((time.perf_counter() - started) * 1000, 1), error=None)
+        # Tools without a warm hook are ready once built
+        self._state[name]["state"] = "built" if self._warmers[name] else "ready"
+        self.instances[name] = tool
+
+
+_registry: Optional[ToolRegistry] = None
+_registry_lock = threading.Lock()
+
+
+def get_tool_registry() -> ToolRegistry:
+    """
+    Returns the tool registry shared by the workflows of this process.
+    """
+    global _registry
+    if _registry is None:
+        with _registry_lock:
+            if _registry is None:
+                _registry = ToolRegistry()
+    return _registry
@@ -1,23 +1,44 @@
-from fastapi import FastAPI, HTTPException, UploadFile, File
+from fastapi import FastAPI, HTTPException, UploadFile, File, Form
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, StreamingResponse
 from pydantic import BaseModel, Field
 from typing import Optional, List, Dict, Any
+import asyncio
+import json
+from contextlib import aclosing, asynccontextmanager, contextmanager
 import os
-import shutil
+import tempfile
+import uuid
 
 # Add modules path for imports
 import sys
 sys.path.append(os.path.join(os.getcwd(), "..", "..", ".."))
 
 from app.core.graph import app_graph
+from app.engine.executor import get_run_executor, run_key
+from app.engine.registry import TOOL_WARMUP, get_tool_registry
+from app.workflows.legal_agency import nodes as legal_nodes
 from app.workflows.legal_agency.graph import legal_graph
 from app.workflows.design_agency.graph import design_graph
 from modules.legal.knowledge.ingestion import DocumentParser
-from modules.legal.knowledge.vector_store import VectorStore
+from modules.legal.knowledge.embeddings import get_embedding_engine
+from modules.legal.knowledge.jobs import get_job_manager
+from modules.legal.knowledge.result_cache import get_retrieval_cache
+from modules.legal.knowledge.vector_store import DOCUMENT_TYPES
 from langchain_core.messages import HumanMessage
 
 from fastapi.middleware.cors import CORSMiddleware
 
-app = FastAPI(title="AI Agency Pipeline Service")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Warm up in the background: the server accepts connections at once and
+    # /ready turns 200 when the tools are built and the model is loaded
+    warm_up = asyncio.create_task(get_tool_registry().warm_up()) if TOOL_WARMUP else None
+    yield
+    if warm_up is not None and not warm_up.done():
+        warm_up.cancel()
+
+app = FastAPI(title="AI Agency Pipeline Service", lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -30,73 +51,333 @@ app.add_middleware(
 class AgencyRequest(BaseModel):
     prompt: str
     agency_type: str = Field("design", description="Type of agency to run: 'design' or 'legal'")
+    tenant: Optional[str] = Field(None, description="Tenant whose private documents research may use")
+    run_id: Optional[str] = Field(None, description="Checkpoint id for the run, '<agency_type>-...' (default: generated)")
+
+# Runs are checkpointed under their run id, prefixed with the agency that owns them
+RUN_GRAPHS = {"legal": legal_graph, "design": design_graph}
+RUN_RECURSION_LIMIT = int(os.getenv("RUN_RECURSION_LIMIT", "50"))
+
+# Runs this process is executing right now; an unfinished checkpoint not in
+# here was cut off (e.g. by a restart) and reports "interrupted"
+ACTIVE_RUNS: Dict[str, int] = {}
+
+@contextmanager
+def _executing(run_id: str):
+    ACTIVE_RUNS[run_id] = ACTIVE_RUNS.get(run_id, 0) + 1
+    try:
+        yield
+    finally:
+        ACTIVE_RUNS[run_id] -= 1
+        if not ACTIVE_RUNS[run_id]:
+            del ACTIVE_RUNS[run_id]
+
+def _run_config(run_id: str) -> Dict[str, Any]:
+    return {"configurable": {"thread_id": run_id}, "recursion_limit": RUN_RECURSION_LIMIT}
+
+def _run_graph(run_id: str):
+    agency = run_id.split("-", 1)[0]
+    if agency not in RUN_GRAPHS:
+        raise HTTPException(status_code=404, detail="Run not found")
+    return agency, RUN_GRAPHS[agency]
+
+def _run_response(agency: str, run_id: str, result: Dict[str, Any]) -> Dict[str, Any]:
+    if agency == "legal":
+        # Extract structured output for Legal Agency
+        return {
+            "status": "success",
+            "agency": "legal",
+            "run_id": run_id,
+            "output": result.get("output", {}),
+            "metrics": result.get("metrics", {}),
+            "history": result.get("history", []),
+            "messages": [m.content for m in result['messages']]
+        }
+    return {"status": "success", "run_id": run_id, "output": result}
+
+async def _invoke_run(agency: str, run_id: str, state: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """Runs (state given) or resumes (state None) a checkpointed run."""
+    try:
+        with _executing(run_id):
+            result = await RUN_GRAPHS[agency].ainvoke(state, _run_config(run_id))
+        return _run_response(agency, run_id, result)
+    except Exception as e:
+        import traceback
+        traceback.print_exc()
+        # Completed steps are checkpointed: POST /runs/{run_id}/resume continues from there
+        raise HTTPException(status_code=500, detail={"error": str(e), "run_id": run_id})
+
+def _initial_state(request: AgencyRequest) -> Optional[Dict[str, Any]]:
+    """Input of a checkpointed agency run, or None for the legacy graph."""
+    if request.agency_type == "legal":
+        return {
+            "input": {"tenant": request.tenant},
+            "messages": [HumanMessage(content=request.prompt)],
+            "history": []
+        }
+    if request.agency_type == "design":
+        return {
+            "input": {"request": request.prompt},
+            "messages": [HumanMessage(content=request.prompt)],
+            "artifacts": {},
+            "review": {},
+            "next_node": "intake"
+        }
+    return None
+
+def _new_run_id(request: AgencyRequest) -> str:
+    if request.run_id is None:
+        return f"{request.agency_type}-{uuid.uuid4().hex}"
+    if not request.run_id.startswith(f"{request.agency_type}-"):
+        raise HTTPException(status_code=400, detail=f"run_id must start with '{request.agency_type}-'")
+    return request.run_id
 
 @app.post("/run-agency")
 async def run_agency(request: AgencyRequest):
-    try:
-        if request.agency_type == "legal":
-            initial_state = {
-                "messages": [HumanMessage(content=request.prompt)],
-                "history": []
-            }
-            result = await legal_graph.ainvoke(initial_state)
-            
-            # Extract structured output for Legal Agency
-            return {
-                "status": "success",
-                "agency": "legal",
-                "output": result.get("output", {}),
-                "metrics": result.get("metrics", {}),
-                "history": result.get("history", []),
-                "messages": [m.content for m in result['messages']]
-            }
-        elif request.agency_type == "design":
-            initial_state = {
-                "input": {"request": request.prompt},
-                "messages": [HumanMessage(content=request.prompt)],
-                "artifacts": {},
-                "review": {},
-                "next_node": "intake"
-            }
-            result = await design_graph.ainvoke(initial_state)
-            return {"status": "success", "output": result}
-        else:
-            # Fallback (legacy)
+    initial_state = _initial_state(request)
+    if initial_state is None:
+        # Fallback (legacy)
+        try:
             initial_state = {"messages": [HumanMessage(content=request.prompt)]}
             result = await app_graph.ainvoke(initial_state)
             return {"status": "success", "output": result}
+        except Exception as e:
+            import traceback
+            traceback.print_exc()
+            raise HTTPException(status_code=500, detail=str(e))
+    run_id = _new_run_id(request)
+    if request.run_id is not None:
+        # The caller owns this checkpoint thread (e.g. a job that may resume it): always run it
+        return {**await _invoke_run(request.agency_type, run_id, initial_state), "execution": "run"}
+    # Identical requests in flight share one run; finished ones are served from the cache
+    version = await _corpus_version(request.agency_type)
+    result, execution = await get_run_executor().execute(
+        run_key(request.agency_type, request.prompt, request.tenant),
+        version,
+        lambda: _invoke_run(request.agency_type, run_id, initial_state),
+    )
+    return {**result, "execution": execution}
+
+async def _corpus_version(agency: str) -> int:
+    """Version of the knowledge a run reads: legal runs depend on the ingested corpus."""
+    if agency == "legal":
+        researcher = await legal_nodes.tools.aget("legal.researcher")
+        return await asyncio.to_thread(lambda: researcher.corpus_version)
+    return 0
+
+@app.get("/run-agency/cache/stats")
+def run_cache_stats():
+    return get_run_executor().stats()
+
+# State keys forwarded as they are in node events (messages are sent as text)
+STREAMED_KEYS = ("history", "intermediate", "metrics", "output", "artifacts", "review")
+
+def _sse(event: str, data: Any) -> str:
+    return f"event: {event}\ndata: {json.dumps(jsonable_encoder(data))}\n\n"
+
+def _node_event(node: str, update: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    update = update or {}
+    event = {"node": node, "messages": [m.content for m in update.get("messages", [])]}
+    event.update({key: update[key] for key in STREAMED_KEYS if key in update})
+    return event
+
+async def _stream_run(agency: str, run_id: str, state: Optional[Dict[str, Any]]):
+    """
+    SSE events of a run: ``run`` at once, ``node`` as each node completes
+    (with its messages, partial draft, metrics...), then ``done`` with the
+    same body /run-agency returns, or ``error``. When the client disconnects
+    the response is cancelled; the cancellation reaches the node running at
+    that moment and the graph stream is closed. Completed nodes stay
+    checkpointed, so the run can be resumed.
+    """
+    graph = RUN_GRAPHS[agency]
+    config = _run_config(run_id)
+    yield _sse("run", {"run_id": run_id, "agency": agency})
+    try:
+        with _executing(run_id):
+            async with aclosing(graph.astream(state, config, stream_mode="updates")) as stream:
+                async for chunk in stream:
+                    for node, update in chunk.items():
+                        yield _sse("node", _node_event(node, update))
+        snapshot = await graph.aget_state(config)
+        yield _sse("done", _run_response(agency, run_id, snapshot.values))
+    except asyncio.CancelledError:
+        print(f"[Stream] Client disconnected, cancelled run {run_id}")
+        raise
+    except Exception as e:
+        import traceback
+        traceback.print_exc()
+        yield _sse("error", {"error": str(e), "run_id": run_id})
+
+@app.post("/run-agency/stream")
+async def run_agency_stream(request: AgencyRequest):
+    """
+    /run-agency as server-sent events, so clients see each node complete
+    instead of waiting for the whole run.
+    """
+    initial_state = _initial_state(request)
+    if initial_state is None:
+        raise HTTPException(status_code=400, detail=f"Streaming is not available for agency type: {request.agency_type}")
+    return StreamingResponse(
+        _stream_run(request.agency_type, _new_run_id(request), initial_state),
+        media_type="text/event-stream",
+        # Proxies must not buffer the stream
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@app.post("/runs/{run_id}/resume")
+async def resume_run(run_id: str):
+    """
+    Continues a failed or interrupted run from its last checkpoint: nodes that
+    already completed are not executed again.
+    """
+    agency, graph = _run_graph(run_id)
+    snapshot = await graph.aget_state(_run_config(run_id))
+    if not snapshot.created_at:
+        raise HTTPException(status_code=404, detail="Run not found")
+    if not snapshot.next:
+        return _run_response(agency, run_id, snapshot.values)
+    return await _invoke_run(agency, run_id, None)
+
+def _run_status(run_id: str, snapshot) -> str:
+    if not snapshot.next:
+        return "completed"
+    if run_id in ACTIVE_RUNS:
+        return "running"
+    # Unfinished and not executing here: a node raised, or the process running it stopped
+    return "failed" if any(t.error for t in snapshot.tasks) else "interrupted"
+
+@app.get("/runs/{run_id}")
+async def get_run(run_id: str):
+    """
+    Status of a run: "completed", "running" (executing in this process),
+    "failed" (a node raised) or "interrupted" (cut off, e.g. by a restart);
+    failed and interrupted runs continue with POST /runs/{run_id}/resume.
+    """
+    _, graph = _run_graph(run_id)
+    snapshot = await graph.aget_state(_run_config(run_id))
+    if not snapshot.created_at:
+        raise HTTPException(status_code=404, detail="Run not found")
+    return {
+        "run_id": run_id,
+        "status": _run_status(run_id, snapshot),
+        "next": list(snapshot.next),
+        "step": snapshot.metadata.get("step") if snapshot.metadata else None,
+        "updated_at": snapshot.created_at,
+    }
+
+# Uploads are streamed to disk in pieces of this size
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+INGEST_TMP_DIR = os.getenv("INGEST_TMP_DIR", tempfile.gettempdir())
+
+async def _spool_upload(file: UploadFile, suffix: str) -> str:
+    """Streams an upload to a temp file without holding it in memory; nothing is left behind if it fails."""
+    spooled = tempfile.NamedTemporaryFile(delete=False, suffix=suffix, dir=INGEST_TMP_DIR)
+    try:
+        with spooled:
+            while True:
+                chunk = await file.read(UPLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                spooled.write(chunk)
+    except BaseException:
+        os.remove(spooled.name)
+        raise
+    return spooled.name
+
+@app.post("/ingest", status_code=202)
+async def ingest_document(
+    file: UploadFile = File(...),
+    document_id: Optional[str] = Form(None),
+    doc_type: str = Form("document"),
+    tenant: Optional[str] = Form(None),
+):
+    """
+    Queues a document for ingestion. Uploading again with the same
+    document_id (default: the filename) indexes it as a new version and
+    only re-embeds the chunks that changed.
+    doc_type and tenant select the partition searches are restricted to;
+    documents without a tenant form the shared corpus.
+    """
+    ext = os.path.splitext(file.filename or "")[1].lower()
+    if ext not in DocumentParser.SUPPORTED_EXTENSIONS:
+        raise HTTPException(status_code=400, detail=f"Unsupported file format: {ext}")
+    if doc_type not in DOCUMENT_TYPES:
+        raise HTTPException(status_code=400, detail=f"Unknown doc_type: {doc_type}")
+
+    metadata = {"source": file.filename, "type": doc_type}
+    document_id = document_id or file.filename
+    if tenant:
+        metadata["tenant"] = tenant
+        document_id = f"{tenant}/{document_id}"
+
+    try:
+        path = await _spool_upload(file, ext)
+
+        # Parsing, embedding and indexing happen on the ingestion worker pool
+        job = get_job_manager().submit(path, file.filename, metadata=metadata, document_id=document_id)
+        return {"status": "accepted", "job_id": job.id, "filename": file.filename}
+
     except Exception as e:
         import traceback
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.post("/ingest")
-async def ingest_document(file: UploadFile = File(...)):
+@app.post("/ingest/bulk", status_code=202)
+async def ingest_bulk(
+    file: UploadFile = File(...),
+    doc_type: str = Form("document"),
+    tenant: Optional[str] = Form(None),
+):
+    """
+    Bulk ingestion of a zip archive of PDF/DOCX/TXT files.
+    Files are parsed in parallel; per-file failures are listed in the job report.
+    """
+    if os.path.splitext(file.filename or "")[1].lower() != ".zip":
+        raise HTTPException(status_code=400, detail="Bulk ingestion expects a .zip archive")
+    if doc_type not in DOCUMENT_TYPES:
+        raise HTTPException(status_code=400, detail=f"Unknown doc_type: {doc_type}")
+
     try:
-        # Save uploaded file temporarily
-        temp_path = f"temp_{file.filename}"
-        with open(temp_path, "wb") as buffer:
-            content = await file.read()
-            buffer.write(content)
-            
-        # Parse document
-        parser = DocumentParser()
-        chunks = parser.parse_file(temp_path)
-        
-        # Add to Vector Store
-        store = VectorStore()
-        store.add_documents(chunks, metadatas=[{"source": file.filename, "type": "document"} for _ in chunks])
-        
-        # Clean up
-        os.remove(temp_path)
-        
-        return {"status": "success", "chunks_added": len(chunks), "filename": file.filename}
-        
+        path = await _spool_upload(file, ".zip")
+        job = get_job_manager().submit_bulk(path, file.filename, doc_type=doc_type, tenant=tenant)
+        return {"status": "accepted", "job_id": job.id, "filename": file.filename}
+
     except Exception as e:
         import traceback
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/ingest/jobs")
+def list_ingest_jobs():
+    return [job.to_dict() for job in get_job_manager().list()]
+
+@app.get("/ingest/jobs/{job_id}")
+def get_ingest_job(job_id: str):
+    job = get_job_manager().get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job.to_dict()
+
+@app.get("/embeddings/stats")
+def embedding_stats():
+    return get_embedding_engine().stats()
+
+@app.get("/retrieval/cache/stats")
+def retrieval_cache_stats():
+    return get_retrieval_cache().stats()
+
 @app.get("/health")
 def health_check():
+    """Liveness: the process is serving requests (tools may still be warming up)."""
     return {"status": "ok"}
+
+@app.get("/ready")
+def readiness_check():
+    """Readiness: 200 once every tool is warm (or warm-up is disabled), 503 before."""
+    registry = get_tool_registry()
+    ready = registry.ready or not TOOL_WARMUP
+    return JSONResponse(
+        status_code=200 if ready else 503,
+        content={"status": "ready" if ready else "warming", "tools": registry.status()},
+    )
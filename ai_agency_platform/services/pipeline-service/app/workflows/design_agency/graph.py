@@ -1,4 +1,5 @@
 from langgraph.graph import StateGraph, START, END
+from app.core.checkpoint import get_checkpointer
 from app.workflows.design_agency.state import DesignAgentState
 from app.workflows.design_agency.nodes import (
     intake_node,
@@ -23,5 +24,5 @@ workflow.add_edge("designer", "copywriter")
 workflow.add_edge("copywriter", "review")
 workflow.add_edge("review", END)
 
-# Compile
-design_graph = workflow.compile()
+# Compile; a checkpoint after every step makes runs resumable by thread_id
+design_graph = workflow.compile(checkpointer=get_checkpointer())
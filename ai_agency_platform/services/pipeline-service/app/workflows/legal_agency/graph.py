@@ -1,4 +1,5 @@
 from langgraph.graph import StateGraph, START, END
+from app.core.checkpoint import get_checkpointer
 from app.workflows.legal_agency.state import LegalAgentState
 from app.workflows.legal_agency.nodes import (
     intake_node,
@@ -29,14 +30,17 @@ legal_workflow.add_node("refinement", refinement_node)
 legal_workflow.add_node("citation", citation_node)
 legal_workflow.add_node("audit", audit_node)
 
-# Add edges
+# Add edges. Independent branches fan out and are joined by a list edge,
+# which waits for all of them: latency follows the critical path, and the
+# state reducers merge the branches' context/intermediate/metrics updates
 legal_workflow.add_edge(START, "intake")
 legal_workflow.add_edge("intake", "planner")
+# Research stays one node: case law and statutes share one retrieval batch
 legal_workflow.add_edge("planner", "researcher")
 legal_workflow.add_edge("researcher", "drafter")
 legal_workflow.add_edge("drafter", "compliance")
-legal_workflow.add_edge("compliance", "risk")
-legal_workflow.add_edge("risk", "evaluation")
+legal_workflow.add_edge("drafter", "risk")
+legal_workflow.add_edge(["compliance", "risk"], "evaluation")
 
 # Conditional Loop
 legal_workflow.add_conditional_edges(
@@ -48,9 +52,11 @@ legal_workflow.add_conditional_edges(
     }
 )
 
-legal_workflow.add_edge("refinement", "compliance") # Loop back
+# Loop back: both analyses re-run on the refined draft
+legal_workflow.add_edge("refinement", "compliance")
+legal_workflow.add_edge("refinement", "risk")
 legal_workflow.add_edge("citation", "audit")
 legal_workflow.add_edge("audit", END)
 
-# Compile the graph
-legal_graph = legal_workflow.compile()
+# Compile the graph; a checkpoint after every step makes runs resumable by thread_id
+legal_graph = legal_workflow.compile(checkpointer=get_checkpointer())
@@ -1,5 +1,9 @@
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from langchain_core.messages import AIMessage, HumanMessage, BaseMessage
+from app.engine.registry import get_tool_registry
 from app.workflows.legal_agency.state import LegalAgentState
 
 # Import Legal Modules (Simulated import path - assuming modules are in python path)
@@ -21,16 +25,21 @@ except ImportError:
     # Basic mock for when modules aren't found in path (during dev)
     print("Warning: Legal modules not found in path. Using mocks.")
     class MockTool:
+        corpus_version = 0
         def search_case_law(self, q): return []
         def retrieve_statutes(self, q): return []
         def summarize_findings(self, f): return "Mock Summary"
-        def get_structured_context(self, q): return {"summary": "Mock Context"}
+        def get_structured_context(self, q, tenant=None): return {"summary": "Mock Context"}
+        async def asearch_case_law(self, q, tenant=None): return []
+        async def aretrieve_statutes(self, q, tenant=None): return []
+        async def aget_structured_context(self, q, tenant=None): return {"summary": "Mock Context"}
         def draft_document(self, t, c): return "Mock Draft"
         def analyze_document(self, c, r): return 1.0, []
         def analyze_risk(self, c): return {"score": 1.0, "vulnerabilities": []}
         def evaluate(self, c, r): return 1.0
         def attach_citations(self, c, s): return c
-        def log_step(self, s, i, o): pass
+        def log_step(self, s, i, o): return {"step": s}
+        def warm_up(self): pass
     
     LegalResearcher = MockTool
     LegalDrafter = MockTool
@@ -40,32 +49,44 @@ except ImportError:
     CitationEngine = MockTool
     AuditLogger = MockTool
 
-# Initialize Tools
-researcher = LegalResearcher()
-drafter = LegalDrafter()
-compliance = ComplianceAnalyzer()
-risk = RiskAnalyzer()
-evaluator = LegalEvaluator()
-citation = CitationEngine()
-audit = AuditLogger()
+# Tools are built on first use, or ahead of traffic by the warm-up in the app
+# lifespan, never at import: the researcher opens the index and loads the model
+tools = get_tool_registry()
+tools.register("legal.researcher", LegalResearcher, warm=lambda researcher: researcher.warm_up())
+tools.register("legal.drafter", LegalDrafter)
+tools.register("legal.compliance", ComplianceAnalyzer)
+tools.register("legal.risk", RiskAnalyzer)
+tools.register("legal.evaluator", LegalEvaluator)
+tools.register("legal.citation", CitationEngine)
+tools.register("legal.audit", AuditLogger)
 
-def intake_node(state: LegalAgentState):
+# Threads for the CPU-bound tools (drafting, analysis, scoring), so they never
+# run on the event loop serving other requests
+_cpu_pool = ThreadPoolExecutor(max_workers=int(os.getenv("LEGAL_CPU_WORKERS", "4")), thread_name_prefix="legal-cpu")
+
+
+async def _cpu(fn, *args):
+    """Runs a CPU-bound tool call on the tool thread pool."""
+    return await asyncio.get_running_loop().run_in_executor(_cpu_pool, functools.partial(fn, *args))
+
+async def intake_node(state: LegalAgentState):
     """
     Validates and processes the initial user request.
     """
     user_input = state['messages'][-1].content
     print(f"[Intake] Processing: {user_input}")
     
-    audit.log_step("Intake", user_input, "Initialized")
+    audit = await tools.aget("legal.audit")
+    entry = audit.log_step("Intake", user_input, "Initialized")
     
     return {
-        "input": {"request": user_input},
-        "history": [], # Initialize history
+        "input": {"request": user_input, "tenant": state.get("input", {}).get("tenant")},
+        "history": [entry],
         "next_node": "planner",
         "messages": [AIMessage(content="Request received. Starting legal workflow.", name="Intake")]
     }
 
-def planner_node(state: LegalAgentState):
+async def planner_node(state: LegalAgentState):
     """
     Decomposes the request into specific tasks.
     """
@@ -89,113 +110,110 @@ def planner_node(state: LegalAgentState):
         "compliance_rules": ["Indemnification", "Termination", "Jurisdiction"]
     }
     
-    audit.log_step("Planner", request, plan)
+    audit = await tools.aget("legal.audit")
+    entry = audit.log_step("Planner", request, plan)
     
     return {
         "intermediate": {"plan": plan},
+        "history": [entry],
         "next_node": "researcher",
         "messages": [AIMessage(content=f"Plan created: Draft {doc_type}", name="Planner")]
     }
 
-def research_node(state: LegalAgentState):
+async def research_node(state: LegalAgentState):
     """
-    Performs legal research.
+    Performs legal research: case law and statutes in one embedding and
+    retrieval batch (see LegalResearcher.aget_structured_context).
     """
     plan = state.get("intermediate", {}).get("plan", {})
     query = f"precedents for {plan.get('doc_type', 'contract')}"
     
-    context = researcher.get_structured_context(query)
+    # Embedding and index reads are awaited, not run on the event loop
+    researcher, audit = await tools.aget("legal.researcher"), await tools.aget("legal.audit")
+    context = await researcher.aget_structured_context(query, tenant=state.get("input", {}).get("tenant"))
     
-    audit.log_step("Research", query, context.get("summary")[:50])
+    entry = audit.log_step("Research", query, context.get("summary")[:50])
     
     return {
         "context": context,
+        "history": [entry],
         "next_node": "drafter",
         "messages": [AIMessage(content="Research completed.", name="Researcher")]
     }
 
-def draft_node(state: LegalAgentState):
+async def draft_node(state: LegalAgentState):
     """
     Drafts the document using the plan and context.
     """
     plan = state.get("intermediate", {}).get("plan", {})
     context = state.get('context', {})
     
-    draft = drafter.draft_document(plan.get("doc_type", "General"), context)
+    drafter, audit = await tools.aget("legal.drafter"), await tools.aget("legal.audit")
+    draft = await _cpu(drafter.draft_document, plan.get("doc_type", "General"), context)
     
-    # Merge with existing intermediate state
-    intermediate = state.get("intermediate", {}).copy()
-    intermediate['draft'] = draft
-    
-    audit.log_step("Drafting", "Context+Plan", "Draft Generated")
+    entry = audit.log_step("Drafting", "Context+Plan", "Draft Generated")
     
     return {
-        "intermediate": intermediate,
-        "next_node": "compliance",
+        "intermediate": {"draft": draft},
+        "history": [entry],
+        "next_node": "analysis",
         "messages": [AIMessage(content="Draft generated.", name="Drafter")]
     }
 
-def compliance_node(state: LegalAgentState):
+async def compliance_node(state: LegalAgentState):
     """
-    Checks the draft for compliance.
+    Checks the draft for compliance (runs in parallel with risk_node).
     """
-    intermediate = state.get("intermediate", {}).copy()
+    intermediate = state.get("intermediate", {})
     draft = intermediate.get("draft", "")
     rules = intermediate.get("plan", {}).get("compliance_rules", [])
     
-    score, missing = compliance.analyze_document(draft, rules)
-    
-    intermediate['compliance_report'] = {"score": score, "missing": missing}
+    compliance, audit = await tools.aget("legal.compliance"), await tools.aget("legal.audit")
+    score, missing = await _cpu(compliance.analyze_document, draft, rules)
     
-    metrics = state.get('metrics', {}).copy()
-    metrics['compliance'] = score
-    
-    audit.log_step("Compliance", "Draft", f"Score: {score}")
+    entry = audit.log_step("Compliance", "Draft", f"Score: {score}")
     
     return {
-        "intermediate": intermediate,
-        "metrics": metrics,
-        "next_node": "risk",
+        "intermediate": {"compliance_report": {"score": score, "missing": missing}},
+        "metrics": {"compliance": score},
+        "history": [entry],
         "messages": [AIMessage(content=f"Compliance check passed. Score: {score}", name="Compliance")]
     }
 
-def risk_node(state: LegalAgentState):
+async def risk_node(state: LegalAgentState):
     """
-    Analyzes the draft for risks.
+    Analyzes the draft for risks (runs in parallel with compliance_node).
     """
-    intermediate = state.get("intermediate", {}).copy()
-    draft = intermediate.get("draft", "")
-    
-    risk_report = risk.analyze_risk(draft)
-    intermediate['risk_report'] = risk_report
+    draft = state.get("intermediate", {}).get("draft", "")
     
-    metrics = state.get('metrics', {}).copy()
-    metrics['risk'] = risk_report['score']
+    risk, audit = await tools.aget("legal.risk"), await tools.aget("legal.audit")
+    risk_report = await _cpu(risk.analyze_risk, draft)
     
-    audit.log_step("Risk", "Draft", f"Risk Level: {risk_report['risk_level']}")
+    entry = audit.log_step("Risk", "Draft", f"Risk Level: {risk_report['risk_level']}")
     
     return {
-        "intermediate": intermediate,
-        "metrics": metrics,
-        "next_node": "evaluation",
+        "intermediate": {"risk_report": risk_report},
+        "metrics": {"risk": risk_report['score']},
+        "history": [entry],
         "messages": [AIMessage(content=f"Risk analysis complete. Level: {risk_report['risk_level']}", name="Risk")]
     }
 
-def evaluation_node(state: LegalAgentState):
+async def evaluation_node(state: LegalAgentState):
     """
     Evaluates the overall quality and decides on refinement.
     """
-    metrics = state.get('metrics', {}).copy()
+    metrics = state.get('metrics', {})
     c_score = metrics.get('compliance', 0.0)
     r_score = metrics.get('risk', 0.0)
     
-    overall = evaluator.evaluate(c_score, r_score)
-    metrics['overall'] = overall
+    evaluator, audit = await tools.aget("legal.evaluator"), await tools.aget("legal.audit")
+    overall = await _cpu(evaluator.evaluate, c_score, r_score)
     
-    audit.log_step("Evaluation", "Metrics", f"Overall: {overall}")
+    entry = audit.log_step("Evaluation", "Metrics", f"Overall: {overall}")
     
     return {
-        "metrics": metrics,
+        "metrics": {"overall": overall},
+        "history": [entry],
         "next_node": "refinement_check",
         "messages": [AIMessage(content=f"Evaluation complete. Score: {overall}", name="Evaluator")]
     }
@@ -215,25 +233,22 @@ def refinement_router(state: LegalAgentState) -> str:
             return "citation"
         return "refinement"
 
-def refinement_node(state: LegalAgentState):
+async def refinement_node(state: LegalAgentState):
     """
     Refines the draft (Mock implementation).
     """
     # In a real system, LLM refines the draft based on reports.
     # Here we just "fix" it to pass checks next time.
-    intermediate = state.get("intermediate", {}).copy()
-    current_draft = intermediate.get('draft', "")
+    current_draft = state.get("intermediate", {}).get('draft', "")
     improved_draft = current_draft + "\n[Refined: Added missing clauses and indemnification]"
     
-    intermediate['draft'] = improved_draft
-    
     return {
-        "intermediate": intermediate,
-        "next_node": "compliance", # Loop back to check
+        "intermediate": {"draft": improved_draft},
+        "next_node": "analysis", # Loop back to check
         "messages": [AIMessage(content="Refining document based on feedback.", name="Refiner")]
     }
 
-def citation_node(state: LegalAgentState):
+async def citation_node(state: LegalAgentState):
     """
     Attaches citations to the final draft.
     """
@@ -241,27 +256,29 @@ def citation_node(state: LegalAgentState):
     # For MVP, using research context as sources
     sources = state.get('context', {}).get('cases', []) + state.get('context', {}).get('statutes', [])
     
-    final_doc = citation.attach_citations(draft, sources)
+    citation, audit = await tools.aget("legal.citation"), await tools.aget("legal.audit")
+    final_doc = await _cpu(citation.attach_citations, draft, sources)
     
-    audit.log_step("Citation", "Draft", "Citations Attached")
+    entry = audit.log_step("Citation", "Draft", "Citations Attached")
     
     return {
         "output": {"document": final_doc},
+        "history": [entry],
         "next_node": "audit",
         "messages": [AIMessage(content="Citations attached.", name="Citation")]
     }
 
-def audit_node(state: LegalAgentState):
+async def audit_node(state: LegalAgentState):
     """
     Finalizes the audit log.
     """
-    # In a real system, save logs to DB
-    logs = audit.get_logs()
+    # In a real system, save logs to DB. The run's trail is already in its
+    # state: the shared logger interleaves concurrent runs
+    logs = state.get("history", [])
     
     print(f"[Audit] Workflow complete. {len(logs)} steps logged.")
     
     return {
-        "history": logs,
         "next_node": "end",
         "messages": [AIMessage(content="Workflow complete. Audit log saved.", name="Audit")]
     }
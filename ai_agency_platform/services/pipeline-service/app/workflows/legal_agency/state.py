@@ -2,6 +2,15 @@ from typing import TypedDict, Annotated, List, Dict, Any
 import operator
 from langchain_core.messages import BaseMessage
 
+
+def merge_dicts(left: Dict[str, Any], right: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Reducer for keyed state: nodes return only the keys they produce, so
+    branches running in parallel never overwrite each other's results.
+    """
+    return {**(left or {}), **(right or {})}
+
+
 class LegalAgentState(TypedDict):
     """
     Represents the state of the Legal Agency workflow.
@@ -10,20 +19,21 @@ class LegalAgentState(TypedDict):
     input: Dict[str, Any]
     
     # Retrieved knowledge (RAG output)
-    context: Dict[str, Any]
+    context: Annotated[Dict[str, Any], merge_dicts]
     
     # Intermediate step outputs (Drafts, Analysis reports)
-    intermediate: Dict[str, Any]
+    intermediate: Annotated[Dict[str, Any], merge_dicts]
     
     # Final deliverable
     output: Dict[str, Any]
     
     # Evaluation scores
-    metrics: Dict[str, float]
+    metrics: Annotated[Dict[str, float], merge_dicts]
     
-    # Audit trail
-    history: List[Dict[str, Any]]
+    # Audit trail of this run; each node appends its entries
+    history: Annotated[List[Dict[str, Any]], operator.add]
     
     # LangGraph requirements
     messages: Annotated[List[BaseMessage], operator.add]
+    # Set by the sequential steps only; parallel branches leave it alone
     next_node: str
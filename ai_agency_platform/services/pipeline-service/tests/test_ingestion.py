@@ -0,0 +1,133 @@
+import sys
+import os
+import zipfile
+
+# Add the platform root to sys.path so 'modules' is importable
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', '..')))
+
+from modules.legal.knowledge.chunker import TokenChunker, estimate_tokens
+from modules.legal.knowledge.ingestion import DocumentParser, iter_docx_paragraphs, iter_pdf_pages, iter_text_blocks
+from modules.legal.knowledge.page_cache import PageCache
+
+CONTRACT = """SERVICE AGREEMENT
+
+1. Indemnification: The Provider agrees to indemnify and hold harmless the Client from any claims. """ + "The Provider shall defend the Client at its own cost. " * 30 + """
+2. Termination: This agreement may be terminated by either party with 30 days written notice.
+3. Liability: The Provider's liability shall be limited to the fees paid.
+4. Jurisdiction: This agreement shall be governed by the laws of the State of California.
+"""
+
+
+def test_chunks_respect_token_budget_and_clauses():
+    chunker = TokenChunker(max_tokens=64, overlap_tokens=16, count_tokens=estimate_tokens)
+    chunks = chunker.split(CONTRACT)
+
+    assert all(tokens <= 64 for _, _, tokens in chunks)
+    assert all(CONTRACT[start:].startswith(text) for start, text, _ in chunks)
+    # Short clauses start their own chunk instead of being cut mid-way
+    assert any(text.startswith("2. Termination:") for _, text, _ in chunks)
+    assert any(text.startswith("4. Jurisdiction:") for _, text, _ in chunks)
+
+
+def test_long_clause_chunks_overlap():
+    chunker = TokenChunker(max_tokens=64, overlap_tokens=16, count_tokens=estimate_tokens)
+    chunks = chunker.split(CONTRACT)
+    first_end = chunks[0][0] + len(chunks[0][1])
+    assert chunks[1][0] < first_end
+
+
+def test_parser_records_chunk_stats(tmp_path):
+    path = tmp_path / "contract.txt"
+    path.write_text(CONTRACT)
+    parser = DocumentParser(chunker=TokenChunker(max_tokens=240, count_tokens=estimate_tokens))
+    chunks = parser.parse_file(str(path))
+
+    assert parser.last_stats["chunks"] == len(chunks)
+    assert parser.last_stats["baseline_chunks"] == -(-len(CONTRACT) // 1000)
+    assert "".join(chunks).count("Indemnification") == 1
+
+
+def make_pdf(path, page_texts):
+    """Writes a minimal PDF with one line of Helvetica text per page."""
+    objects = [b"<< /Type /Catalog /Pages 2 0 R >>", None, b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    kids = []
+    for text in page_texts:
+        stream = b"BT /F1 12 Tf 72 720 Td (" + text.encode("latin-1") + b") Tj ET"
+        objects.append(b"<< /Length %d >>\nstream\n%s\nendstream" % (len(stream), stream))
+        objects.append(
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>"
+            % (len(objects),)
+        )
+        kids.append(b"%d 0 R" % len(objects))
+    objects[1] = b"<< /Type /Pages /Kids [" + b" ".join(kids) + b"] /Count %d >>" % len(kids)
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n%s\nendobj\n" % (number, body)
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    out += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    path.write_bytes(bytes(out))
+
+
+def test_pdf_pages_stream_in_order_from_pool_and_cache(tmp_path):
+    path = tmp_path / "statute.pdf"
+    make_pdf(path, [f"Section {n}. Page {n} text." for n in range(1, 41)])
+    cache = PageCache(str(tmp_path / "pages"))
+
+    pages = list(iter_pdf_pages(str(path), max_workers=2, pages_per_task=8, page_cache=cache))
+    assert [number for number, _ in pages] == list(range(1, 41))
+    assert "Page 40 text" in pages[-1][1]
+    # Workers are never forked from this (threaded) process
+    from modules.legal.knowledge.ingestion import _get_pdf_pool
+    assert _get_pdf_pool(2)._mp_context.get_start_method() in ("forkserver", "spawn")
+
+    # A retry is served from the page cache without re-extracting
+    assert list(iter_pdf_pages(str(path), max_workers=1, page_cache=cache)) == pages
+    assert cache.stats()["hits"] == 1
+
+
+def test_pdf_chunks_are_tagged_with_start_page(tmp_path):
+    path = tmp_path / "statute.pdf"
+    make_pdf(path, [f"Section {n}. " + "Obligations apply. " * 20 for n in range(1, 6)])
+    parser = DocumentParser(chunker=TokenChunker(max_tokens=64, overlap_tokens=0, count_tokens=estimate_tokens), pdf_workers=1)
+
+    chunks = parser.parse_file(str(path))
+    assert chunks[0].startswith("[Page 1] Section 1.")
+    assert chunks[-1].startswith("[Page 5]")
+    assert parser.last_stats["baseline_chunks"] == 5
+    assert parser.last_stats["chunks"] == len(chunks)
+
+
+def make_docx(path, paragraphs):
+    """Writes a minimal DOCX whose body holds the given paragraphs and a one-cell table."""
+    w = 'xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main"'
+    body = "".join(f"<w:p><w:r><w:t>{text}</w:t></w:r></w:p>" for text in paragraphs)
+    body += "<w:tbl><w:tr><w:tc><w:p><w:r><w:t>Cell</w:t><w:tab/><w:t>text</w:t></w:r></w:p></w:tc></w:tr></w:tbl>"
+    with zipfile.ZipFile(path, "w") as archive:
+        archive.writestr("word/document.xml", f'<?xml version="1.0"?><w:document {w}><w:body>{body}</w:body></w:document>')
+
+
+def test_docx_paragraphs_stream_without_object_model(tmp_path):
+    path = tmp_path / "msa.docx"
+    make_docx(path, ["1. Indemnification: The Provider indemnifies.", "2. Termination: 30 days notice."])
+
+    assert list(iter_docx_paragraphs(str(path))) == [
+        "1. Indemnification: The Provider indemnifies.", "2. Termination: 30 days notice.", "Cell\ttext",
+    ]
+    chunks = DocumentParser(chunker=TokenChunker(max_tokens=240, count_tokens=estimate_tokens)).parse_file(str(path))
+    assert "2. Termination" in "".join(chunks)
+
+
+def test_text_blocks_decode_across_block_boundaries(tmp_path):
+    path = tmp_path / "export.txt"
+    text = "§ 1983 — Café clause.\r\n" * 50
+    path.write_bytes(text.encode("utf-8"))
+
+    # Tiny blocks split multi-byte characters and CR LF pairs
+    assert "".join(iter_text_blocks(str(path), block_size=7)) == text.replace("\r\n", "\n")
+    (tmp_path / "empty.txt").write_bytes(b"")
+    assert list(iter_text_blocks(str(tmp_path / "empty.txt"))) == []
@@ -0,0 +1,609 @@
+import sys
+import os
+import hashlib
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+
+# Add the platform root to sys.path so 'modules' is importable
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', '..')))
+
+import numpy as np
+import pytest
+from modules.legal.knowledge import bulk
+from modules.legal.knowledge.bulk import BulkIngestor
+from modules.legal.knowledge.embedding_backends import HashingEmbedder, benchmark, load_backend
+from modules.legal.knowledge.embedding_cache import EmbeddingCache
+from modules.legal.knowledge.embeddings import EmbeddingEngine
+from modules.legal.knowledge.index import MemmapIndex
+from modules.legal.knowledge.jobs import IngestionJobManager
+from modules.legal.knowledge.lexical import is_citation_query
+from modules.legal.knowledge.pipeline import IngestionPipeline
+from modules.legal.knowledge.result_cache import RetrievalCache
+from modules.legal.knowledge.vector_store import VectorStore, get_index
+from modules.legal.tools.research import LegalResearcher
+
+
+def fake_embedding_fn(texts):
+    """Deterministic bag-of-words embedding so tests need no model download."""
+    vectors = np.zeros((len(texts), 64), dtype=np.float32)
+    for i, text in enumerate(texts):
+        for word in text.lower().split():
+            bucket = int(hashlib.md5(word.encode()).hexdigest(), 16) % 64
+            vectors[i, bucket] += 1.0
+    return vectors
+
+
+def test_documents_shared_between_stores(tmp_path):
+    engine = EmbeddingEngine(encode_fn=fake_embedding_fn)
+    ingest_store = VectorStore(persist_directory=str(tmp_path), embedding_engine=engine)
+    research_store = VectorStore(persist_directory=str(tmp_path), embedding_engine=engine)
+    assert ingest_store.index is research_store.index
+
+    ingest_store.add_documents(
+        ["indemnification clause text", "termination with notice", "governing law of california"],
+        metadatas=[{"source": "a.txt"}, {"source": "b.txt"}, {"source": "c.txt"}],
+    )
+    results = research_store.query("termination notice", n_results=1)
+    assert results[0]["metadata"]["source"] == "b.txt"
+    assert results[0]["distance"] < 0.5
+
+
+def test_index_persists_across_reopen(tmp_path):
+    path = str(tmp_path / "collection")
+    index = MemmapIndex(path)
+    vectors = fake_embedding_fn(["alpha beta", "gamma delta"])
+    index.upsert(["a", "b"], vectors, ["alpha beta", "gamma delta"], [{}, {}])
+    index.close()
+
+    reopened = MemmapIndex(path)
+    assert reopened.count == 2
+    row, _ = reopened.search(fake_embedding_fn(["gamma"]), 1)[0][0]
+    assert reopened.get([row])[row]["id"] == "b"
+
+
+def test_upsert_overwrites_existing_id(tmp_path):
+    index = get_index("upserts", str(tmp_path))
+    index.upsert(["x"], fake_embedding_fn(["old text"]), ["old text"], [{}])
+    index.upsert(["x"], fake_embedding_fn(["new text"]), ["new text"], [{}])
+    assert index.count == 1
+    row, _ = index.search(fake_embedding_fn(["new text"]), 1)[0][0]
+    assert index.get([row])[row]["text"] == "new text"
+
+
+def test_engine_coalesces_concurrent_requests():
+    calls = []
+
+    def slow_encode(texts):
+        calls.append(len(texts))
+        time.sleep(0.01)
+        return fake_embedding_fn(texts)
+
+    engine = EmbeddingEngine(encode_fn=slow_encode, max_batch_size=16, max_workers=1)
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        results = list(pool.map(lambda i: engine.embed([f"query {i}"]), range(32)))
+
+    assert all(r.shape == (1, 64) for r in results)
+    assert np.allclose(results[5], fake_embedding_fn(["query 5"]))
+    assert len(calls) < 32
+    assert engine.stats()["texts"] == 32
+
+
+def test_cache_skips_model_for_seen_chunks(tmp_path):
+    encoded = []
+
+    def counting_encode(texts):
+        encoded.extend(texts)
+        return fake_embedding_fn(texts)
+
+    engine = EmbeddingEngine(encode_fn=counting_encode, cache=EmbeddingCache(str(tmp_path / "cache")))
+    store = VectorStore(persist_directory=str(tmp_path), embedding_engine=engine)
+    template = ["1. Confidentiality: keep it secret.", "2. Termination: 30 days notice."]
+
+    store.add_documents(template + ["Party: Acme Corp"], metadatas=[{"source": "acme.txt"}] * 3)
+    store.add_documents(template + ["Party: Globex Inc"], metadatas=[{"source": "globex.txt"}] * 3)
+    store.add_documents(template + ["Party: Acme Corp"], metadatas=[{"source": "acme.txt"}] * 3)
+
+    assert encoded == template + ["Party: Acme Corp", "Party: Globex Inc"]
+    assert store.index.count == 6
+
+    # The cache is persistent: a fresh engine on the same directory still hits
+    reopened = EmbeddingEngine(encode_fn=counting_encode, cache=EmbeddingCache(str(tmp_path / "cache")))
+    reopened.embed(template)
+    assert len(encoded) == 4
+
+
+def test_hashing_backend_is_deterministic_and_selectable(tmp_path):
+    texts = ["The Provider shall indemnify the Client.", "Payment is due within thirty days.", ""]
+    vectors = HashingEmbedder(dim=128)(texts)
+    assert vectors.shape == (3, 128)
+    assert np.allclose(np.linalg.norm(vectors[:2], axis=1), 1.0) and not vectors[2].any()
+    assert np.array_equal(vectors, HashingEmbedder(dim=128)(texts))
+
+    engine = EmbeddingEngine(backend="hashing")
+    assert engine.model_key.startswith("hashing:") and engine.embed(texts[:1]).shape[1] == 384
+    store = VectorStore(persist_directory=str(tmp_path), embedding_engine=engine)
+    store.upsert_document("msa.txt", texts[:2], {"source": "msa.txt"})
+    assert store.query("who must indemnify the client", n_results=1, mode="vector")[0]["text"] == texts[0]
+    # Same dimension, other model: the collection refuses it
+    try:
+        VectorStore(persist_directory=str(tmp_path), embedding_engine=EmbeddingEngine(encode_fn=lambda t: np.ones((len(t), 384))))
+        assert False, "index accepted another embedding model"
+    except ValueError:
+        pass
+
+    report = benchmark([f"clause {i} on topic {i % 7}" for i in range(40)], ["hashing"], "unused", "hashing", k=3, queries=5)
+    assert report["hashing"]["recall_at_3_vs_hashing"] == 1.0 and report["hashing"]["texts_per_sec"] > 0
+    try:
+        load_backend("tensorflow", "unused")
+        assert False, "unknown backend accepted"
+    except ValueError:
+        pass
+
+
+def test_cache_evicts_least_recently_used(tmp_path):
+    cache = EmbeddingCache(str(tmp_path), capacity=2)
+    cache.put_many(["a", "b"], fake_embedding_fn(["a", "b"]))
+    cache.get_many(["a"])
+    cache.put_many(["c"], fake_embedding_fn(["c"]))
+    assert set(cache.get_many(["a", "b", "c"])) == {"a", "c"}
+
+
+def test_caches_sharing_a_directory_never_share_slots(tmp_path):
+    # Two instances on one directory stand for two processes (API service, bulk CLI)
+    first, second = EmbeddingCache(str(tmp_path), capacity=3), EmbeddingCache(str(tmp_path), capacity=3)
+    first.put_many(["k1"], fake_embedding_fn(["k1"]))
+    second.put_many(["k2"], fake_embedding_fn(["k2"]))
+    first.put_many(["k3"], fake_embedding_fn(["k3"]))
+    for cache in (first, second):
+        found = cache.get_many(["k1", "k2", "k3"])
+        assert all(np.allclose(found[key], fake_embedding_fn([key])[0]) for key in ("k1", "k2", "k3"))
+
+    # Evictions by one are seen by the other: each key still maps to its own vector
+    second.put_many(["k4", "k5"], fake_embedding_fn(["k4", "k5"]))
+    keys = ["k1", "k2", "k3", "k4", "k5"]
+    found = first.get_many(keys)
+    assert len(found) == len(first) == 3 and {"k4", "k5"} <= set(found)
+    assert all(np.allclose(vector, fake_embedding_fn([key])[0]) for key, vector in found.items())
+
+
+def test_bulk_ingest_skips_bad_files(tmp_path):
+    corpus = tmp_path / "corpus"
+    (corpus / "nested").mkdir(parents=True)
+    (corpus / "nda.txt").write_text("1. Confidentiality: keep it secret.")
+    (corpus / "nested" / "msa.txt").write_text("2. Termination: 30 days notice.")
+    (corpus / "broken.pdf").write_bytes(b"not a pdf")
+
+    store = VectorStore(persist_directory=str(tmp_path / "store"), embedding_engine=EmbeddingEngine(encode_fn=fake_embedding_fn))
+    report = BulkIngestor(store=store, max_workers=2).ingest(str(corpus))
+
+    assert report["files_ingested"] == 2
+    assert [f["file"] for f in report["failures"]] == ["broken.pdf"]
+    assert store.index.count == report["chunks_added"] == 2
+
+
+
+def test_bulk_ingest_rejects_oversized_archives(tmp_path, monkeypatch):
+    archive = tmp_path / "bomb.zip"
+    with zipfile.ZipFile(archive, "w", zipfile.ZIP_DEFLATED) as zf:
+        # 3 MB of zeros compresses to a few KB
+        zf.writestr("big.txt", "0" * (3 * 1024 * 1024))
+        zf.writestr("a.txt", "1. Term: one year.")
+        zf.writestr("b.txt", "2. Fees: 100 USD.")
+
+    store = VectorStore(persist_directory=str(tmp_path / "store"), embedding_engine=EmbeddingEngine(encode_fn=fake_embedding_fn))
+    monkeypatch.setattr(bulk, "BULK_MAX_UNCOMPRESSED_MB", 2)
+    with pytest.raises(ValueError, match="expands to"):
+        BulkIngestor(store=store, max_workers=1).ingest(str(archive))
+
+    monkeypatch.setattr(bulk, "BULK_MAX_UNCOMPRESSED_MB", 4)
+    monkeypatch.setattr(bulk, "BULK_MAX_FILES", 2)
+    with pytest.raises(ValueError, match="more than the limit of 2"):
+        BulkIngestor(store=store, max_workers=1).ingest(str(archive))
+    assert store.index.count == 0
+
+def test_upsert_document_reembeds_only_changed_chunks(tmp_path):
+    encoded = []
+
+    def counting_encode(texts):
+        encoded.extend(texts)
+        return fake_embedding_fn(texts)
+
+    store = VectorStore(persist_directory=str(tmp_path), embedding_engine=EmbeddingEngine(encode_fn=counting_encode))
+    v1 = ["1. Parties: Acme and Globex.", "2. Term: one year.", "3. Fees: 100 USD."]
+    v2 = ["1. Parties: Acme and Globex.", "2. Term: two years.", "3. Fees: 100 USD.", "4. Venue: Delaware."]
+
+    first = store.upsert_document("msa", v1, {"source": "msa.txt"})
+    assert (first["version"], first["added"], first["removed"]) == (1, 3, 0)
+
+    encoded.clear()
+    second = store.upsert_document("msa", v2, {"source": "msa.txt"})
+    assert (second["version"], second["added"], second["removed"], second["unchanged"]) == (2, 2, 1, 2)
+    assert encoded == ["2. Term: two years.", "4. Venue: Delaware."]
+    assert store.index.count == 4
+    assert all("one year" not in hit["text"] for hit in store.query("Term one year", n_results=4))
+
+    unchanged = store.upsert_document("msa", v2, {"source": "msa.txt"})
+    assert (unchanged["version"], unchanged["added"], unchanged["updated"], unchanged["removed"]) == (2, 0, 0, 0)
+
+    # New metadata rewrites the unchanged chunks, partition columns included
+    retagged = store.upsert_document("msa", v2, {"source": "msa.txt", "type": "contract"})
+    assert (retagged["version"], retagged["added"], retagged["updated"], retagged["unchanged"]) == (3, 0, 4, 0)
+    assert len(store.index.filter_rows({"type": "contract"})) == 4
+    assert len(store.query("Venue Delaware", n_results=4, where={"type": "contract"})) == 4
+    assert store.delete_document("msa") == 4
+    assert store.index.count == 0
+
+
+def wait_for_job(manager, job_id, timeout=10.0):
+    deadline = time.time() + timeout
+    while manager.get(job_id).status in ("queued", "running"):
+        assert time.time() < deadline, "ingestion job did not finish"
+        time.sleep(0.01)
+    return manager.get(job_id)
+
+
+def test_job_manager_ingests_in_background_and_reports_progress(tmp_path):
+    store = VectorStore(persist_directory=str(tmp_path / "store"), embedding_engine=EmbeddingEngine(encode_fn=fake_embedding_fn))
+    manager = IngestionJobManager(max_workers=1, store=store)
+    spooled = tmp_path / "upload.txt"
+    spooled.write_text("1. Parties: Acme and Globex.\n\n2. Term: one year.\n\n3. Fees: 100 USD.")
+
+    job = manager.submit(str(spooled), "msa.txt", metadata={"source": "msa.txt", "type": "contract"}, document_id="msa")
+    assert job.to_dict()["status"] in ("queued", "running", "completed")
+    done = wait_for_job(manager, job.id).to_dict()
+    assert done["status"] == "completed" and done["document_id"] == "msa" and done["error"] is None
+    assert done["report"]["added"] == done["progress"]["chunks_indexed"] == done["progress"]["chunks_embedded"] > 0
+    assert done["started_at"] <= done["finished_at"]
+    # The spooled upload is removed once the job ends
+    assert not spooled.exists()
+    assert store.index.document_chunk_ids("msa") and [j.id for j in manager.list()] == [job.id]
+
+    broken = tmp_path / "broken.pdf"
+    broken.write_bytes(b"not a pdf")
+    failed = wait_for_job(manager, manager.submit(str(broken), "broken.pdf").id)
+    assert failed.status == "failed" and failed.error and not broken.exists()
+    assert manager.get("missing") is None
+
+
+def test_jobs_for_one_document_run_in_submission_order(tmp_path):
+    store = VectorStore(persist_directory=str(tmp_path / "store"), embedding_engine=EmbeddingEngine(encode_fn=fake_embedding_fn))
+    manager = IngestionJobManager(max_workers=2, store=store)
+    jobs = []
+    for version in range(3):
+        spooled = tmp_path / f"upload{version}.txt"
+        spooled.write_text("\n".join(f"{n}. Clause {n} of version {version}." for n in range(1, 200)))
+        jobs.append(manager.submit(str(spooled), "msa.txt", document_id="msa"))
+    other = manager.submit(str(tmp_path / "missing.txt"), "nda.txt", document_id="nda")
+
+    done = [wait_for_job(manager, job.id) for job in jobs]
+    assert all(job.status == "completed" for job in done)
+    assert done[0].finished_at <= done[1].started_at and done[1].finished_at <= done[2].started_at
+    assert wait_for_job(manager, other.id).status == "failed"
+    # Only the last version's chunks survive
+    chunks = store.index.document_chunks("msa")
+    assert chunks and all(meta["version"] == 3 for meta in chunks.values())
+    assert store.index.get_document("msa")["version"] == 3 and not manager._waiting
+
+
+def test_hybrid_and_lexical_retrieval(tmp_path):
+    store = VectorStore(persist_directory=str(tmp_path), embedding_engine=EmbeddingEngine(encode_fn=fake_embedding_fn))
+    store.add_documents(
+        [
+            "Claims under 42 U.S.C. § 1983 require state action.",
+            "The Provider shall indemnify the Client against third-party claims.",
+            "This agreement is governed by the laws of California.",
+        ],
+        metadatas=[{"source": "statute.txt"}, {"source": "msa.txt"}, {"source": "law.txt"}],
+    )
+
+    assert is_citation_query("42 U.S.C. § 1983")
+    lexical = store.query("42 U.S.C. § 1983", n_results=1, mode="lexical")
+    assert lexical[0]["metadata"]["source"] == "statute.txt"
+
+    hybrid = store.query("indemnify", n_results=2)
+    assert hybrid[0]["metadata"]["source"] == "msa.txt"
+    assert 0.0 <= hybrid[0]["distance"] <= 1.0
+
+    # Deleted chunks disappear from the inverted index too
+    store.index.delete([hybrid[0]["id"]])
+    assert store.query("indemnify", n_results=1, mode="lexical") == []
+
+
+def test_query_many_embeds_once_with_per_query_options(tmp_path):
+    calls = []
+
+    def counting_fn(texts):
+        calls.append(len(texts))
+        return fake_embedding_fn(texts)
+
+    store = VectorStore(persist_directory=str(tmp_path), embedding_engine=EmbeddingEngine(encode_fn=counting_fn))
+    store.add_documents(
+        ["indemnify the client", "terminate with notice", "indemnify the provider"],
+        metadatas=[{"source": "a.txt", "type": "contract"}, {"source": "b.txt", "type": "contract"}, {"source": "c.txt", "type": "statute"}],
+    )
+    calls.clear()
+
+    cases, statutes, exact = store.query_many([
+        {"query": "indemnify", "n_results": 3},
+        {"query": "indemnify client", "n_results": 1, "where": {"type": "statute"}},
+        {"query": "terminate", "mode": "lexical"},
+    ])
+
+    assert calls == [2]
+    assert len(cases) == 3
+    assert [r["metadata"]["source"] for r in statutes] == ["c.txt"]
+    assert exact[0]["metadata"]["source"] == "b.txt"
+    assert store.query("indemnify", n_results=1) == cases[:1]
+
+
+def test_research_cache_invalidated_by_ingestion(tmp_path):
+    store = VectorStore(persist_directory=str(tmp_path), embedding_engine=EmbeddingEngine(encode_fn=fake_embedding_fn))
+    store.add_documents(["The Provider shall indemnify the Client."], metadatas=[{"source": "msa.txt"}])
+    researcher = LegalResearcher(store=store, cache=RetrievalCache(max_entries=16, ttl_s=60))
+
+    first = researcher.get_structured_context("precedents for  NDA")
+    assert researcher.get_structured_context("Precedents for NDA")["cases"] == first["cases"]
+    assert researcher.cache_stats()["hits"] == 2
+
+    store.add_documents(["Precedents for NDA confidentiality obligations."], metadatas=[{"source": "nda.txt"}])
+    refreshed = researcher.get_structured_context("precedents for NDA")
+    stats = researcher.cache_stats()
+    assert stats["stale"] == 2 and stats["misses"] == 4
+    assert "nda.txt" in [case["case_name"] for case in refreshed["cases"]]
+
+
+def test_research_cache_is_shared_but_not_across_collections(tmp_path):
+    engine = EmbeddingEngine(encode_fn=fake_embedding_fn)
+    cache = RetrievalCache(max_entries=16, ttl_s=60)
+    stores = {}
+    for name in ("coll_a", "coll_b"):
+        stores[name] = VectorStore(collection_name=name, persist_directory=str(tmp_path), embedding_engine=engine)
+        stores[name].add_documents([f"Precedents for NDA from {name}."], metadatas=[{"source": f"{name}.txt"}])
+    assert stores["coll_a"].corpus_version == stores["coll_b"].corpus_version
+
+    for name, store in stores.items():
+        cases = LegalResearcher(store=store, cache=cache).get_structured_context("precedents for NDA")["cases"]
+        assert [case["case_name"] for case in cases] == [f"{name}.txt"]
+    assert cache.stats()["hits"] == 0
+
+
+def test_partition_filters_apply_before_search(tmp_path):
+    store = VectorStore(persist_directory=str(tmp_path), embedding_engine=EmbeddingEngine(encode_fn=fake_embedding_fn))
+    store.upsert_document("statute.txt", ["Indemnification statute text."], {"type": "statute"})
+    store.upsert_document("acme/msa.txt", ["Indemnification clause for Acme."], {"type": "contract", "tenant": "acme"})
+    store.upsert_document("globex/msa.txt", ["Indemnification clause for Globex."], {"type": "contract", "tenant": "globex"})
+
+    acme = store.index.filter_rows({"tenant": ["acme", None]})
+    assert sorted(r["metadata"].get("tenant") or "" for r in store.index.get(acme).values()) == ["", "acme"]
+
+    results = store.query("Indemnification clause", n_results=5, where={"tenant": ["acme", None]})
+    assert {r["metadata"].get("tenant") for r in results} == {"acme", None}
+    contracts = store.query("Indemnification", n_results=5, mode="lexical", where={"type": "contract", "tenant": "globex"})
+    assert [r["metadata"]["tenant"] for r in contracts] == ["globex"]
+
+    researcher = LegalResearcher(store=store, cache=RetrievalCache())
+    context = researcher.get_structured_context("Indemnification", tenant="acme")
+    assert [s["statute_name"] for s in context["statutes"]] == ["Unknown Statute"]
+    assert "globex" not in context["summary"].lower()
+
+
+def test_partition_filter_is_masked_in_the_scan(tmp_path):
+    rng = np.random.default_rng(1)
+    vectors = rng.normal(size=(3000, 32)).astype(np.float32)
+    types = ["statute", "case_law", "contract"]
+    metadatas = [{"type": types[i % 3], "tenant": "acme" if i % 5 == 0 else None} for i in range(len(vectors))]
+    ids = [f"c{i}" for i in range(len(vectors))]
+    queries = vectors[:4] + 0.1 * rng.normal(size=(4, 32)).astype(np.float32)
+    where = {"type": ["statute", "case_law"], "tenant": None}
+
+    def rows(hits):
+        return [[row for row, _ in column] for column in hits]
+
+    for quantization in (None, "int8"):
+        index = MemmapIndex(str(tmp_path / str(quantization)), quantization=quantization)
+        index.upsert(ids, vectors, [""] * len(ids), metadatas)
+        expected = [index.search(query, 5, rows=index.filter_rows(where))[0] for query in queries]
+        assert rows(index.search(queries, 5, where=where)) == rows(expected)
+        # A filter covering every partition scans as if unfiltered
+        assert index._allowed_partitions({"type": types}) is None
+        assert rows(index.search(queries, 5, where={"type": types})) == rows(index.search(queries, 5))
+        assert index.search(queries, 5, where={"tenant": "nobody"}) == [[]] * 4
+        index.close()
+
+    # Indexes written before partition codes existed are backfilled on open
+    index = MemmapIndex(str(tmp_path / "None"))
+    index._partitions[:] = -1
+    index._db.execute("DELETE FROM info WHERE key = 'partitions'")
+    index._db.commit()
+    index.close()
+    reopened = MemmapIndex(str(tmp_path / "None"))
+    expected = [reopened.search(query, 5, rows=reopened.filter_rows(where))[0] for query in queries]
+    assert rows(reopened.search(queries, 5, where=where)) == rows(expected)
+
+
+def test_quantized_search_reranks_exactly(tmp_path):
+    rng = np.random.default_rng(0)
+    vectors = rng.normal(size=(3000, 32)).astype(np.float32)
+    ids = [f"c{i}" for i in range(len(vectors))]
+
+    index = MemmapIndex(str(tmp_path / "q"), quantization="int8")
+    index.upsert(ids, vectors, [""] * len(ids), [{}] * len(ids))
+    queries = vectors[:20] + 0.1 * rng.normal(size=(20, 32)).astype(np.float32)
+    hits = index.search(queries, 5)
+    exact = index._exact(queries / np.linalg.norm(queries, axis=1, keepdims=True), 5)
+    assert hits[0][0] == exact[0][0]  # similarities come from the float32 vectors
+    assert index.recall_at_k(queries, 5)["recall_at_k"] >= 0.9
+    index.close()
+
+    # Reopening with another quantization re-encodes the stored vectors
+    binary = MemmapIndex(str(tmp_path / "q"), quantization="binary")
+    report = binary.recall_at_k(queries, 5)
+    assert report["compression"] == 32.0 and report["recall_at_k"] >= 0.5
+
+
+def test_pipeline_ingests_documents_with_stage_metrics(tmp_path):
+    store = VectorStore(persist_directory=str(tmp_path / "store"), embedding_engine=EmbeddingEngine(encode_fn=fake_embedding_fn))
+    docs = []
+    for i in range(6):
+        path = tmp_path / f"doc{i}.txt"
+        path.write_text("\n".join(f"{n}. Clause {n} of document {i}: the Provider shall perform." for n in range(1, 40)))
+        docs.append((str(path), f"doc{i}", {"source": path.name}))
+    docs.append((str(tmp_path / "missing.txt"), "missing", {"source": "missing.txt"}))
+
+    events = []
+    pipeline = IngestionPipeline(store=store, chunk_workers=2, embed_workers=2, batch_size=4, progress=lambda stage, n: events.append(stage))
+    results = pipeline.run(docs)
+
+    assert [doc.error is None for doc in results] == [True] * 6 + [False]
+    added = sum(doc.report["added"] for doc in results[:6])
+    assert added == store.index.count > 0
+    stats = pipeline.stats()
+    assert set(stats) == {"parse", "chunk", "embed", "index"}
+    assert stats["embed"]["items"] == stats["index"]["items"] == added
+    assert stats["chunk"]["max_queue_depth"] >= 1 and "utilization" in stats["index"]
+    assert "file_failed" in events
+
+    # A second run finds every chunk unchanged and embeds nothing
+    again = IngestionPipeline(store=store, batch_size=4).run(docs[:6])
+    assert all(doc.report["added"] == 0 and doc.report["unchanged"] > 0 for doc in again)
+
+
+def test_pipeline_streams_segments_from_parse_processes(tmp_path, monkeypatch):
+    import modules.legal.knowledge.pipeline as pipeline_module
+    monkeypatch.setattr(pipeline_module, "PARSE_BATCH_SEGMENTS", 1)
+    store = VectorStore(persist_directory=str(tmp_path / "store"), embedding_engine=EmbeddingEngine(encode_fn=fake_embedding_fn))
+    path = tmp_path / "msa.txt"
+    path.write_text("\n".join(f"{n}. Clause {n}: the Provider shall perform." for n in range(1, 40)))
+    docs = [(str(path), "msa", {"source": "msa.txt"}), (str(tmp_path / "missing.txt"), "missing", {"source": "missing.txt"})]
+
+    pipeline = IngestionPipeline(store=store, parse_processes=1, batch_size=4)
+    ok, missing = pipeline.run(docs)
+    assert ok.error is None and ok.report["added"] == store.index.count > 0
+    assert isinstance(missing.error, FileNotFoundError)
+    assert pipeline._manager is None and pipeline._pool is None
+
+
+def test_failed_document_leaves_no_partial_version(tmp_path, monkeypatch):
+    import modules.legal.knowledge.ingestion as ingestion
+    monkeypatch.setattr(ingestion, "TXT_BLOCK_SIZE", 256)
+    store = VectorStore(persist_directory=str(tmp_path / "store"), embedding_engine=EmbeddingEngine(encode_fn=fake_embedding_fn))
+    path = tmp_path / "msa.txt"
+    path.write_text("\n".join(f"{n}. Clause {n}: the Provider shall perform." for n in range(1, 10)))
+    [first] = IngestionPipeline(store=store, batch_size=2).run([(str(path), "msa", {"source": "msa.txt"})])
+    before = sorted(store.index.document_chunk_ids("msa"))
+
+    # The new version's early batches are indexed before its undecodable tail is reached
+    text = "\n".join(f"{n}. Revised clause {n}: the Client shall pay within {n} days." for n in range(1, 2000))
+    path.write_bytes(text.encode() + b"\n\xff\xfe")
+    [second] = IngestionPipeline(store=store, batch_size=2).run([(str(path), "msa", {"source": "msa.txt"})])
+    assert isinstance(second.error, UnicodeDecodeError) and second.report is None
+    assert sorted(store.index.document_chunk_ids("msa")) == before
+    assert store.index.count == first.report["added"] and store.index.get_document("msa")["version"] == 1
+
+
+def test_near_duplicate_chunks_collapse_into_one_row(tmp_path):
+    store = VectorStore(persist_directory=str(tmp_path), embedding_engine=EmbeddingEngine(encode_fn=fake_embedding_fn), dedup_threshold=0.8)
+    boilerplate = (
+        "Confidentiality. Each party shall hold the other party's Confidential Information in strict confidence, "
+        "shall not disclose it to any third party and shall use it solely to perform this Agreement. {}"
+    )
+    store.upsert_document("acme.txt", [boilerplate.format("Acme Corp."), "Payment is due in 30 days."], {"source": "acme.txt", "type": "contract"})
+    store.upsert_document("globex.txt", [boilerplate.format("Globex Inc."), "Payment is due in 60 days."], {"source": "globex.txt", "type": "contract"})
+    # Other partitions never collapse into each other
+    store.upsert_document("initech.txt", [boilerplate.format("Acme Corp.")], {"source": "initech.txt", "type": "contract", "tenant": "initech"})
+
+    assert store.index.count == 4
+    assert store.index.dedup_stats()["references"] == 1
+    hit = store.query("Confidential Information third party", n_results=1, where={"tenant": None})[0]
+    assert [s["source"] for s in hit["sources"]] == ["acme.txt", "globex.txt"]
+    # Metadata filters also match the chunks collapsed into a row
+    globex = store.query("Confidential Information", n_results=3, where={"source": "globex.txt"})
+    assert hit["id"] in [r["id"] for r in globex] and len(globex) == 2
+    assert store.query("Confidential", n_results=3, mode="lexical", where={"source": "globex.txt"})[0]["id"] == hit["id"]
+
+    # Removing the indexed copy hands the row, text and vector included, to the remaining source
+    assert store.delete_document("acme.txt") == 2
+    hit = store.query("Confidential Information third party", n_results=1, where={"tenant": None})[0]
+    assert [s["source"] for s in hit["sources"]] == ["globex.txt"] and store.index.count == 3
+    assert "Globex Inc." in hit["text"]
+    assert store.query(hit["text"], n_results=1, mode="vector", where={"tenant": None})[0]["distance"] < 1e-6
+    assert store.query("Acme", n_results=3, mode="lexical", where={"tenant": None}) == []
+    assert store.index.document_chunk_ids("globex.txt") and store.delete_document("globex.txt") == 2
+    assert store.index.count == 1
+
+    # A chunk moved to another partition only collapses within the new one
+    store.upsert_document("globex.txt", [boilerplate.format("Globex Inc.")], {"source": "globex.txt", "type": "contract"})
+    assert (store.index.count, store.index.dedup_stats()["references"]) == (2, 0)
+    moved = store.upsert_document("globex.txt", [boilerplate.format("Globex Inc.")], {"source": "globex.txt", "type": "contract", "tenant": "initech"})
+    assert (moved["added"], moved["updated"]) == (0, 1)
+    assert (store.index.count, store.index.dedup_stats()["references"]) == (1, 1)
+    assert store.delete_document("globex.txt") == 1
+
+    # Enabling deduplication on an existing index collapses its duplicates
+    plain = MemmapIndex(str(tmp_path / "plain"))
+    texts = [boilerplate.format(name) for name in ("A.", "B.", "C.")] + ["Unrelated venue clause."]
+    plain.upsert([f"c{i}" for i in range(4)], fake_embedding_fn(texts), texts, [{"source": f"{i}.txt"} for i in range(4)])
+    plain.close()
+    deduped = MemmapIndex(str(tmp_path / "plain"), dedup_threshold=0.8)
+    assert (deduped.count, deduped.dedup_stats()["references"]) == (2, 2)
+
+
+def test_deleted_rows_are_compacted(tmp_path, monkeypatch):
+    monkeypatch.setattr(MemmapIndex, "COMPACT_MIN_DEAD", 1)
+    store = VectorStore(persist_directory=str(tmp_path), embedding_engine=EmbeddingEngine(encode_fn=fake_embedding_fn), dedup_threshold=0.8)
+    boilerplate = (
+        "Confidentiality. Each party shall hold the other party's Confidential Information in strict confidence, "
+        "shall not disclose it to any third party and shall use it solely to perform this Agreement. {}"
+    )
+    store.upsert_document("old.txt", ["Obsolete escrow terms.", "Superseded warranty.", "Expired option.", "Lapsed lease."], {"source": "old.txt"})
+    store.upsert_document("acme.txt", [boilerplate.format("Acme Corp."), "Payment is due in 30 days."], {"source": "acme.txt", "type": "contract"})
+    store.upsert_document("initech.txt", [boilerplate.format("Initech LLC.")], {"source": "initech.txt", "type": "contract"})
+    store.upsert_document("globex.txt", ["Venue is Delaware."], {"source": "globex.txt", "type": "contract", "tenant": "globex"})
+    assert (store.index.count, store.index.dedup_stats()["references"]) == (7, 1)
+
+    # 4 of 7 rows dead: the delete compacts the index
+    store.delete_document("old.txt")
+    assert store.index._rows == store.index.count == 3
+
+    # Row numbers moved, but vectors, text, references, FTS and partition codes moved with them
+    hit = store.query("Confidential Information third party", n_results=1, where={"tenant": None})[0]
+    assert [s["source"] for s in hit["sources"]] == ["acme.txt", "initech.txt"] and "Acme Corp." in hit["text"]
+    assert store.query(hit["text"], n_results=1, mode="vector")[0]["distance"] < 1e-6
+    assert [r["id"] for r in store.query("Confidential", n_results=3, where={"source": "initech.txt"})] == [hit["id"]]
+    assert store.query("Delaware", n_results=3, mode="lexical", where={"tenant": "globex"})[0]["text"] == "Venue is Delaware."
+    assert store.query("Delaware", n_results=3, where={"tenant": None, "type": "contract"})[0]["metadata"]["source"] == "acme.txt"
+    assert store.query("Obsolete escrow", n_results=3, mode="lexical") == []
+    # Signatures were renumbered too: a new duplicate still collapses into the row
+    store.upsert_document("hooli.txt", [boilerplate.format("Hooli Inc.")], {"source": "hooli.txt", "type": "contract"})
+    assert (store.index.count, store.index.dedup_stats()["references"]) == (3, 2)
+
+    reopened = MemmapIndex(store.index.path)
+    assert reopened.count == 3 and reopened.get([0, 1, 2]) == store.index.get([0, 1, 2])
+    reopened.close()
+    assert store.index.compact() == 0
+
+
+def test_indexes_sharing_a_directory_never_overwrite_rows(tmp_path):
+    # Two instances on one directory stand for two processes (API worker, bulk CLI)
+    a, b = MemmapIndex(str(tmp_path)), MemmapIndex(str(tmp_path))
+    texts = ["x", "y", "z"]
+    vectors = fake_embedding_fn(texts)
+    a.upsert(["x"], vectors[:1], texts[:1], [{}])
+    b.upsert(["y"], vectors[1:2], texts[1:2], [{}])
+    a.upsert(["z"], vectors[2:], texts[2:], [{"tenant": "t"}])
+    assert {row: record["id"] for row, record in b.get([0, 1, 2]).items()} == {0: "x", 1: "y", 2: "z"}
+    # b sees the partition a allocated
+    assert [row for row, _ in b.search(vectors[2:], 3, where={"tenant": "t"})[0]] == [2]
+
+    # Capacity grown by one is remapped by the other
+    bulk = [f"c{i}" for i in range(MemmapIndex.MIN_CAPACITY)]
+    a.upsert(bulk, fake_embedding_fn(bulk), bulk, [{}] * len(bulk))
+    assert b.count == len(bulk) + 3
+
+    # So are the files compaction (run by b's delete) replaced, with their new row numbers
+    b.delete(bulk + ["x"])
+    assert [a.get([row])[row]["id"] for row, _ in a.search(vectors[1:2], 1)[0]] == ["y"]
+    assert a.count == 2 and a.compact() == 0
+    a.close()
+    b.close()
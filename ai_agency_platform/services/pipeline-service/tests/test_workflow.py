@@ -1,8 +1,13 @@
 import sys
 import os
+import tempfile
 
 # Add the service root directory to sys.path
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+# ... and the platform root so 'modules' is importable
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', '..')))
+# Keep the graphs' run checkpoints out of the working directory
+os.environ.setdefault("CHECKPOINT_DB", os.path.join(tempfile.mkdtemp(), "checkpoints.sqlite"))
 
 from app.core.graph import app_graph
 from langchain_core.messages import HumanMessage
@@ -30,5 +35,449 @@ def test_design_workflow():
         import traceback
         traceback.print_exc()
 
+
+def test_concurrent_legal_runs_overlap_and_keep_their_own_history(tmp_path, monkeypatch):
+    import asyncio
+    from app.workflows.legal_agency import nodes
+    from app.workflows.legal_agency.graph import legal_graph
+    from modules.legal.knowledge.embeddings import EmbeddingEngine
+    from modules.legal.knowledge.result_cache import RetrievalCache
+    from modules.legal.knowledge.vector_store import VectorStore
+    from modules.legal.tools.research import LegalResearcher
+
+    store = VectorStore(persist_directory=str(tmp_path), embedding_engine=EmbeddingEngine(backend="hashing"))
+    store.upsert_document("nda.txt", ["Precedents for NDA: the receiving party shall not disclose."], {"source": "nda.txt"})
+    researcher = LegalResearcher(store=store, cache=RetrievalCache())
+    aquery_many = store.aquery_many
+
+    in_flight = {"now": 0, "peak": 0}
+
+    async def slow_aquery_many(*args, **kwargs):
+        # Counts searches waiting at once instead of timing the runs
+        in_flight["now"] += 1
+        in_flight["peak"] = max(in_flight["peak"], in_flight["now"])
+        try:
+            await asyncio.sleep(0.2)  # stands in for a remote vector store round trip
+            return await aquery_many(*args, **kwargs)
+        finally:
+            in_flight["now"] -= 1
+
+    monkeypatch.setattr(store, "aquery_many", slow_aquery_many)
+    monkeypatch.setitem(nodes.tools.instances, "legal.researcher", researcher)
+
+    async def run_all(n):
+        runs = [
+            legal_graph.ainvoke(
+                {"input": {"tenant": None}, "messages": [HumanMessage(content=f"Draft an NDA #{i}")], "history": []},
+                {"configurable": {"thread_id": f"concurrent-{n}-{i}"}, "recursion_limit": 50},
+            )
+            for i in range(n)
+        ]
+        return await asyncio.gather(*runs)
+
+    results = asyncio.run(run_all(20))
+    assert in_flight["peak"] >= 20  # runs wait on research together
+
+    for i, result in enumerate(results):
+        steps = [entry["step"] for entry in result["history"]]
+        assert steps.count("Intake") == 1 and steps[-1] == "Citation"
+        assert f"#{i}" in result["history"][0]["input_snapshot"]
+        assert "nda.txt" in result["output"]["document"]
+
+    # Case-law and statute retrieval share one batch, so one run makes a
+    # single round trip; parallel branches' updates are merged, not overwritten
+    calls = []
+    monkeypatch.setattr(store, "aquery_many", lambda specs, **kwargs: calls.append(len(specs)) or slow_aquery_many(specs, **kwargs))
+    researcher.cache.clear()
+    result = asyncio.run(run_all(1))[0]
+    assert calls == [2]
+    assert set(result["metrics"]) == {"compliance", "risk", "overall"}
+    assert set(result["intermediate"]) == {"plan", "draft", "compliance_report", "risk_report"}
+    assert set(result["context"]) == {"query", "cases", "statutes", "summary"}
+
+
+def test_failed_legal_run_resumes_from_last_completed_node(tmp_path, monkeypatch):
+    import asyncio
+    import time
+    from langgraph.checkpoint.base import CheckpointTuple
+    from app.core.checkpoint import SqliteCheckpointer
+    from app.workflows.legal_agency import nodes
+    from app.workflows.legal_agency.graph import legal_workflow
+    from modules.legal.knowledge.embeddings import EmbeddingEngine
+    from modules.legal.knowledge.result_cache import RetrievalCache
+    from modules.legal.knowledge.vector_store import VectorStore
+    from modules.legal.tools.compliance import ComplianceAnalyzer
+    from modules.legal.tools.research import LegalResearcher
+    from modules.legal.tools.risk import RiskAnalyzer
+
+    store = VectorStore(persist_directory=str(tmp_path / "store"), embedding_engine=EmbeddingEngine(backend="hashing"))
+    store.upsert_document("nda.txt", ["Precedents for NDA: the receiving party shall not disclose."], {"source": "nda.txt"})
+    researcher = LegalResearcher(store=store, cache=RetrievalCache())
+    compliance, risk = ComplianceAnalyzer(), RiskAnalyzer()
+    calls = {"research": 0, "compliance": 0, "risk": 0}
+    get_structured_context, analyze_document, analyze_risk = researcher.aget_structured_context, compliance.analyze_document, risk.analyze_risk
+
+    async def counted_research(*args, **kwargs):
+        calls["research"] += 1
+        return await get_structured_context(*args, **kwargs)
+
+    def counted_compliance(*args, **kwargs):
+        calls["compliance"] += 1
+        return analyze_document(*args, **kwargs)
+
+    def flaky_risk(*args, **kwargs):
+        calls["risk"] += 1
+        if calls["risk"] == 1:
+            time.sleep(0.1)  # fails after the compliance branch has finished
+            raise TimeoutError("risk model timed out")
+        return analyze_risk(*args, **kwargs)
+
+    monkeypatch.setattr(researcher, "aget_structured_context", counted_research)
+    monkeypatch.setattr(compliance, "analyze_document", counted_compliance)
+    monkeypatch.setattr(risk, "analyze_risk", flaky_risk)
+    monkeypatch.setitem(nodes.tools.instances, "legal.researcher", researcher)
+    monkeypatch.setitem(nodes.tools.instances, "legal.compliance", compliance)
+    monkeypatch.setitem(nodes.tools.instances, "legal.risk", risk)
+
+    path = str(tmp_path / "checkpoints.sqlite")
+    config = {"configurable": {"thread_id": "legal-run-1"}, "recursion_limit": 50}
+    state = {"input": {"tenant": None}, "messages": [HumanMessage(content="Draft an NDA")], "history": []}
+    graph = legal_workflow.compile(checkpointer=SqliteCheckpointer(path))
+    # Compiling a graph does not open (or prune) the database; the first run does
+    assert not os.path.exists(path)
+    try:
+        asyncio.run(graph.ainvoke(state, config))
+        assert False, "the risk node should have failed"
+    except TimeoutError:
+        pass
+
+    # A new process: the failed node is next, and the compliance check that finished beside it is kept
+    checkpointer = SqliteCheckpointer(path)
+    graph = legal_workflow.compile(checkpointer=checkpointer)
+    snapshot = graph.get_state(config)
+    assert [(t.name, t.error is not None, t.result is not None) for t in snapshot.tasks] == [
+        ("compliance", False, True), ("risk", True, False)
+    ]
+    result = asyncio.run(graph.ainvoke(None, config))
+    # Research is not repeated, and only risk re-runs the failed step (the refinement loop runs both again)
+    assert calls["research"] == 1 and calls["risk"] == calls["compliance"] + 1
+    steps = [entry["step"] for entry in result["history"]]
+    assert steps.count("Intake") == 1 and steps[-1] == "Citation"
+    assert "nda.txt" in result["output"]["document"]
+
+    latest = checkpointer.get_tuple(config)
+    assert isinstance(latest, CheckpointTuple) and latest.checkpoint["channel_values"]["messages"][0].content == "Draft an NDA"
+    assert checkpointer.prune(0) == 1 and checkpointer.get_tuple(config) is None
+
+
+def test_refinement_rechecks_only_changed_clauses():
+    from modules.legal.tools.compliance import ComplianceAnalyzer
+    from modules.legal.tools.drafting import LegalDrafter
+    from modules.legal.tools.risk import RiskAnalyzer
+
+    compliance, risk = ComplianceAnalyzer(), RiskAnalyzer()
+    rules = ["Indemnification", "Termination", "Jurisdiction"]
+    draft = LegalDrafter().draft_document("NDA", {"summary": "Background."})
+    clauses = len([line for line in draft.splitlines() if line.strip()])
+
+    assert compliance.analyze_document(draft, rules) == (2 / 3, ["Indemnification"])
+    assert risk.analyze_risk(draft)["risk_level"] == "High"
+    assert compliance.cache.stats()["misses"] == risk.cache.stats()["misses"] == clauses
+
+    refined = draft + "\n[Refined: Added indemnification; the Provider shall indemnify and cap liability]"
+    assert compliance.analyze_document(refined, rules) == (1.0, [])
+    assert risk.analyze_risk(refined) == {"risk_level": "Low", "vulnerabilities": [], "score": 1.0}
+    # Only the appended clause was analyzed again
+    assert compliance.cache.stats()["misses"] == risk.cache.stats()["misses"] == clauses + 1
+
+
+def test_run_agency_stream_sends_node_events_then_result():
+    import json
+    from fastapi.testclient import TestClient
+    from app.main import app
+
+    client = TestClient(app)
+    with client.stream("POST", "/run-agency/stream", json={"prompt": "Logo for a bakery", "agency_type": "design"}) as response:
+        assert response.headers["content-type"].startswith("text/event-stream")
+        events = [
+            (block.split("\n")[0][len("event: "):], json.loads(block.split("\n")[1][len("data: "):]))
+            for block in response.read().decode().strip().split("\n\n")
+        ]
+
+    names = [name for name, _ in events]
+    assert names == ["run", "node", "node", "node", "node", "done"]
+    run_id = events[0][1]["run_id"]
+    assert [data["node"] for name, data in events if name == "node"] == ["intake", "designer", "copywriter", "review"]
+    assert events[2][1]["artifacts"]["image"]["url"]
+    assert events[-1][1]["run_id"] == run_id and events[-1][1]["output"]["review"]["status"] == "approved"
+    assert client.get(f"/runs/{run_id}").json()["status"] == "completed"
+
+
+def test_stream_disconnect_cancels_the_running_node(monkeypatch):
+    import asyncio
+    import app.main as main
+
+    log = []
+
+    class SlowGraph:
+        async def astream(self, state, config, stream_mode=None):
+            try:
+                yield {"intake": {"messages": []}}
+                log.append("node started")
+                await asyncio.sleep(60)  # a long LLM call
+                yield {"designer": {"messages": []}}
+            except asyncio.CancelledError:
+                log.append("node cancelled")
+                raise
+            finally:
+                log.append("stream closed")
+
+    monkeypatch.setitem(main.RUN_GRAPHS, "design", SlowGraph())
+
+    async def scenario():
+        events = main._stream_run("design", "design-slow", {})
+        assert (await events.__anext__()).startswith("event: run")
+        assert (await events.__anext__()).startswith("event: node")
+        # The response is cancelled when the client leaves, in the middle of a node
+        pending = asyncio.ensure_future(events.__anext__())
+        await asyncio.sleep(0.05)
+        pending.cancel()
+        try:
+            await pending
+            assert False, "cancellation swallowed"
+        except asyncio.CancelledError:
+            pass
+
+    asyncio.run(asyncio.wait_for(scenario(), 5))
+    assert log == ["node started", "node cancelled", "stream closed"]
+
+
+def test_run_cut_off_mid_node_reports_interrupted_and_resumes(monkeypatch):
+    import asyncio
+    from fastapi.testclient import TestClient
+    import app.main as main
+    from app.workflows.legal_agency import nodes
+
+    started = []
+
+    class StalledResearcher:
+        corpus_version = 0
+
+        async def aget_structured_context(self, query, tenant=None):
+            started.append(query)
+            if len(started) == 1:
+                await asyncio.sleep(60)  # the process stops during this call
+            return {"query": query, "cases": [], "statutes": [], "summary": "No findings."}
+
+    monkeypatch.setitem(nodes.tools.instances, "legal.researcher", StalledResearcher())
+    client = TestClient(main.app)
+    run_id = "legal-cut-off"
+    state = {"input": {"tenant": None}, "messages": [HumanMessage(content="Draft an NDA")], "history": []}
+
+    async def cut_off():
+        run = asyncio.ensure_future(main._invoke_run("legal", run_id, state))
+        while not started:
+            await asyncio.sleep(0.01)
+        status = client.get(f"/runs/{run_id}").json()["status"]
+        run.cancel()
+        try:
+            await run
+        except asyncio.CancelledError:
+            pass
+        return status
+
+    assert asyncio.run(cut_off()) == "running"
+    # Nothing executes it any more and no node failed: interrupted, and resumable
+    run = client.get(f"/runs/{run_id}").json()
+    assert (run["status"], run["next"]) == ("interrupted", ["researcher"])
+    assert "CITATIONS" in client.post(f"/runs/{run_id}/resume").json()["output"]["document"]
+    assert client.get(f"/runs/{run_id}").json()["status"] == "completed" and len(started) == 2
+
+
+def test_identical_runs_are_coalesced_and_cached():
+    import asyncio
+    from app.engine.executor import RunExecutor, run_key
+
+    executor = RunExecutor(max_entries=8, ttl_s=60)
+    started = []
+
+    async def run(prompt, fail=False):
+        started.append(prompt)
+        await asyncio.sleep(0.05)
+        if fail:
+            raise RuntimeError("graph failed")
+        return {"output": prompt}
+
+    async def scenario():
+        key = run_key("legal", "Draft  an NDA", None)
+        assert key == run_key("legal", "Draft an NDA ", None) != run_key("legal", "Draft an NDA", "acme")
+        first = await asyncio.gather(*[executor.execute(key, 1, lambda: run("nda")) for _ in range(5)])
+        assert [source for _, source in first] == ["run"] + ["coalesced"] * 4
+        assert all(result == {"output": "nda"} for result, _ in first)
+        assert await executor.execute(key, 1, lambda: run("nda")) == ({"output": "nda"}, "cache")
+        # New corpus version: cached result is stale
+        assert (await executor.execute(key, 2, lambda: run("nda v2")))[1] == "run"
+
+        # A failure reaches every waiter and is not cached
+        other = run_key("legal", "Draft a lease", None)
+        failed = await asyncio.gather(*[executor.execute(other, 1, lambda: run("lease", fail=True)) for _ in range(3)], return_exceptions=True)
+        assert all(isinstance(error, RuntimeError) for error in failed)
+        assert (await executor.execute(other, 1, lambda: run("lease")))[1] == "run"
+
+    asyncio.run(scenario())
+    assert started == ["nda", "nda v2", "lease", "lease"]
+    assert executor.stats()["executed"] == 4 and executor.stats()["coalesced"] == 6 and executor.stats()["in_flight"] == 0
+
+
+def test_run_agency_keeps_a_caller_supplied_run_id():
+    from fastapi.testclient import TestClient
+    from app.main import app
+
+    client = TestClient(app)
+    body = {"prompt": "Logo for a florist", "agency_type": "design"}
+    first = client.post("/run-agency", json=body).json()
+    assert client.post("/run-agency", json=body).json()["execution"] == "cache"
+    # Same request under the caller's own run id: executed on that run, never shared
+    own = client.post("/run-agency", json=dict(body, run_id="design-job-1")).json()
+    assert own["run_id"] == "design-job-1" and own["execution"] == "run" and first["run_id"] != own["run_id"]
+    assert client.get("/runs/design-job-1").json()["status"] == "completed"
+
+
+def test_tool_registry_builds_lazily_and_reports_readiness():
+    import asyncio
+    import threading
+    import time
+    from app.engine.registry import ToolRegistry
+
+    built, warmed = [], []
+
+    def slow_tool():
+        time.sleep(0.05)
+        built.append("slow")
+        return object()
+
+    registry = ToolRegistry()
+    registry.register("cheap", dict)
+    registry.register("slow", slow_tool, warm=warmed.append)
+    assert built == [] and not registry.ready
+    assert registry.status()["slow"]["state"] == "cold"
+
+    # Racing first uses build the tool once
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(registry.get("slow"))) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert built == ["slow"] and len({id(tool) for tool in results}) == 1
+    assert registry.status()["slow"]["state"] == "built" and not registry.ready
+
+    asyncio.run(registry.warm_up())
+    assert warmed == results[:1] and registry.ready
+    assert registry.status()["cheap"]["state"] == registry.status()["slow"]["state"] == "ready"
+
+
+def test_failed_warm_up_is_retried_until_ready():
+    import asyncio
+    from app.engine.registry import ToolRegistry
+
+    attempts = []
+
+    def flaky_warm(tool):
+        attempts.append(tool)
+        if len(attempts) < 3:
+            raise ConnectionError("model download timed out")
+
+    registry = ToolRegistry()
+    registry.register("cheap", dict)
+    registry.register("model", dict, warm=flaky_warm)
+    asyncio.run(registry.warm_up(retry_s=0.01))
+    assert len(attempts) == 3 and registry.ready
+    assert registry.status()["model"]["state"] == "ready" and registry.status()["model"]["error"] is None
+
+
+def test_ready_endpoint_turns_ok_after_warm_up(monkeypatch):
+    import time
+    from fastapi.testclient import TestClient
+    from app.engine.registry import ToolRegistry
+    import app.engine.registry as registry_module
+    import app.main as main
+
+    registry = ToolRegistry()
+    registry.register("legal.researcher", dict, warm=lambda tool: None)
+    monkeypatch.setattr(registry_module, "_registry", registry)
+    monkeypatch.setattr(main, "TOOL_WARMUP", True)
+
+    client = TestClient(main.app)
+    assert client.get("/ready").status_code == 503
+    with TestClient(main.app) as client:
+        # Warm-up runs in the lifespan, in the background
+        for _ in range(100):
+            if client.get("/ready").status_code == 200:
+                break
+            time.sleep(0.01)
+        assert client.get("/ready").json()["tools"]["legal.researcher"]["state"] == "ready"
+        assert client.get("/health").json() == {"status": "ok"}
+
+
+def test_ingest_endpoint_accepts_then_reports_job_progress(tmp_path, monkeypatch):
+    import time
+    from fastapi.testclient import TestClient
+    import app.main as main
+    import modules.legal.knowledge.jobs as jobs
+    from modules.legal.knowledge.embeddings import EmbeddingEngine
+    from modules.legal.knowledge.vector_store import VectorStore
+
+    store = VectorStore(persist_directory=str(tmp_path / "store"), embedding_engine=EmbeddingEngine(backend="hashing"))
+    monkeypatch.setattr(jobs, "_manager", jobs.IngestionJobManager(max_workers=1, store=store))
+    monkeypatch.setattr(main, "INGEST_TMP_DIR", str(tmp_path))
+
+    client = TestClient(main.app)
+    upload = {"file": ("nda.txt", b"Confidentiality. The receiving party shall not disclose.", "text/plain")}
+    response = client.post("/ingest", files=upload, data={"doc_type": "contract", "tenant": "acme"})
+    assert response.status_code == 202 and response.json()["status"] == "accepted"
+    job_id = response.json()["job_id"]
+
+    for _ in range(500):
+        job = client.get(f"/ingest/jobs/{job_id}").json()
+        if job["status"] not in ("queued", "running"):
+            break
+        time.sleep(0.01)
+    assert job["status"] == "completed" and job["document_id"] == "acme/nda.txt"
+    assert job["progress"]["chunks_indexed"] == job["report"]["added"] == 1
+    assert [j["job_id"] for j in client.get("/ingest/jobs").json()] == [job_id]
+    assert client.get("/ingest/jobs/missing").status_code == 404
+    assert client.post("/ingest", files={"file": ("nda.exe", b"MZ", "application/octet-stream")}).status_code == 400
+    assert client.post("/ingest", files=upload, data={"doc_type": "memo"}).status_code == 400
+    # Bulk uploads take doc_type and tenant as form fields too
+    archive = {"file": ("corpus.zip", b"PK\x05\x06" + b"\0" * 18, "application/zip")}
+    assert client.post("/ingest/bulk", files=archive, data={"doc_type": "memo"}).status_code == 400
+    # The spooled upload is gone once the job has run
+    assert [name for name in os.listdir(tmp_path) if name != "store"] == []
+
+
+def test_failed_upload_leaves_no_spooled_file(tmp_path, monkeypatch):
+    import asyncio
+    import app.main as main
+
+    class BrokenUpload:
+        def __init__(self):
+            self.reads = 0
+
+        async def read(self, size):
+            self.reads += 1
+            if self.reads > 1:
+                raise ConnectionResetError("client went away")
+            return b"x" * size
+
+    monkeypatch.setattr(main, "INGEST_TMP_DIR", str(tmp_path))
+    try:
+        asyncio.run(main._spool_upload(BrokenUpload(), ".txt"))
+        assert False, "upload error swallowed"
+    except ConnectionResetError:
+        pass
+    assert os.listdir(tmp_path) == []
+
+
 if __name__ == "__main__":
     test_design_workflow()
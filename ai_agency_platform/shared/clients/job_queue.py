@@ -0,0 +1,445 @@
+import heapq
+import itertools
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional
+
+# Queue implementation: "sqlite" (durable, shared by processes on one host)
+# or "memory" (in-process: workers must run in the same process)
+JOB_QUEUE_BACKEND = os.getenv("JOB_QUEUE_BACKEND", "sqlite")
+JOB_QUEUE_DB = os.getenv("JOB_QUEUE_DB", os.path.join(os.getcwd(), "data", "jobs.sqlite"))
+# Runs of a job before it is marked failed
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+# Delay before the first retry, doubled on every further attempt
+JOB_RETRY_DELAY_S = float(os.getenv("JOB_RETRY_DELAY_S", "2"))
+
+FINISHED = ("completed", "failed")
+
+
+class PermanentJobError(Exception):
+    """Raised by a job handler when retrying cannot help (e.g. the request was rejected): the job fails at once."""
+
+
+class QueuedJob:
+    """
+    A pipeline run in the queue. While ``running`` the job is leased to
+    ``lease_owner`` until ``lease_expires_at``; a lease that is not renewed
+    by a heartbeat expires and the job becomes visible to other workers.
+    """
+
+    def __init__(self, pipeline: str, input: Dict[str, Any], max_attempts: int, id: str = None):
+        self.id = id or uuid.uuid4().hex
+        self.pipeline = pipeline
+        self.input = input
+        self.max_attempts = max_attempts
+        self.status = "queued"
+        self.attempts = 0
+        self.output: Optional[Dict[str, Any]] = None
+        self.error: Optional[str] = None
+        self.lease_owner: Optional[str] = None
+        self.lease_expires_at: Optional[float] = None
+        self.available_at = time.time()
+        self.created_at = self.available_at
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+
+    def to_dict(self) -> Dict:
+        return {
+            "id": self.id,
+            "pipeline": self.pipeline,
+            "status": self.status,
+            "attempts": self.attempts,
+            "max_attempts": self.max_attempts,
+            "output": self.output,
+            "error": self.error,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+
+
+def retry_delay(attempts: int, base_s: float = None) -> float:
+    """Exponential backoff after the ``attempts``-th failed run."""
+    base_s = JOB_RETRY_DELAY_S if base_s is None else base_s
+    return base_s * 2 ** max(attempts - 1, 0)
+
+
+class JobQueue(ABC):
+    """
+    Work queue of pipeline jobs with leases (visibility timeouts).
+
+    Workers ``claim`` a batch of jobs, which leases them for ``visibility_s``;
+    ``heartbeat`` extends the leases of jobs still being worked on. A job
+    whose lease expires (the worker died or stalled) is handed to another
+    worker. Every claim is an attempt: failed and expired attempts are retried
+    with backoff until ``max_attempts``, then the job fails. ``complete`` and
+    ``fail`` are ignored unless the caller still holds the lease, so a worker
+    that lost a job cannot overwrite the result of the worker that took over.
+    """
+
+    @abstractmethod
+    def enqueue(self, pipeline: str, input: Dict[str, Any], max_attempts: int = None) -> QueuedJob:
+        """Adds a job, due at once."""
+
+    @abstractmethod
+    def get(self, job_id: str) -> Optional[QueuedJob]:
+        """The job, or None if it is unknown."""
+
+    @abstractmethod
+    def claim(self, worker_id: str, limit: int, visibility_s: float) -> List[QueuedJob]:
+        """Leases up to ``limit`` jobs that are due, oldest first."""
+
+    @abstractmethod
+    def heartbeat(self, worker_id: str, job_ids: List[str], visibility_s: float) -> List[str]:
+        """Extends the leases of ``job_ids``; returns the ids still held by ``worker_id``."""
+
+    @abstractmethod
+    def complete(self, worker_id: str, job_id: str, output: Dict[str, Any]) -> bool:
+        """Records the output of a job the caller still holds; False if its lease was lost."""
+
+    @abstractmethod
+    def fail(self, worker_id: str, job_id: str, error: str, retry: bool = True) -> bool:
+        """Schedules a retry with backoff, or fails the job on its last attempt (or at once without ``retry``)."""
+
+    @abstractmethod
+    def release(self, worker_id: str, job_ids: List[str]):
+        """Returns leased jobs that were never started (e.g. on shutdown) without using an attempt."""
+
+    @abstractmethod
+    def stats(self) -> Dict[str, int]:
+        """Job counts by status."""
+
+
+class InMemoryJobQueue(JobQueue):
+    """
+    Queue held in this process, for local runs and tests. Finished jobs are
+    kept (up to ``history``) so clients can poll for results.
+    """
+
+    def __init__(self, max_attempts: int = None, history: int = 1000):
+        self.max_attempts = max_attempts or JOB_MAX_ATTEMPTS
+        self.history = history
+        self._jobs: "OrderedDict[str, QueuedJob]" = OrderedDict()
+        # (available_at, sequence, job_id) of queued jobs
+        self._due: List = []
+        self._sequence = itertools.count()
+        self._running: Dict[str, QueuedJob] = {}
+        self._lock = threading.Lock()
+
+    def enqueue(self, pipeline: str, input: Dict[str, Any], max_attempts: int = None) -> QueuedJob:
+        job = QueuedJob(pipeline, input, max_attempts or self.max_attempts)
+        with self._lock:
+            self._jobs[job.id] = job
+            self._schedule(job)
+            self._trim()
+        return job
+
+    def get(self, job_id: str) -> Optional[QueuedJob]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def claim(self, worker_id: str, limit: int, visibility_s: float) -> List[QueuedJob]:
+        now = time.time()
+        claimed = []
+        with self._lock:
+            for job in [job for job in self._running.values() if job.lease_expires_at < now]:
+                self._retry_or_fail(job, "Lease expired (worker stopped sending heartbeats)", now)
+            while self._due and len(claimed) < limit and self._due[0][0] <= now:
+                job = self._jobs.get(heapq.heappop(self._due)[2])
+                if job is None or job.status != "queued":
+                    continue
+                job.status = "running"
+                job.attempts += 1
+                job.lease_owner = worker_id
+                job.lease_expires_at = now + visibility_s
+                job.started_at = job.started_at or now
+                self._running[job.id] = job
+                claimed.append(job)
+        return claimed
+
+    def heartbeat(self, worker_id: str, job_ids: List[str], visibility_s: float) -> List[str]:
+        expires_at = time.time() + visibility_s
+        held = []
+        with self._lock:
+            for job_id in job_ids:
+                job = self._running.get(job_id)
+                if job is not None and job.lease_owner == worker_id:
+                    job.lease_expires_at = expires_at
+                    held.append(job_id)
+        return held
+
+    def complete(self, worker_id: str, job_id: str, output: Dict[str, Any]) -> bool:
+        with self._lock:
+            job = self._held(worker_id, job_id)
+            if job is None:
+                return False
+            job.status, job.output, job.error = "completed", output, None
+            self._finish(job, time.time())
+            return True
+
+    def fail(self, worker_id: str, job_id: str, error: str, retry: bool = True) -> bool:
+        with self._lock:
+            job = self._held(worker_id, job_id)
+            if job is None:
+                return False
+            self._retry_or_fail(job, error, time.time(), retry)
+            return True
+
+    def release(self, worker_id: str, job_ids: List[str]):
+        with self._lock:
+            for job_id in job_ids:
+                job = self._held(worker_id, job_id)
+                if job is not None:
+                    del self._running[job.id]
+                    job.attempts -= 1
+                    job.status, job.lease_owner, job.lease_expires_at = "queued", None, None
+                    job.available_at = time.time()
+                    self._schedule(job)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            counts: Dict[str, int] = {}
+            for job in self._jobs.values():
+                counts[job.status] = counts.get(job.status, 0) + 1
+            return counts
+
+    def _held(self, worker_id: str, job_id: str) -> Optional[QueuedJob]:
+        job = self._running.get(job_id)
+        return job if job is not None and job.lease_owner == worker_id else None
+
+    def _schedule(self, job: QueuedJob):
+        heapq.heappush(self._due, (job.available_at, next(self._sequence), job.id))
+
+    def _retry_or_fail(self, job: QueuedJob, error: str, now: float, retry: bool = True):
+        del self._running[job.id]
+        job.error, job.lease_owner, job.lease_expires_at = error, None, None
+        if not retry or job.attempts >= job.max_attempts:
+            job.status = "failed"
+            self._finish(job, now)
+        else:
+            job.status = "queued"
+            job.available_at = now + retry_delay(job.attempts)
+            self._schedule(job)
+
+    def _finish(self, job: QueuedJob, now: float):
+        self._running.pop(job.id, None)
+        job.lease_owner, job.lease_expires_at, job.finished_at = None, None, now
+
+    def _trim(self):
+        while len(self._jobs) > self.history:
+            oldest_id, oldest = next(iter(self._jobs.items()))
+            if oldest.status not in FINISHED:
+                break
+            del self._jobs[oldest_id]
+
+
+class SqliteJobQueue(JobQueue):
+    """
+    Durable queue in a SQLite database (WAL mode). Any number of processes
+    on the host (the job service and every worker) can share the file: claims
+    run in IMMEDIATE transactions, so each job is leased to one worker.
+    """
+
+    COLUMNS = (
+        "id, pipeline, input, status, attempts, max_attempts, output, error, lease_owner,"
+        " lease_expires_at, available_at, created_at, started_at, finished_at"
+    )
+
+    def __init__(self, path: str = None, max_attempts: int = None):
+        self.path = path or JOB_QUEUE_DB
+        self.max_attempts = max_attempts or JOB_MAX_ATTEMPTS
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self._lock = threading.Lock()
+        # Autocommit: transactions are opened explicitly where they are needed
+        self._db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                pipeline TEXT NOT NULL,
+                input TEXT NOT NULL,
+                status TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                max_attempts INTEGER NOT NULL,
+                output TEXT,
+                error TEXT,
+                lease_owner TEXT,
+                lease_expires_at REAL,
+                available_at REAL NOT NULL,
+                created_at REAL NOT NULL,
+                started_at REAL,
+                finished_at REAL
+            );
+            CREATE INDEX IF NOT EXISTS jobs_due ON jobs (status, available_at);
+            CREATE INDEX IF NOT EXISTS jobs_leases ON jobs (status, lease_expires_at);
+            """
+        )
+
+    def enqueue(self, pipeline: str, input: Dict[str, Any], max_attempts: int = None) -> QueuedJob:
+        job = QueuedJob(pipeline, input, max_attempts or self.max_attempts)
+        with self._lock:
+            self._db.execute(
+                "INSERT INTO jobs (id, pipeline, input, status, max_attempts, available_at, created_at)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (job.id, job.pipeline, json.dumps(job.input), job.status, job.max_attempts, job.available_at, job.created_at),
+            )
+        return job
+
+    def get(self, job_id: str) -> Optional[QueuedJob]:
+        with self._lock:
+            row = self._db.execute(f"SELECT {self.COLUMNS} FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._job(row) if row else None
+
+    def claim(self, worker_id: str, limit: int, visibility_s: float) -> List[QueuedJob]:
+        now = time.time()
+
+        def claim_due():
+            expired = self._db.execute(
+                "SELECT id, attempts, max_attempts FROM jobs WHERE status = 'running' AND lease_expires_at < ?", (now,)
+            ).fetchall()
+            for job_id, attempts, max_attempts in expired:
+                self._retry_or_fail(job_id, attempts, max_attempts, "Lease expired (worker stopped sending heartbeats)", now)
+            ids = [
+                r[0] for r in self._db.execute(
+                    "SELECT id FROM jobs WHERE status = 'queued' AND available_at <= ? ORDER BY available_at, rowid LIMIT ?",
+                    (now, limit),
+                )
+            ]
+            self._db.executemany(
+                "UPDATE jobs SET status = 'running', attempts = attempts + 1, lease_owner = ?, lease_expires_at = ?,"
+                " started_at = COALESCE(started_at, ?) WHERE id = ?",
+                [(worker_id, now + visibility_s, now, job_id) for job_id in ids],
+            )
+            return self._fetch(ids)
+
+        return self._transaction(claim_due)
+
+    def heartbeat(self, worker_id: str, job_ids: List[str], visibility_s: float) -> List[str]:
+        expires_at = time.time() + visibility_s
+
+        def extend():
+            self._db.executemany(
+                "UPDATE jobs SET lease_expires_at = ? WHERE id = ? AND status = 'running' AND lease_owner = ?",
+                [(expires_at, job_id, worker_id) for job_id in job_ids],
+            )
+            return [job.id for job in self._fetch(job_ids) if job.status == "running" and job.lease_owner == worker_id]
+
+        return self._transaction(extend)
+
+    def complete(self, worker_id: str, job_id: str, output: Dict[str, Any]) -> bool:
+        with self._lock:
+            cursor = self._db.execute(
+                "UPDATE jobs SET status = 'completed', output = ?, error = NULL, lease_owner = NULL, lease_expires_at = NULL,"
+                " finished_at = ? WHERE id = ? AND status = 'running' AND lease_owner = ?",
+                (json.dumps(output), time.time(), job_id, worker_id),
+            )
+        return cursor.rowcount == 1
+
+    def fail(self, worker_id: str, job_id: str, error: str, retry: bool = True) -> bool:
+        def retry_or_fail():
+            row = self._db.execute(
+                "SELECT attempts, max_attempts FROM jobs WHERE id = ? AND status = 'running' AND lease_owner = ?",
+                (job_id, worker_id),
+            ).fetchone()
+            if row is None:
+                return False
+            self._retry_or_fail(job_id, row[0], row[1], error, time.time(), retry)
+            return True
+
+        return self._transaction(retry_or_fail)
+
+    def release(self, worker_id: str, job_ids: List[str]):
+        with self._lock:
+            self._db.executemany(
+                "UPDATE jobs SET status = 'queued', attempts = attempts - 1, lease_owner = NULL, lease_expires_at = NULL,"
+                " available_at = ? WHERE id = ? AND status = 'running' AND lease_owner = ?",
+                [(time.time(), job_id, worker_id) for job_id in job_ids],
+            )
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._db.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def _transaction(self, fn: Callable):
+        """Runs ``fn`` in an IMMEDIATE transaction (one writer across processes)."""
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                result = fn()
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+            self._db.execute("COMMIT")
+            return result
+
+    def _retry_or_fail(self, job_id: str, attempts: int, max_attempts: int, error: str, now: float, retry: bool = True):
+        """Called inside a transaction."""
+        if not retry or attempts >= max_attempts:
+            self._db.execute(
+                "UPDATE jobs SET status = 'failed', error = ?, lease_owner = NULL, lease_expires_at = NULL, finished_at = ?"
+                " WHERE id = ?",
+                (error, now, job_id),
+            )
+        else:
+            self._db.execute(
+                "UPDATE jobs SET status = 'queued', error = ?, lease_owner = NULL, lease_expires_at = NULL, available_at = ?"
+                " WHERE id = ?",
+                (error, now + retry_delay(attempts), job_id),
+            )
+
+    def _fetch(self, ids: List[str]) -> List[QueuedJob]:
+        if not ids:
+            return []
+        rows = self._db.execute(
+            f"SELECT {self.COLUMNS} FROM jobs WHERE id IN ({','.join('?' * len(ids))})", ids
+        ).fetchall()
+        order = {job_id: i for i, job_id in enumerate(ids)}
+        return sorted((self._job(row) for row in rows), key=lambda job: order[job.id])
+
+    @staticmethod
+    def _job(row) -> QueuedJob:
+        (job_id, pipeline, input, status, attempts, max_attempts, output, error, lease_owner,
+         lease_expires_at, available_at, created_at, started_at, finished_at) = row
+        job = QueuedJob(pipeline, json.loads(input), max_attempts, id=job_id)
+        job.status, job.attempts, job.error = status, attempts, error
+        job.output = json.loads(output) if output is not None else None
+        job.lease_owner, job.lease_expires_at = lease_owner, lease_expires_at
+        job.available_at, job.created_at = available_at, created_at
+        job.started_at, job.finished_at = started_at, finished_at
+        return job
+
+
+# Backend name -> factory
+BACKENDS: Dict[str, Callable[[], JobQueue]] = {
+    "sqlite": SqliteJobQueue,
+    "memory": InMemoryJobQueue,
+}
+
+_queue: Optional[JobQueue] = None
+_queue_lock = threading.Lock()
+
+
+def get_job_queue() -> JobQueue:
+    """
+    Returns the job queue of this process (backend chosen by JOB_QUEUE_BACKEND).
+    """
+    global _queue
+    if _queue is None:
+        with _queue_lock:
+            if _queue is None:
+                if JOB_QUEUE_BACKEND not in BACKENDS:
+                    raise ValueError(f"Unknown job queue backend: {JOB_QUEUE_BACKEND} (expected one of {', '.join(BACKENDS)})")
+                _queue = BACKENDS[JOB_QUEUE_BACKEND]()
+    return _queue
@@ -1,10 +1,24 @@
-from uuid import UUID
-class JobCreate:
-    pipeline: str
-    input: dict
+from typing import Any, Dict, Literal, Optional
+
+from pydantic import BaseModel, Field
+
 
+# Properties to receive via API on creation
+class JobCreate(BaseModel):
+    pipeline: Literal["legal", "design"] = Field(..., description="Pipeline to run: an agency type, 'legal' or 'design'")
+    input: Dict[str, Any] = Field(default_factory=dict, description="Pipeline input, e.g. {'prompt': ..., 'tenant': ...}")
+    max_attempts: Optional[int] = Field(None, ge=1, description="Runs before the job fails (default: the queue's)")
 
-class JobResponse:
-    id:UUID
-    status:str
-    output:dict|None
\ No newline at end of file
+
+# Properties to return via API
+class JobResponse(BaseModel):
+    id: str
+    pipeline: str
+    status: str
+    attempts: int = 0
+    max_attempts: int = 1
+    output: Optional[Dict[str, Any]] = None
+    error: Optional[str] = None
+    created_at: float
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
@@ -1,6 +1,7 @@
 import sys
 import os
 import asyncio
+import uuid
 import requests
 from langchain_core.messages import HumanMessage
 
@@ -53,7 +54,11 @@ async def verify_ingestion_and_rag():
     }
     
     try:
-        result = await legal_graph.ainvoke(initial_state, {"recursion_limit": 50})
+        result = await legal_graph.ainvoke(
+            initial_state,
+            # The graph is checkpointed: every run needs its own thread (run) id
+            {"configurable": {"thread_id": f"legal-{uuid.uuid4().hex}"}, "recursion_limit": 50},
+        )
         
         # 4. Inspect Output
         print("\n[Raw RAG Context Retrieved]")
@@ -1,6 +1,7 @@
 import sys
 import os
 import asyncio
+import uuid
 from langchain_core.messages import HumanMessage
 
 # Add the pipeline service to path
@@ -21,7 +22,11 @@ async def verify_legal_workflow():
     
     try:
         # Invoke the graph with higher recursion limit for loops
-        result = await legal_graph.ainvoke(initial_state, {"recursion_limit": 50})
+        result = await legal_graph.ainvoke(
+            initial_state,
+            # The graph is checkpointed: every run needs its own thread (run) id
+            {"configurable": {"thread_id": f"legal-{uuid.uuid4().hex}"}, "recursion_limit": 50},
+        )
         
         print("\n--- Workflow Execution Complete ---")
         
@@ -0,0 +1,69 @@
+import os
+from typing import Any, Dict
+
+import httpx
+
+from shared.clients.job_queue import PermanentJobError, QueuedJob
+
+# Pipeline service running the agency graphs
+PIPELINE_SERVICE_URL = os.getenv("PIPELINE_SERVICE_URL", "http://localhost:8002")
+# Longest a single agency run may take
+PIPELINE_TIMEOUT_S = float(os.getenv("PIPELINE_TIMEOUT_S", "600"))
+
+PIPELINES = ("legal", "design")
+
+_client: httpx.AsyncClient = None
+
+
+def _get_client() -> httpx.AsyncClient:
+    global _client
+    if _client is None:
+        _client = httpx.AsyncClient(base_url=PIPELINE_SERVICE_URL, timeout=PIPELINE_TIMEOUT_S)
+    return _client
+
+
+def run_id(job: QueuedJob) -> str:
+    """The pipeline run of a job: every attempt uses the same checkpointed run."""
+    return f"{job.pipeline}-{job.id}"
+
+
+async def run_pipeline(job: QueuedJob) -> Dict[str, Any]:
+    """
+    Runs a job's agency on the pipeline service and returns the run's result.
+    The first attempt starts the run; a retry resumes it from its last
+    checkpoint, so nodes that completed before the failure are not run again;
+    that includes runs the service reports "interrupted" (cut off by a restart).
+    A retry whose run is still in progress (e.g. the previous attempt's lease
+    expired while it kept running) fails again instead of running it twice.
+    Requests the service rejects (4xx) fail the job without retries.
+    """
+    if job.pipeline not in PIPELINES:
+        raise PermanentJobError(f"Unknown pipeline: {job.pipeline} (expected one of {', '.join(PIPELINES)})")
+    client = _get_client()
+    rid = run_id(job)
+    run = await client.get(f"/runs/{rid}") if job.attempts > 1 else None
+    if run is not None and run.status_code != 404:
+        _raise_for_status(run)
+        status = run.json()["status"]
+        if status == "running":
+            raise RuntimeError(f"Run {rid} is still in progress")
+        # Failed or interrupted: continue from the last checkpoint; completed: returns the stored result
+        response = await client.post(f"/runs/{rid}/resume")
+    else:
+        response = await client.post("/run-agency", json={
+            "prompt": job.input.get("prompt", ""),
+            "agency_type": job.pipeline,
+            "tenant": job.input.get("tenant"),
+            "run_id": rid,
+        })
+    _raise_for_status(response)
+    return response.json()
+
+
+def _raise_for_status(response: httpx.Response):
+    try:
+        response.raise_for_status()
+    except httpx.HTTPStatusError as e:
+        if 400 <= response.status_code < 500:
+            raise PermanentJobError(f"{e} {response.text}") from e
+        raise
@@ -0,0 +1,164 @@
+import asyncio
+import os
+import socket
+import sys
+import uuid
+from typing import Any, Awaitable, Callable, Dict, Optional, Set
+
+# Allow running as a script from anywhere: the platform root holds 'shared'
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
+
+from shared.clients.job_queue import JobQueue, PermanentJobError, QueuedJob, get_job_queue
+
+# Jobs run at the same time by one worker
+WORKER_CONCURRENCY = int(os.getenv("WORKER_CONCURRENCY", "4"))
+# Jobs leased ahead of the running ones, so a finished job is replaced without a queue round trip
+WORKER_PREFETCH = int(os.getenv("WORKER_PREFETCH", "4"))
+# Lease length; heartbeats renew it every third of it
+WORKER_VISIBILITY_S = float(os.getenv("WORKER_VISIBILITY_S", "60"))
+# Wait between claims while the queue is empty
+WORKER_POLL_INTERVAL_S = float(os.getenv("WORKER_POLL_INTERVAL_S", "0.5"))
+
+Handler = Callable[[QueuedJob], Awaitable[Dict[str, Any]]]
+
+
+class PipelineWorker:
+    """
+    Pulls jobs from the queue and runs them, ``concurrency`` at a time.
+
+    Up to ``concurrency + prefetch`` jobs are leased at once: the prefetched
+    ones wait in a local buffer so a slot that frees up is refilled at once.
+    A heartbeat renews the leases of every job held (running or buffered);
+    a job whose lease was lost (e.g. the worker stalled past the visibility
+    timeout) has been handed to another worker, and its result is dropped.
+    Throughput scales by running more workers against the same queue.
+    """
+
+    def __init__(
+        self,
+        handler: Handler,
+        queue: JobQueue = None,
+        concurrency: int = None,
+        prefetch: int = None,
+        visibility_s: float = None,
+        poll_interval_s: float = None,
+        worker_id: str = None,
+    ):
+        self.handler = handler
+        self.queue = queue or get_job_queue()
+        self.concurrency = concurrency or WORKER_CONCURRENCY
+        self.prefetch = WORKER_PREFETCH if prefetch is None else prefetch
+        self.visibility_s = visibility_s or WORKER_VISIBILITY_S
+        self.poll_interval_s = WORKER_POLL_INTERVAL_S if poll_interval_s is None else poll_interval_s
+        self.worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+        self.processed = 0
+        self.failed = 0
+        self._held: Set[str] = set()
+        self._buffer: "asyncio.Queue[QueuedJob]" = None
+        self._slots: asyncio.Semaphore = None
+
+    async def run(self, stop: Optional[asyncio.Event] = None):
+        """Works until ``stop`` is set; running jobs finish, buffered ones go back to the queue."""
+        stop = stop or asyncio.Event()
+        self._buffer = asyncio.Queue()
+        self._slots = asyncio.Semaphore(self.concurrency)
+        print(f"[PipelineWorker] {self.worker_id} started (concurrency={self.concurrency}, prefetch={self.prefetch})")
+        heartbeat = asyncio.create_task(self._heartbeat())
+        running: Set[asyncio.Task] = set()
+        try:
+            while not stop.is_set():
+                await self._refill()
+                if self._buffer.empty():
+                    await self._wait(stop, self.poll_interval_s)
+                    continue
+                await self._slots.acquire()
+                if stop.is_set():
+                    # Stopped while waiting for a slot: the buffered job goes back to the queue
+                    self._slots.release()
+                    break
+                job = self._buffer.get_nowait()
+                if job.id not in self._held:
+                    # Lease lost while buffered: another worker has it now
+                    self._slots.release()
+                    continue
+                task = asyncio.create_task(self._process(job))
+                running.add(task)
+                task.add_done_callback(running.discard)
+        finally:
+            buffered = []
+            while not self._buffer.empty():
+                buffered.append(self._buffer.get_nowait().id)
+            if buffered:
+                self._held.difference_update(buffered)
+                await asyncio.to_thread(self.queue.release, self.worker_id, buffered)
+            if running:
+                await asyncio.gather(*running, return_exceptions=True)
+            heartbeat.cancel()
+            print(f"[PipelineWorker] {self.worker_id} stopped ({self.processed} processed, {self.failed} failed)")
+
+    async def _refill(self):
+        wanted = self.concurrency + self.prefetch - len(self._held)
+        if wanted <= 0:
+            return
+        jobs = await asyncio.to_thread(self.queue.claim, self.worker_id, wanted, self.visibility_s)
+        for job in jobs:
+            self._held.add(job.id)
+            self._buffer.put_nowait(job)
+
+    async def _process(self, job: QueuedJob):
+        try:
+            output = await self.handler(job)
+        except Exception as e:
+            print(f"[PipelineWorker] Job {job.id} attempt {job.attempts}/{job.max_attempts} failed: {e}")
+            if job.id in self._held:
+                retry = not isinstance(e, PermanentJobError)
+                await asyncio.to_thread(self.queue.fail, self.worker_id, job.id, f"{type(e).__name__}: {e}", retry)
+            self.failed += 1
+        else:
+            if job.id not in self._held or not await asyncio.to_thread(self.queue.complete, self.worker_id, job.id, output):
+                print(f"[PipelineWorker] Job {job.id} finished after its lease expired; result dropped")
+            self.processed += 1
+        finally:
+            self._held.discard(job.id)
+            self._slots.release()
+
+    async def _heartbeat(self):
+        while True:
+            await asyncio.sleep(self.visibility_s / 3)
+            held = list(self._held)
+            if not held:
+                continue
+            try:
+                kept = set(await asyncio.to_thread(self.queue.heartbeat, self.worker_id, held, self.visibility_s))
+            except Exception as e:
+                print(f"[PipelineWorker] Heartbeat failed: {e}")
+                continue
+            lost = set(held) - kept
+            if lost:
+                print(f"[PipelineWorker] Lost the lease of {len(lost)} job(s)")
+                self._held.difference_update(lost)
+
+    @staticmethod
+    async def _wait(stop: asyncio.Event, timeout: float):
+        try:
+            await asyncio.wait_for(stop.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+
+def main():
+    import signal
+    from tasks import run_pipeline
+
+    async def serve():
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, stop.set)
+        await PipelineWorker(run_pipeline).run(stop)
+
+    asyncio.run(serve())
+
+
+if __name__ == "__main__":
+    main()